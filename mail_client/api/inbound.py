@@ -1,3 +1,4 @@
+from base64 import b64encode
 from datetime import datetime
 from email.utils import formataddr
 from typing import TYPE_CHECKING
@@ -10,6 +11,7 @@ from frappe.utils import cint, convert_utc_to_system_timezone, now
 from mail_client.api.auth import validate_mailbox, validate_user
 from mail_client.mail_client.doctype.mail_sync_history.mail_sync_history import get_mail_sync_history
 from mail_client.utils import convert_to_utc
+from mail_client.utils.message_store import decompress_body, load_compressed_message, load_message
 from mail_client.utils.validation import validate_mailbox_for_incoming
 
 if TYPE_CHECKING:
@@ -45,8 +47,9 @@ def pull_raw(
 	mailbox: str,
 	limit: int = 50,
 	last_synced_at: str | None = None,
+	compressed: bool = False,
 ) -> dict[str, list[str] | str]:
-	"""Returns the raw-emails for the given mailbox."""
+	"""Returns the raw-emails for the given mailbox, as base64 encoded zstd frames if `compressed` is set."""
 
 	validate_user()
 	validate_mailbox(mailbox)
@@ -57,7 +60,9 @@ def pull_raw(
 	source = get_source()
 	last_synced_at = convert_to_system_timezone(last_synced_at)
 	sync_history = get_mail_sync_history(source, frappe.session.user, mailbox)
-	result = get_raw_incoming_mails(mailbox, limit, last_synced_at or sync_history.last_synced_at)
+	result = get_raw_incoming_mails(
+		mailbox, limit, last_synced_at or sync_history.last_synced_at, compressed=cint(compressed)
+	)
 	update_mail_sync_history(sync_history, result["last_synced_at"], result["last_synced_mail"])
 	result["last_synced_at"] = convert_to_utc(result["last_synced_at"])
 
@@ -125,6 +130,7 @@ def get_incoming_mails(
 	for mail in mails:
 		mail.pop("processed_at")
 		mail["from"] = formataddr((mail.pop("display_name"), mail.pop("sender")))
+		mail["html"], mail["text"] = decompress_body(mail.html), decompress_body(mail.text)
 		mail["to"], mail["cc"] = get_recipients(mail)
 		mail["created_at"] = convert_to_utc(mail.created_at)
 
@@ -139,13 +145,14 @@ def get_raw_incoming_mails(
 	mailbox: str,
 	limit: int,
 	last_synced_at: str | None = None,
+	compressed: bool = False,
 ) -> dict[str, list[str] | str]:
 	"""Returns the raw incoming mails for the given mailbox."""
 
 	IM = frappe.qb.DocType("Incoming Mail")
 	query = (
 		frappe.qb.from_(IM)
-		.select(IM.processed_at, IM.name.as_("id"), IM.message)
+		.select(IM.processed_at, IM.name.as_("id"), IM.message_key, IM.message)
 		.where((IM.docstatus == 1) & (IM.receiver == mailbox))
 		.orderby(IM.processed_at)
 		.limit(limit)
@@ -155,16 +162,27 @@ def get_raw_incoming_mails(
 		query = query.where(IM.processed_at > last_synced_at)
 
 	data = query.run(as_dict=True)
-	mails = [d.message for d in data]
+
+	if compressed:
+		# Messages stored compressed are passed through as they are, without being decompressed.
+		mails = [b64encode(load_compressed_message(d.message_key, d.message)).decode() for d in data]
+	else:
+		mails = [load_message(d.message_key, d.message) for d in data]
+
 	last_synced_at = data[-1].processed_at if data else now()
 	last_synced_mail = data[-1].id if data else None
 
-	return {
+	result = {
 		"mails": mails,
 		"last_synced_at": last_synced_at,
 		"last_synced_mail": last_synced_mail,
 	}
 
+	if compressed:
+		result["compression"] = "zstd"
+
+	return result
+
 
 def update_mail_sync_history(
 	sync_history: "MailSyncHistory",
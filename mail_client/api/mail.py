@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 from frappe.translate import get_all_translations
 from frappe.utils import is_html
 
+from mail_client.utils.message_store import decompress_body
 from mail_client.utils.user import has_role, is_system_manager
 
 
@@ -130,6 +131,8 @@ def get_mail_list(mails, mail_type) -> list:
 				mails.remove(email)
 
 	for mail in mails:
+		# Decompressed only for the mails left in the list, once their threads are collapsed.
+		mail.body_html, mail.body_plain = decompress_body(mail.body_html), decompress_body(mail.body_plain)
 		mail.latest_content = get_latest_content(mail.body_html, mail.body_plain)
 		mail.snippet = get_snippet(mail.latest_content) if mail.latest_content else ""
 
@@ -290,6 +293,7 @@ def get_mail_details(name: str, type: str, include_all_details: bool = False) ->
 	]
 
 	mail = frappe.db.get_value(type, name, fields, as_dict=1)
+	mail.body_html, mail.body_plain = decompress_body(mail.body_html), decompress_body(mail.body_plain)
 	mail.mail_type = type
 
 	if not include_all_details:
@@ -4,6 +4,7 @@ import frappe
 from frappe import _
 from frappe.utils import cint
 
+from mail_client.mail_client.doctype.newsletter_campaign.newsletter_campaign import create_newsletter_campaign
 from mail_client.mail_client.doctype.outgoing_mail.outgoing_mail import create_outgoing_mail
 
 
@@ -71,6 +72,37 @@ def send_raw(
 	return doc.name
 
 
+@frappe.whitelist(methods=["POST"])
+def send_newsletter_campaign(
+	from_: str,
+	subject: str,
+	html: str,
+	recipients: str | list[str | dict],
+	reply_to: str | None = None,
+) -> str:
+	"""Send Newsletter Campaign.
+
+	The subject and HTML are Jinja templates rendered for each recipient at transfer time. A recipient is
+	either an address or a dict with `email`, `display_name` and `variables`.
+	"""
+
+	display_name, sender = parseaddr(from_)
+	recipients = frappe.parse_json(recipients)
+	if not recipients:
+		frappe.throw(_("At least one recipient is required."), frappe.MandatoryError)
+
+	doc = create_newsletter_campaign(
+		sender=sender,
+		subject=subject,
+		body_html=html,
+		recipients=recipients,
+		display_name=display_name,
+		reply_to=reply_to,
+	)
+
+	return doc.name
+
+
 # TODO: Remove
 @frappe.whitelist(methods=["POST"])
 def send_newsletter(
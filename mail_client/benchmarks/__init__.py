@@ -0,0 +1,38 @@
+import time
+import tracemalloc
+from collections.abc import Callable
+
+
+def measure(func: Callable[[], object], number: int = 10) -> float:
+	"""Returns the best time of `number` calls of the function, in milliseconds."""
+
+	best = float("inf")
+	for __ in range(number):
+		start = time.perf_counter()
+		func()
+		best = min(best, time.perf_counter() - start)
+
+	return best * 1000
+
+
+def measure_peak_memory(func: Callable[[], object]) -> float:
+	"""Returns the peak memory allocated by a call of the function, in megabytes."""
+
+	tracemalloc.start()
+	try:
+		func()
+		__, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+
+	return peak / (1024 * 1024)
+
+
+def print_results(title: str, results: dict[str, float], unit: str = "ms") -> None:
+	"""Prints the measurements, with the ratio of the first one to each of them."""
+
+	baseline = next(iter(results.values()))
+
+	print(title)
+	for name, value in results.items():
+		print(f"  {name:<24} {value:>10.2f} {unit:<2} {baseline / value:>8.1f}x")
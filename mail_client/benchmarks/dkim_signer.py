@@ -0,0 +1,82 @@
+"""Benchmarks `sign_message` against dkimpy, which signed outgoing mail before.
+
+Run with `bench --site <site> execute mail_client.benchmarks.dkim_signer.run`. dkimpy is a dev dependency.
+"""
+
+import os
+from base64 import encodebytes
+
+import frappe
+
+from mail_client.benchmarks import measure, print_results
+from mail_client.utils.dkim_signer import DKIM_HEADERS, DKIM_SELECTOR, sign_message
+
+SIZES = {"10 KB": 10 * 1024, "1 MB": 1024 * 1024, "20 MB": 20 * 1024 * 1024}
+
+
+def get_sample_message(size: int) -> bytes:
+	"""Returns a message with a text part and a base64 attachment, of about the given size."""
+
+	headers = (
+		b"From: Sender <sender@example.com>\r\n"
+		b"To: Recipient <recipient@example.org>\r\n"
+		b"Subject: Benchmark\r\n"
+		b"Date: Sun, 18 Oct 2026 10:00:00 +0000\r\n"
+		b"Message-ID: <benchmark@example.com>\r\n"
+		b"MIME-Version: 1.0\r\n"
+		b'Content-Type: multipart/mixed; boundary="b0undary"\r\n'
+		b"\r\n"
+	)
+	text = b"--b0undary\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n" + b"Hello, world.\r\n" * 64
+	attachment = encodebytes(os.urandom(size * 3 // 4)).replace(b"\n", b"\r\n")
+
+	return (
+		headers
+		+ text
+		+ b"--b0undary\r\nContent-Type: application/octet-stream\r\n"
+		+ b"Content-Transfer-Encoding: base64\r\n\r\n"
+		+ attachment
+		+ b"--b0undary--\r\n"
+	)
+
+
+def run(number: int = 5) -> None:
+	"""Prints the signing time of messages of 10 KB, 1 MB and 20 MB with dkimpy and `sign_message`."""
+
+	import dkim
+	from cryptography.hazmat.primitives import serialization
+	from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+	rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+	rsa_key_pem = rsa_key.private_bytes(
+		serialization.Encoding.PEM,
+		serialization.PrivateFormat.TraditionalOpenSSL,
+		serialization.NoEncryption(),
+	)
+	rsa_dkim_key = frappe._dict(version="benchmark", private_key=rsa_key)
+	ed25519_dkim_key = frappe._dict(version="benchmark", private_key=ed25519.Ed25519PrivateKey.generate())
+	include_headers = [header.encode() for header in DKIM_HEADERS]
+
+	for name, size in SIZES.items():
+		message = get_sample_message(size)
+
+		def _sign_with_dkimpy(message: bytes = message) -> bytes:
+			return dkim.sign(
+				message,
+				DKIM_SELECTOR.encode(),
+				b"example.com",
+				rsa_key_pem,
+				include_headers=include_headers,
+				canonicalize=(b"relaxed", b"simple"),
+			)
+
+		def _sign(dkim_key: frappe._dict, message: bytes = message) -> str:
+			return sign_message(message, "example.com", dkim_key=dkim_key)
+
+		results = {
+			"dkimpy (rsa)": measure(_sign_with_dkimpy, number),
+			"sign_message (rsa)": measure(lambda: _sign(rsa_dkim_key), number),
+			"sign_message (ed25519)": measure(lambda: _sign(ed25519_dkim_key), number),
+		}
+
+		print_results(f"{name} message", results)
@@ -0,0 +1,57 @@
+"""Benchmarks `EmailParser` against parsing the message as `str` with `message_from_string` and taking its
+size from `as_string()`, as incoming mail was processed before.
+
+Run with `bench --site <site> execute mail_client.benchmarks.email_parser.run`.
+"""
+
+from email import message_from_string
+
+from mail_client.benchmarks import measure, measure_peak_memory, print_results
+from mail_client.benchmarks.dkim_signer import SIZES, get_sample_message
+from mail_client.utils.email_parser import EmailParser
+
+
+def _parse_before(message: str) -> tuple[str, int]:
+	parsed = message_from_string(message)
+
+	body_plain = ""
+	for part in parsed.walk():
+		if part.get_content_type() == "text/plain":
+			if payload := part.get_payload(decode=True):
+				body_plain += payload.decode(part.get_content_charset() or "utf-8", "ignore")
+
+	return body_plain, len(parsed.as_string())
+
+
+def _parse(message: str) -> tuple[str, int]:
+	# Incoming messages arrive as `str`, so encoding them is part of the cost.
+	parser = EmailParser(message.encode("utf-8"))
+	__, body_plain = parser.get_body()
+
+	return body_plain, parser.get_size()
+
+
+def run(number: int = 5) -> None:
+	"""Prints the time and peak memory to parse messages of 10 KB, 1 MB and 20 MB, and get their size."""
+
+	for name, size in SIZES.items():
+		message = get_sample_message(size).decode("ascii")
+
+		if _parse(message)[0] != _parse_before(message)[0]:
+			raise AssertionError(f"Parsed bodies of the {name} message differ")
+
+		print_results(
+			f"{name} message",
+			{
+				"message_from_string": measure(lambda: _parse_before(message), number),
+				"EmailParser": measure(lambda: _parse(message), number),
+			},
+		)
+		print_results(
+			f"{name} message, peak memory",
+			{
+				"message_from_string": measure_peak_memory(lambda: _parse_before(message)),
+				"EmailParser": measure_peak_memory(lambda: _parse(message)),
+			},
+			unit="MB",
+		)
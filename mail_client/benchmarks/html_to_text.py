@@ -0,0 +1,87 @@
+"""Benchmarks `html_to_text` against BeautifulSoup's `get_text`, which `convert_html_to_text` used before.
+
+Run with `bench --site <site> execute mail_client.benchmarks.html_to_text.run`, optionally with
+`--kwargs "{'path': '/path/to/newsletters'}"` to convert a folder of `.html` files instead of generated ones.
+"""
+
+import os
+import re
+
+from mail_client.benchmarks import measure, print_results
+from mail_client.utils.html_to_text import html_to_text
+
+
+def get_sample_newsletter(sections: int = 50) -> str:
+	"""Returns a generated newsletter, laid out with nested tables and inline styles as newsletters are."""
+
+	section = """
+	<tr><td style="padding: 24px; font-family: Helvetica, Arial, sans-serif; color: #333333;">
+		<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0"><tr>
+			<td width="200" valign="top">
+				<img src="https://example.com/images/{i}.png" width="200" alt="">
+			</td>
+			<td valign="top" style="padding-left: 16px;">
+				<h2 style="margin: 0 0 8px; font-size: 20px;">Article {i} &mdash; what&rsquo;s new</h2>
+				<p style="margin: 0 0 12px; line-height: 1.5;">Lorem ipsum dolor sit amet, <b>consectetur</b>
+				adipiscing elit, sed do eiusmod tempor &amp; incididunt ut labore et dolore magna aliqua.</p>
+				<a href="https://example.com/articles/{i}?utm_source=newsletter" style="color: #0b5fff;">
+					Read more
+				</a>
+			</td>
+		</tr></table>
+	</td></tr>
+	<!-- section {i} -->
+	"""
+
+	return f"""<!DOCTYPE html>
+	<html><head><meta charset="utf-8"><title>Weekly Newsletter</title>
+	<style>body {{ margin: 0; }} @media (max-width: 600px) {{ td {{ display: block; }} }}</style></head>
+	<body><table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0">
+	{"".join(section.format(i=i) for i in range(sections))}
+	<tr><td style="font-size: 12px;">You are receiving this because you subscribed.
+	<a href="https://example.com/unsubscribe">Unsubscribe</a></td></tr>
+	</table><script>window.tracking = {{}};</script></body></html>"""
+
+
+def get_documents(path: str | None = None) -> dict[str, str]:
+	"""Returns the `.html` files in the folder, or generated newsletters of increasing size."""
+
+	if not path:
+		return {f"generated, {n} sections": get_sample_newsletter(n) for n in (10, 50, 250)}
+
+	documents = {}
+	for filename in sorted(os.listdir(path)):
+		if filename.endswith((".html", ".htm")):
+			with open(os.path.join(path, filename), encoding="utf-8", errors="replace") as f:
+				documents[filename] = f.read()
+
+	return documents
+
+
+def run(path: str | None = None, number: int = 20) -> None:
+	"""Prints the conversion time of each document, and fails if the converters disagree on its text."""
+
+	from bs4 import BeautifulSoup
+
+	def _get_text_with_bs4(html: str) -> str:
+		return re.sub(r"\s+", " ", BeautifulSoup(html, "html.parser").get_text()).strip()
+
+	parsers = ["html.parser"]
+	try:
+		import lxml  # noqa: F401
+
+		parsers.append("lxml")
+	except ImportError:
+		pass
+
+	for name, html in get_documents(path).items():
+		expected = _get_text_with_bs4(html)
+		results = {"BeautifulSoup": measure(lambda html=html: _get_text_with_bs4(html), number)}
+
+		for parser in parsers:
+			if (text := html_to_text(html, parser)) != expected:
+				raise AssertionError(f"{parser} differs from BeautifulSoup on {name}: {text[:200]!r}")
+
+			results[parser] = measure(lambda html=html, parser=parser: html_to_text(html, parser), number)
+
+		print_results(f"{name} ({len(html) / 1024:.0f} KB)", results)
@@ -0,0 +1,86 @@
+"""Benchmarks the rewriting of inline image URLs of Outgoing Mail against the previous implementation,
+which scanned the attachments for every image and replaced every match in the whole body.
+
+Run with `bench --site <site> execute mail_client.benchmarks.inline_images.run`.
+"""
+
+import re
+from urllib.parse import parse_qs, urlparse
+
+import frappe
+
+from mail_client.benchmarks import measure, print_results
+
+IMAGE_COUNTS = (10, 100, 500)
+
+
+def get_sample_mail(images: int) -> tuple[str, list[dict]]:
+	"""Returns a body referencing the given number of images by file name, and their attachments."""
+
+	attachments = [
+		frappe._dict(
+			name=f"attachment-{i}",
+			file_name=f"image-{i}.png",
+			file_url=f"/private/files/{frappe.generate_hash(length=10)}.png",
+			type="attachment",
+		)
+		for i in range(images)
+	]
+	sections = "".join(
+		f'<tr><td><img width="600" src="image-{i}.png" alt="Image {i}"><p>Caption {i}</p></td></tr>'
+		for i in range(images)
+	)
+
+	return f"<html><body><table>{sections}</table></body></html>", attachments
+
+
+def _correct_attachments_file_url_before(body_html: str, attachments: list[dict]) -> str:
+	for img_src_match in re.finditer(r'<img.*?src=[\'"](.*?)[\'"].*?>', body_html):
+		img_src = img_src_match.group(1)
+		for attachment in attachments:
+			if img_src == attachment.file_name:
+				body_html = body_html.replace(img_src, attachment.file_url)
+				break
+
+	return body_html
+
+
+def _replace_image_url_with_content_id_before(body_html: str, attachments: list[dict]) -> str:
+	for img_src_match in re.finditer(r'<img.*?src=[\'"](.*?)[\'"].*?>', body_html):
+		img_src = img_src_match.group(1)
+		field, value = "file_url", urlparse(img_src).path
+		if fid := parse_qs(urlparse(img_src).query).get("fid", [None])[0]:
+			field, value = "name", fid
+
+		for attachment in attachments:
+			if attachment[field] == value:
+				attachment.type = "inline"
+				body_html = body_html.replace(img_src, f"cid:{attachment.name}")
+				break
+
+	return body_html
+
+
+def run(number: int = 10) -> None:
+	"""Prints the time to rewrite bodies of 10, 100 and 500 images, and fails if the results differ."""
+
+	for images in IMAGE_COUNTS:
+		body_html, attachments = get_sample_mail(images)
+
+		def _rewrite_before() -> str:
+			html = _correct_attachments_file_url_before(body_html, attachments)
+			return _replace_image_url_with_content_id_before(html, attachments)
+
+		def _rewrite() -> str:
+			# A new list, as the attachments index is rebuilt whenever the list is replaced, as on load.
+			doc = frappe.new_doc("Outgoing Mail")
+			doc.body_html = body_html
+			doc.attachments = list(attachments)
+			doc._correct_attachments_file_url()
+			return doc._replace_image_url_with_content_id()
+
+		if (html := _rewrite()) != _rewrite_before():
+			raise AssertionError(f"Rewritten bodies differ for {images} images: {html[:200]!r}")
+
+		results = {"before": measure(_rewrite_before, number), "single pass": measure(_rewrite, number)}
+		print_results(f"{images} inline images ({len(body_html) / 1024:.0f} KB)", results)
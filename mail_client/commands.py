@@ -0,0 +1,26 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("migrate-mail-messages")
+@click.option("--batch-size", default=500, help="Number of messages moved per commit.")
+@pass_context
+def migrate_mail_messages(context, batch_size: int = 500) -> None:
+	"""Moves the raw messages of Outgoing Mail and Incoming Mail from the database to the message store."""
+
+	import frappe
+
+	from mail_client.utils.message_store import migrate_messages
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+
+	try:
+		total_migrated = migrate_messages(batch_size=batch_size)
+		click.echo(f"Moved {total_migrated} message(s) to the message store.")
+	finally:
+		frappe.destroy()
+
+
+commands = [migrate_mail_messages]
@@ -138,6 +138,7 @@ permission_query_conditions = {
 	"Mail Contact": "mail_client.mail_client.doctype.mail_contact.mail_contact.get_permission_query_condition",
 	"Outgoing Mail": "mail_client.mail_client.doctype.outgoing_mail.outgoing_mail.get_permission_query_condition",
 	"Incoming Mail": "mail_client.mail_client.doctype.incoming_mail.incoming_mail.get_permission_query_condition",
+	"Newsletter Campaign": "mail_client.mail_client.doctype.newsletter_campaign.newsletter_campaign.get_permission_query_condition",
 }
 
 has_permission = {
@@ -145,6 +146,7 @@ has_permission = {
 	"Mail Contact": "mail_client.mail_client.doctype.mail_contact.mail_contact.has_permission",
 	"Outgoing Mail": "mail_client.mail_client.doctype.outgoing_mail.outgoing_mail.has_permission",
 	"Incoming Mail": "mail_client.mail_client.doctype.incoming_mail.incoming_mail.has_permission",
+	"Newsletter Campaign": "mail_client.mail_client.doctype.newsletter_campaign.newsletter_campaign.has_permission",
 }
 
 website_route_rules = [
@@ -194,10 +196,12 @@ scheduler_events = {
 	"cron": {
 		"* * * * *": [
 			"mail_client.tasks.enqueue_transfer_emails_to_mail_server",
+			"mail_client.tasks.enqueue_transfer_newsletter_campaigns",
 		],
 		"*/30 * * * *": [
 			"mail_client.tasks.enqueue_fetch_emails_from_mail_server",
 			"mail_client.tasks.enqueue_fetch_and_update_delivery_statuses",
+			"mail_client.tasks.enqueue_fetch_and_update_newsletter_delivery_statuses",
 		],
 	},
 }
@@ -1,8 +1,10 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
-import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from email.utils import parseaddr
+from functools import partial
 from typing import TYPE_CHECKING
 
 import frappe
@@ -10,15 +12,28 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.query_builder import Interval
 from frappe.query_builder.functions import Now
-from frappe.utils import now, time_diff_in_seconds
+from frappe.utils import cint, get_system_timezone, now, time_diff_in_seconds
 from uuid_utils import uuid7
 
-from mail_client.mail_client.doctype.mail_contact.mail_contact import create_mail_contact
+from mail_client.mail_client.doctype.mail_contact.mail_contact import (
+	create_mail_contact,
+	create_mail_contacts,
+)
 from mail_client.mail_client.doctype.outgoing_mail.outgoing_mail import create_outgoing_mail
 from mail_client.mail_server import get_mail_server_inbound_api
 from mail_client.utils import add_or_update_tzinfo, get_in_reply_to_mail, parse_iso_datetime
+from mail_client.utils.attachment_store import delete_attachments
 from mail_client.utils.cache import get_postmaster_for_domain
 from mail_client.utils.email_parser import EmailParser, extract_ip_and_host
+from mail_client.utils.message_store import (
+	MessageStore,
+	compressed_bodies,
+	decompress_bodies,
+	delete_unreferenced_messages,
+	get_message_store,
+	load_message,
+)
+from mail_client.utils.routing import get_routing_table
 from mail_client.utils.user import get_user_mailboxes, is_mailbox_owner, is_system_manager
 
 if TYPE_CHECKING:
@@ -32,6 +47,7 @@ class IncomingMail(Document):
 	def validate(self) -> None:
 		self.validate_fetched_at()
 		self.validate_mandatory_fields()
+		self.store_message()
 		if self.get("_action") == "submit":
 			self.process()
 
@@ -44,6 +60,19 @@ class IncomingMail(Document):
 		if frappe.session.user != "Administrator":
 			frappe.throw(_("Only Administrator can delete Incoming Mail."))
 
+	def load_from_db(self) -> "IncomingMail":
+		super().load_from_db()
+		decompress_bodies(self)
+		return self
+
+	def db_insert(self, *args, **kwargs) -> None:
+		with compressed_bodies(self):
+			super().db_insert(*args, **kwargs)
+
+	def db_update(self) -> None:
+		with compressed_bodies(self):
+			super().db_update()
+
 	def validate_fetched_at(self) -> None:
 		"""Set `fetched_at` to current datetime if not set."""
 
@@ -53,16 +82,40 @@ class IncomingMail(Document):
 	def validate_mandatory_fields(self) -> None:
 		"""Validates the mandatory fields."""
 
-		mandatory_fields = ["incoming_mail_log", "message"]
+		mandatory_fields = ["incoming_mail_log"] if self.message_key else ["incoming_mail_log", "message"]
 		for field in mandatory_fields:
 			if not self.get(field):
 				field_label = frappe.get_meta(self.doctype).get_label(field)
 				frappe.throw(_("{0} is mandatory.").format(field_label))
 
+	def store_message(self) -> None:
+		"""Moves the raw message to the message store, keeping only its key on the row."""
+
+		if self.message:
+			self._message = self.message
+			self.message_key, __ = get_message_store().put(self.message.encode("utf-8"))
+			self.message = None
+
+	def get_message(self) -> str | None:
+		"""Returns the raw message, loaded from the message store on first access."""
+
+		if not hasattr(self, "_message"):
+			self._message = load_message(self.message_key, self.message)
+
+		return self._message
+
+	def get_parser(self) -> EmailParser:
+		"""Returns the parsed message, which is shared when the message is delivered to several mailboxes."""
+
+		if not getattr(self, "_parser", None):
+			self._parser = EmailParser(self.get_message())
+
+		return self._parser
+
 	def process(self) -> None:
 		"""Processes the Incoming Mail."""
 
-		parser = EmailParser(self.message)
+		parser = self.get_parser()
 		self.display_name, self.sender = parser.get_sender()
 		self.domain_name = self.receiver.split("@")[1]
 		self.subject = parser.get_subject()
@@ -75,8 +128,10 @@ class IncomingMail(Document):
 		self.in_reply_to = parser.get_in_reply_to()
 		self.in_reply_to_mail_type, self.in_reply_to_mail_name = get_in_reply_to_mail(self.in_reply_to)
 
-		parser.save_attachments(self.doctype, self.name, is_private=True)
-		self.body_html, self.body_plain = parser.get_body()
+		# Only the headers of rejected mails are used, so their body parts are never parsed nor decoded.
+		if not self.is_rejected:
+			parser.save_attachments(self.doctype, self.name, is_private=True)
+			self.body_html, self.body_plain = parser.get_body()
 
 		for recipient in parser.get_recipients():
 			self.append("recipients", recipient)
@@ -149,7 +204,7 @@ class IncomingMail(Document):
 				<div>
 					<p>Original Message Headers</p>
 					<br/><br/>
-					<code>{self.message}</code>
+					<code>{self.get_message()}</code>
 				</div>
 			</div>
 		</body>
@@ -204,15 +259,21 @@ def delete_rejected_mails() -> None:
 
 	retention_days = frappe.db.get_single_value("Mail Client Settings", "rejected_mail_retention", cache=True)
 	IM = frappe.qb.DocType("Incoming Mail")
-	(
+	mails = (
 		frappe.qb.from_(IM)
+		.select(IM.name, IM.message_key)
 		.where(
 			(IM.docstatus != 0)
 			& (IM.is_rejected == 1)
 			& (IM.processed_at < (Now() - Interval(days=retention_days)))
 		)
-		.delete()
-	).run()
+	).run(as_dict=True)
+	names = [mail.name for mail in mails]
+
+	delete_attachments("Incoming Mail", names)
+	for i in range(0, len(names), 1000):
+		frappe.qb.from_(IM).where(IM.name.isin(names[i : i + 1000])).delete().run()
+	delete_unreferenced_messages(mail.message_key for mail in mails)
 
 
 def has_permission(doc: "Document", ptype: str, user: str) -> bool:
@@ -250,15 +311,24 @@ def create_incoming_mail(
 	is_spam: int = 0,
 	is_rejected: int = 0,
 	rejection_message: str | None = None,
+	message_key: str | None = None,
+	parser: EmailParser | None = None,
 	do_not_save: bool = False,
 	do_not_submit: bool = False,
 ) -> "IncomingMail":
-	"""Creates an Incoming Mail."""
+	"""Creates an Incoming Mail.
+
+	`message_key` is the key of the message if it is already in the message store, and `parser` its parsed
+	structure, so that a message delivered to several mailboxes is stored and parsed only once.
+	"""
 
 	doc = frappe.new_doc("Incoming Mail")
 	doc.incoming_mail_log = incoming_mail_log
 	doc.receiver = receiver
-	doc.message = message
+	doc.message_key = message_key
+	doc.message = None if message_key else message
+	doc._message = message
+	doc._parser = parser
 	doc.is_spam = is_spam
 	doc.is_rejected = is_rejected
 	doc.rejection_message = rejection_message
@@ -285,94 +355,310 @@ def create_incoming_mail(
 	return doc
 
 
-def process_incoming_mail(incoming_mail_log: str, message: str, is_spam: bool) -> None:
-	"""Processes the incoming mail."""
+REJECTION_MESSAGE = "550 5.4.1 Recipient address rejected: Access denied."
+
+
+def route_incoming_mail(receiver: str, routing_table: frappe._dict) -> list[str] | None:
+	"""Returns the mailboxes the mail for the receiver is delivered to, or None if the mail is rejected.
+
+	Addresses are matched case-insensitively, and the mailboxes are returned by their names.
+	"""
+
+	receiver = receiver.lower()
+	domain_name = receiver.split("@")[1]
+	mailboxes = routing_table.mailboxes
+
+	if domain_name in routing_table.domains:
+		if alias := routing_table.aliases.get(receiver):
+			if alias.enabled:
+				return [mailboxes[m.lower()] for m in alias.mailboxes if m.lower() in mailboxes]
+		elif receiver in mailboxes:
+			return [mailboxes[receiver]]
+
+	return None
 
-	def is_active_domain(domain_name: str) -> bool:
-		"""Returns True if the domain is active, otherwise False."""
 
-		return bool(frappe.db.exists("Mail Domain", {"domain_name": domain_name, "enabled": 1}))
+def process_incoming_mail(
+	incoming_mail_log: str,
+	message: str,
+	is_spam: bool,
+	routing_table: frappe._dict | None = None,
+) -> None:
+	"""Processes the incoming mail, routing it with the in-memory routing table."""
 
-	def is_mail_alias(alias: str) -> bool:
-		"""Returns True if the mail alias exists, otherwise False."""
+	routing_table = routing_table or get_routing_table()
+
+	# Encoded, parsed and stored once, and shared by the Incoming Mail of every mailbox it is delivered to.
+	raw_message = message.encode("utf-8")
+	parser = EmailParser(raw_message)
+	message_key, __ = get_message_store().put(raw_message)
+	receiver = parser.get_header("Delivered-To")
+	mailboxes = route_incoming_mail(receiver, routing_table)
+
+	if mailboxes is None:
+		create_incoming_mail(
+			incoming_mail_log=incoming_mail_log,
+			receiver=receiver,
+			message=message,
+			is_spam=is_spam,
+			is_rejected=1,
+			rejection_message=REJECTION_MESSAGE,
+			message_key=message_key,
+			parser=parser,
+		)
+		return
+
+	for mailbox in mailboxes:
+		create_incoming_mail(
+			incoming_mail_log=incoming_mail_log,
+			receiver=mailbox,
+			message=message,
+			is_spam=is_spam,
+			message_key=message_key,
+			parser=parser,
+		)
 
-		return bool(frappe.db.exists("Mail Alias", alias))
 
-	def is_active_mailbox(mailbox: str) -> bool:
-		"""Returns True if the mailbox is active, otherwise False."""
+def prepare_incoming_mail(
+	mail: dict, routing_table: frappe._dict, message_store: MessageStore
+) -> tuple[EmailParser, str, str, list[str] | None]:
+	"""Returns the parsed message, its key in the message store, the receiver and the mailboxes to deliver to.
 
-		return bool(frappe.db.exists("Mailbox", {"email": mailbox, "enabled": 1}))
+	Only the given arguments are used, so that mails can be prepared by worker threads without a site context.
+	"""
 
-	parser = EmailParser(message)
+	raw_message = mail["message"].encode("utf-8")
+	parser = EmailParser(raw_message)
+	message_key, __ = message_store.put(raw_message)
 	receiver = parser.get_header("Delivered-To")
-	domain_name = receiver.split("@")[1]
+	mailboxes = route_incoming_mail(receiver, routing_table)
 
-	if is_active_domain(domain_name):
-		if is_mail_alias(receiver):
-			alias = frappe.get_cached_doc("Mail Alias", receiver)
-			if alias.enabled:
-				for mailbox in alias.mailboxes:
-					if is_active_mailbox(mailbox.mailbox):
-						create_incoming_mail(
-							incoming_mail_log=incoming_mail_log,
-							receiver=mailbox.mailbox,
-							message=message,
-							is_spam=is_spam,
-						)
-				return
-		elif is_active_mailbox(receiver):
-			create_incoming_mail(
-				incoming_mail_log=incoming_mail_log,
-				receiver=receiver,
-				message=message,
-				is_spam=is_spam,
-			)
-			return
-
-	create_incoming_mail(
-		incoming_mail_log=incoming_mail_log,
-		receiver=receiver,
-		message=message,
-		is_spam=is_spam,
-		is_rejected=1,
-		rejection_message="550 5.4.1 Recipient address rejected: Access denied.",
-	)
+	# Decoded up front and memoized by the parser, leaving only the database work to `process`.
+	parser.get_recipients()
+	parser.get_authentication_results()
+	if mailboxes is not None:
+		parser.get_attachments()
+		parser.get_body()
 
+	return parser, message_key, receiver, mailboxes
 
-def fetch_emails_from_mail_server() -> None:
-	"""Fetches the emails from the mail server."""
 
-	max_failures = 3
-	total_failures = 0
+def ingest_incoming_mails(
+	mails: list[dict],
+	routing_table: frappe._dict | None = None,
+	executor: ThreadPoolExecutor | None = None,
+	chunk_size: int = 20,
+) -> list[str]:
+	"""Processes a fetched batch of mails and writes them with multi-row inserts.
 
-	try:
-		while True:
-			inbound_api = get_mail_server_inbound_api()
-			last_synced_at = frappe.db.get_single_value("Mail Client Settings", "last_synced_at")
+	The documents are built and processed as on submit, but the Incoming Mail and Mail Recipient rows are
+	written with one `INSERT` per table per chunk of `chunk_size` mails, and the contacts and realtime
+	notifications are emitted once per batch instead of from `on_submit` per mail. With an `executor`, the
+	next chunk is parsed and stored by its workers while the documents of the current one are built here, so
+	that at most two chunks of parsed messages are held at a time. Returns the names of the ingested mails.
+	"""
 
-			if last_synced_at:
-				last_synced_at = add_or_update_tzinfo(last_synced_at)
+	if not mails:
+		return []
 
-			result = inbound_api.fetch(last_synced_at=last_synced_at)
+	routing_table = routing_table or get_routing_table()
+	prepare = partial(prepare_incoming_mail, routing_table=routing_table, message_store=get_message_store())
 
-			frappe.db.set_single_value(
-				"Mail Client Settings", "last_synced_at", result["last_synced_at"], update_modified=False
-			)
+	def _prepare_chunk(chunk: list[dict]) -> list[Callable]:
+		"""Returns a callable per mail of the chunk, which returns the prepared mail or raises its error."""
+
+		if executor:
+			return [executor.submit(prepare, mail).result for mail in chunk]
+
+		return [partial(prepare, mail) for mail in chunk]
 
-			if not result["mails"]:
-				break
+	existing = {
+		(mail.receiver, mail.incoming_mail_log)
+		for mail in frappe.db.get_all(
+			"Incoming Mail",
+			filters={"incoming_mail_log": ["in", [mail["incoming_mail_log"] for mail in mails]]},
+			fields=["receiver", "incoming_mail_log"],
+		)
+	}
+
+	names, contacts, receivers = [], [], {}
+	chunks = [mails[i : i + chunk_size] for i in range(0, len(mails), chunk_size)]
+	next_prepared = _prepare_chunk(chunks[0])
+
+	for i, chunk in enumerate(chunks):
+		prepared = next_prepared
+		if i + 1 < len(chunks):
+			next_prepared = _prepare_chunk(chunks[i + 1])
+
+		docs = []
+		for mail, get_prepared in zip(chunk, prepared, strict=True):
+			try:
+				parser, message_key, receiver, mailboxes = get_prepared()
+			except Exception:
+				frappe.log_error(
+					title="Create Incoming Mail", message=frappe.get_traceback(with_context=True)
+				)
+				continue
+
+			deliveries = [(receiver, 1)] if mailboxes is None else [(mailbox, 0) for mailbox in mailboxes]
+			for receiver, is_rejected in deliveries:
+				if (receiver, mail["incoming_mail_log"]) in existing:
+					frappe.log_error(
+						title="Duplicate Incoming Mail",
+						message=_("Incoming Mail Log {0} is already delivered to {1}.").format(
+							mail["incoming_mail_log"], receiver
+						),
+					)
+					continue
+
+				existing.add((receiver, mail["incoming_mail_log"]))
+
+				try:
+					doc = create_incoming_mail(
+						incoming_mail_log=mail["incoming_mail_log"],
+						receiver=receiver,
+						message=mail["message"],
+						is_spam=mail["is_spam"],
+						is_rejected=is_rejected,
+						rejection_message=REJECTION_MESSAGE if is_rejected else None,
+						message_key=message_key,
+						parser=parser,
+						do_not_save=True,
+					)
+					doc.autoname()
+					doc.docstatus = 1
+					doc.validate_fetched_at()
+					doc.process()
+					validate_for_bulk_insert(doc)
+				except Exception:
+					frappe.log_error(
+						title="Create Incoming Mail", message=frappe.get_traceback(with_context=True)
+					)
+					continue
+
+				docs.append(doc)
+
+		bulk_insert_docs(docs)
+
+		for doc in docs:
+			names.append(doc.name)
+
+			if doc.is_rejected:
+				doc.send_reject_notification()
+				continue
+
+			if frappe.get_cached_value("Mailbox", doc.receiver, "create_mail_contact"):
+				user = frappe.get_cached_value("Mailbox", doc.receiver, "user")
+				contacts.append((user, doc.sender, doc.display_name))
+
+			receivers.setdefault(doc.receiver, []).append(doc.name)
+
+	create_mail_contacts(contacts)
+
+	for receiver, mail_names in receivers.items():
+		frappe.publish_realtime(
+			"incoming_mail_received", {"mails": mail_names}, user=receiver, after_commit=True
+		)
+
+	return names
+
+
+def validate_for_bulk_insert(doc: "Document") -> None:
+	"""Validates the document and its child rows as `insert` would, as `bulk_insert_docs` writes them as is.
+
+	Data values longer than their column, which headers of received mail can be, are truncated rather than
+	rejected, except for email addresses. A row that still fails the validation would fail the whole chunk.
+	"""
+
+	for d in [doc, *doc.get_all_children()]:
+		for df in d.meta.get("fields", {"fieldtype": "Data"}):
+			value = d.get(df.fieldname)
+			max_length = cint(df.get("length")) or frappe.db.VARCHAR_LEN
+
+			if isinstance(value, str) and len(value) > max_length and df.options != "Email":
+				d.set(df.fieldname, value[:max_length])
+
+		d._validate_length()
+		d._validate_selects()
+
+	doc._validate_mandatory()
 
-			for mail in result["mails"]:
-				process_incoming_mail(mail["incoming_mail_log"], mail["message"], mail["is_spam"])
+
+def bulk_insert_docs(docs: list["Document"]) -> None:
+	"""Inserts the new documents and their child rows with one multi-row `INSERT` per table."""
+
+	user, timestamp = frappe.session.user, now()
+	rows = {}
+
+	for doc in docs:
+		with compressed_bodies(doc):
+			for d in [doc, *doc.get_all_children()]:
+				d.name = d.name or str(uuid7())
+				d.docstatus = doc.docstatus
+				d.creation = d.modified = timestamp
+				d.owner = d.modified_by = user
+				rows.setdefault(d.doctype, []).append(d.get_valid_dict(convert_dates_to_str=True))
+
+	for doctype, values in rows.items():
+		fields = list(values[0])
+		frappe.db.bulk_insert(doctype, fields, [tuple(row.get(f) for f in fields) for row in values])
+
+
+def fetch_emails_from_mail_server() -> None:
+	"""Fetches the emails from the mail server.
+
+	Pages are fetched one ahead: while a page is parsed and stored by a pool of workers and written from this
+	thread, the next one is fetched in the background from the `last_synced_at` the page ended at. The
+	checkpoint is committed with the mails of its page, in page order, so that a failure at any point resumes
+	from the first page that was not ingested.
+	"""
+
+	inbound_workers = max(
+		cint(frappe.db.get_single_value("Mail Client Settings", "inbound_workers", cache=True)), 1
+	)
+
+	try:
+		# Resolved up front, as the fetches run in a thread without a site context.
+		inbound_api = get_mail_server_inbound_api()
+		timezone = get_system_timezone()
+		last_synced_at = frappe.db.get_single_value("Mail Client Settings", "last_synced_at")
+
+		if last_synced_at:
+			last_synced_at = add_or_update_tzinfo(last_synced_at, timezone)
+
+		with (
+			ThreadPoolExecutor(max_workers=1) as fetcher,
+			ThreadPoolExecutor(max_workers=inbound_workers) as executor,
+		):
+			next_page = fetcher.submit(inbound_api.fetch, last_synced_at=last_synced_at, timezone=timezone)
+
+			while True:
+				result = next_page.result()
+
+				if result["mails"]:
+					next_page = fetcher.submit(
+						inbound_api.fetch,
+						last_synced_at=add_or_update_tzinfo(result["last_synced_at"], timezone),
+						timezone=timezone,
+					)
+					# Chunks of a few mails per worker keep the workers busy without holding the whole page.
+					ingest_incoming_mails(result["mails"], executor=executor, chunk_size=inbound_workers * 4)
+
+				frappe.db.set_single_value(
+					"Mail Client Settings", "last_synced_at", result["last_synced_at"], update_modified=False
+				)
+				frappe.db.commit()
+
+				if not result["mails"]:
+					break
 
 	except Exception:
-		total_failures += 1
+		# Nothing of the failed page is kept, as its checkpoint was not moved past it. No in-process retry,
+		# the next scheduled run resumes from the checkpoint.
+		frappe.db.rollback()
 		error_log = frappe.get_traceback(with_context=False)
 		frappe.log_error(title="Fetch Emails from Mail Server", message=error_log)
 
-		if total_failures < max_failures:
-			time.sleep(2**total_failures)
-
 
 def on_doctype_update() -> None:
 	frappe.db.add_unique(
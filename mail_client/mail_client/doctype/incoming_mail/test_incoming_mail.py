@@ -1,9 +1,53 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import frappe
+from frappe.model.document import Document
 from frappe.tests.utils import FrappeTestCase
 
+from mail_client.mail_client.doctype.incoming_mail.incoming_mail import (
+	bulk_insert_docs,
+	validate_for_bulk_insert,
+)
+
 
 class TestIncomingMail(FrappeTestCase):
 	pass
+
+
+class TestIncomingMailBulkInsert(FrappeTestCase):
+	def get_doc(self, **kwargs) -> Document:
+		"""Returns a processed Incoming Mail, as `ingest_incoming_mails` builds it before the bulk insert."""
+
+		doc = frappe.new_doc("Incoming Mail")
+		doc.update(
+			{
+				"incoming_mail_log": frappe.generate_hash(length=10),
+				"receiver": "receiver@example.com",
+				"sender": "sender@example.com",
+				"status": "Accepted",
+				"folder": "Inbox",
+				"docstatus": 1,
+				**kwargs,
+			}
+		)
+		doc.append("recipients", {"type": "To", "email": "receiver@example.com", "display_name": "x" * 200})
+		doc.autoname()
+
+		return doc
+
+	def test_long_display_name(self):
+		doc = self.get_doc(display_name="a" * 200)
+
+		validate_for_bulk_insert(doc)
+		bulk_insert_docs([doc])
+
+		self.assertEqual(frappe.db.get_value("Incoming Mail", doc.name, "display_name"), "a" * 140)
+		self.assertEqual(
+			frappe.db.get_value("Mail Recipient", {"parent": doc.name}, "display_name"), "x" * 140
+		)
+
+	def test_long_email_address(self):
+		doc = self.get_doc(sender=f"{'a' * 200}@example.com")
+
+		self.assertRaises(frappe.CharacterLengthExceededError, validate_for_bulk_insert, doc)
@@ -5,6 +5,7 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from mail_client.utils.routing import invalidate_routing_table
 from mail_client.utils.validation import (
 	is_valid_email_for_domain,
 	validate_domain_is_enabled_and_verified,
@@ -22,6 +23,12 @@ class MailAlias(Document):
 		self.validate_alias()
 		self.validate_mailboxes()
 
+	def on_update(self) -> None:
+		invalidate_routing_table()
+
+	def on_trash(self) -> None:
+		invalidate_routing_table()
+
 	def validate_domain(self) -> None:
 		"""Validates the domain."""
 
@@ -15,6 +15,9 @@ class MailClientSettings(Document):
 		self.validate_mail_server()
 		self.validate_outgoing_max_attachment_size()
 		self.validate_outgoing_total_attachments_size()
+		self.validate_transfer_workers()
+		self.validate_transfer_jobs()
+		self.validate_inbound_workers()
 
 	def validate_mail_server(self) -> None:
 		"""Validates the Mail Server."""
@@ -48,6 +51,24 @@ class MailClientSettings(Document):
 				)
 			)
 
+	def validate_transfer_workers(self) -> None:
+		"""Validates the Transfer Workers."""
+
+		if self.transfer_workers < 1:
+			frappe.throw(_("{0} must be greater than 0.").format(frappe.bold("Transfer Workers")))
+
+	def validate_transfer_jobs(self) -> None:
+		"""Validates the Transfer Jobs."""
+
+		if self.transfer_jobs < 1:
+			frappe.throw(_("{0} must be greater than 0.").format(frappe.bold("Transfer Jobs")))
+
+	def validate_inbound_workers(self) -> None:
+		"""Validates the Inbound Workers."""
+
+		if self.inbound_workers < 1:
+			frappe.throw(_("{0} must be greater than 0.").format(frappe.bold("Inbound Workers")))
+
 
 def validate_mail_client_settings() -> None:
 	"""Validates the mandatory fields in the Mail Client Settings."""
@@ -4,9 +4,22 @@
 import frappe
 from frappe import _
 from frappe.model.document import Document
+from frappe.utils import now
 
+from mail_client.utils import bulk_update
 from mail_client.utils.user import is_system_manager
 
+MAIL_CONTACT_FIELDS = [
+	"name",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"user",
+	"email",
+	"display_name",
+]
+
 
 class MailContact(Document):
 	def before_validate(self) -> None:
@@ -45,6 +58,49 @@ def create_mail_contact(user: str, email: str, display_name: str | None = None)
 		doc.insert()
 
 
+def create_mail_contacts(contacts: list[tuple[str, str, str | None]]) -> None:
+	"""Creates the mail contacts (user, email, display name) of a batch, with multi-row statements."""
+
+	if not contacts:
+		return
+
+	# The last display name seen for a contact wins, as with `create_mail_contact` called in order.
+	contacts = {(user, email): display_name for user, email, display_name in contacts}
+
+	MC = frappe.qb.DocType("Mail Contact")
+	existing = {
+		(contact.user, contact.email): contact
+		for contact in (
+			frappe.qb.from_(MC)
+			.select(MC.name, MC.user, MC.email, MC.display_name)
+			.where(
+				MC.user.isin(list({user for user, __ in contacts}))
+				& MC.email.isin(list({email for __, email in contacts}))
+			)
+		).run(as_dict=True)
+	}
+
+	doc_updates, values = {}, []
+	user, timestamp = frappe.session.user, now()
+	for (contact_user, email), display_name in contacts.items():
+		if contact := existing.get((contact_user, email)):
+			if display_name != contact.display_name:
+				doc_updates[contact.name] = {"display_name": display_name}
+		else:
+			name = frappe.generate_hash(length=10)
+			values.append((name, timestamp, timestamp, user, user, contact_user, email, display_name))
+
+	bulk_update("Mail Contact", doc_updates)
+	frappe.db.bulk_insert(
+		"Mail Contact",
+		MAIL_CONTACT_FIELDS,
+		values,
+		# A contact created concurrently violates the `unique_user_email` index added in `on_doctype_update`,
+		# so its row is skipped and the contact is left as it is.
+		ignore_duplicates=True,
+	)
+
+
 def has_permission(doc: "Document", ptype: str, user: str) -> bool:
 	if doc.doctype != "Mail Contact":
 		return False
@@ -63,4 +119,5 @@ def get_permission_query_condition(user: str | None = None) -> str:
 
 
 def on_doctype_update() -> None:
+	# Also what keeps `create_mail_contacts` from inserting a contact twice when jobs run concurrently.
 	frappe.db.add_unique("Mail Contact", ["user", "email"], constraint_name="unique_user_email")
@@ -1,9 +1,53 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now
+
+from mail_client.mail_client.doctype.mail_contact.mail_contact import (
+	MAIL_CONTACT_FIELDS,
+	create_mail_contact,
+	create_mail_contacts,
+)
 
 
 class TestMailContact(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.email = f"{frappe.generate_hash(length=8)}@contacts.test"
+
+	def get_contacts(self) -> list[dict]:
+		return frappe.get_all(
+			"Mail Contact", filters={"user": "Administrator", "email": self.email}, fields=["display_name"]
+		)
+
+	def test_create_mail_contacts(self):
+		create_mail_contact("Administrator", self.email, "Old Name")
+
+		create_mail_contacts([("Administrator", self.email, "First"), ("Administrator", self.email, "Last")])
+
+		self.assertEqual(self.get_contacts(), [{"display_name": "Last"}])
+
+	def test_concurrent_contacts_are_not_duplicated(self):
+		# Stands in for a contact inserted by another job after `create_mail_contacts` looked the contact up.
+		for display_name in ["First", "Second"]:
+			timestamp = now()
+			frappe.db.bulk_insert(
+				"Mail Contact",
+				MAIL_CONTACT_FIELDS,
+				[
+					(
+						frappe.generate_hash(length=10),
+						timestamp,
+						timestamp,
+						"Administrator",
+						"Administrator",
+						"Administrator",
+						self.email,
+						display_name,
+					)
+				],
+				ignore_duplicates=True,
+			)
+
+		self.assertEqual(self.get_contacts(), [{"display_name": "First"}])
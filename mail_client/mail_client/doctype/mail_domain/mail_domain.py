@@ -7,6 +7,8 @@ from frappe.model.document import Document
 
 from mail_client.mail_client.doctype.mailbox.mailbox import create_postmaster_mailbox
 from mail_client.mail_server import get_mail_server_domain_api
+from mail_client.utils.dkim_signer import invalidate_dkim_key
+from mail_client.utils.routing import invalidate_routing_table
 
 
 class MailDomain(Document):
@@ -30,6 +32,12 @@ class MailDomain(Document):
 	def after_insert(self) -> None:
 		create_postmaster_mailbox(self.domain_name)
 
+	def on_update(self) -> None:
+		invalidate_routing_table()
+
+	def on_trash(self) -> None:
+		invalidate_routing_table()
+
 	def validate_newsletter_retention(self) -> None:
 		"""Validates the Newsletter Retention."""
 
@@ -109,6 +117,7 @@ class MailDomain(Document):
 		self.dkim_private_key, self.dkim_public_key = generate_dkim_keys()
 		self.add_or_update_domain_in_mail_server()
 		self.save()
+		invalidate_dkim_key(self.domain_name)
 		frappe.msgprint(_("DKIM Keys rotated successfully."), indicator="green", alert=True)
 
 	@frappe.whitelist()
@@ -6,6 +6,7 @@ from frappe import _
 from frappe.model.document import Document
 
 from mail_client.utils.cache import delete_cache
+from mail_client.utils.routing import invalidate_routing_table
 from mail_client.utils.user import has_role, is_system_manager
 from mail_client.utils.validation import (
 	is_valid_email_for_domain,
@@ -27,10 +28,12 @@ class Mailbox(Document):
 
 	def on_update(self) -> None:
 		delete_cache(f"user|{self.user}")
+		invalidate_routing_table()
 
 	def on_trash(self) -> None:
 		self.validate_against_mail_alias()
 		delete_cache(f"user|{self.user}")
+		invalidate_routing_table()
 
 	def validate_domain(self) -> None:
 		"""Validates the domain."""
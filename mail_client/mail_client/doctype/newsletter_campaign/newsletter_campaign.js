@@ -0,0 +1,14 @@
+// Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Newsletter Campaign", {
+	setup(frm) {
+		frm.trigger("set_queries");
+	},
+
+	set_queries(frm) {
+		frm.set_query("sender", () => ({
+			query: "mail_client.utils.query.get_sender",
+		}));
+	},
+});
@@ -0,0 +1,505 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr, formatdate, make_msgid, parseaddr
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint, get_system_timezone, now, now_datetime, validate_email_address
+from jinja2 import StrictUndefined, TemplateSyntaxError, meta
+from jinja2.sandbox import SandboxedEnvironment
+from uuid_utils import uuid7
+
+from mail_client.mail_client.doctype.outgoing_mail.outgoing_mail import get_next_retry_at, get_transfer_delay
+from mail_client.mail_server import MailServerUnavailableError, get_mail_server_outbound_api
+from mail_client.utils import bulk_update, convert_html_to_text, now_in_timezone
+from mail_client.utils.dkim_signer import get_dkim_key, sign_message
+from mail_client.utils.html_to_text import html_to_text
+from mail_client.utils.user import get_user_mailboxes, is_mailbox_owner, is_system_manager
+from mail_client.utils.validation import (
+	validate_domain_is_enabled_and_verified,
+	validate_mailbox_for_outgoing,
+)
+
+# Templates are written by mailbox users and rendered by the scheduler as Administrator, so they are rendered
+# in a bare sandbox with only the variables of the recipient, instead of Frappe's environment and its globals.
+TEMPLATE_ENVIRONMENT = SandboxedEnvironment(undefined=StrictUndefined)
+
+
+class NewsletterCampaign(Document):
+	def autoname(self) -> None:
+		self.name = str(uuid7())
+
+	def validate(self) -> None:
+		self.validate_amended_doc()
+		self.validate_sender()
+		self.validate_template()
+
+	def on_submit(self) -> None:
+		if not self.total_recipients:
+			frappe.throw(_("Add recipients to the campaign before submitting it."))
+
+		self._db_set(status="Queued", submitted_at=now(), notify_update=True)
+
+	def on_cancel(self) -> None:
+		self._db_set(status="Cancelled", notify_update=True)
+
+	def on_trash(self) -> None:
+		if self.docstatus != 0 and frappe.session.user != "Administrator":
+			frappe.throw(_("Only Administrator can delete Newsletter Campaign."))
+
+		NR = frappe.qb.DocType("Newsletter Recipient")
+		frappe.qb.from_(NR).where(NR.campaign == self.name).delete().run()
+
+	def validate_amended_doc(self) -> None:
+		"""Validates the amended document."""
+
+		if self.amended_from:
+			frappe.throw(_("Amending {0} is not allowed.").format(frappe.bold("Newsletter Campaign")))
+
+	def validate_sender(self) -> None:
+		"""Validates the sender."""
+
+		user = frappe.session.user
+		if not is_mailbox_owner(self.sender, user) and not is_system_manager(user):
+			frappe.throw(
+				_("You are not allowed to send mail from mailbox {0}.").format(frappe.bold(self.sender))
+			)
+
+		validate_mailbox_for_outgoing(self.sender)
+		validate_domain_is_enabled_and_verified(self.domain_name)
+
+	def validate_template(self) -> None:
+		"""Validates the Jinja syntax of the subject and body."""
+
+		for fieldname in ["subject", "body_html"]:
+			try:
+				TEMPLATE_ENVIRONMENT.from_string(self.get(fieldname) or "")
+			except TemplateSyntaxError as e:
+				frappe.throw(
+					_("Invalid template in {0} at line {1}: {2}").format(
+						frappe.bold(_(self.meta.get_label(fieldname))), e.lineno, e.message
+					)
+				)
+
+	def add_recipients(self, recipients: list[str | dict]) -> int:
+		"""Adds the recipients with multi-row inserts and returns the number of recipients added.
+
+		A recipient is either an address (`Name <email>`) or a dict with `email`, `display_name` and
+		`variables`. Recipients already in the campaign are skipped.
+		"""
+
+		if self.docstatus != 0:
+			frappe.throw(_("Recipients can only be added to a draft campaign."))
+
+		NR = frappe.qb.DocType("Newsletter Recipient")
+		emails = set(frappe.qb.from_(NR).select(NR.email).where(NR.campaign == self.name).run(pluck=True))
+
+		user, timestamp = frappe.session.user, now()
+		fields = [
+			"name",
+			"creation",
+			"modified",
+			"owner",
+			"modified_by",
+			"campaign",
+			"email",
+			"display_name",
+			"variables",
+			"status",
+		]
+		values = []
+
+		for recipient in recipients:
+			variables = None
+			if isinstance(recipient, str):
+				display_name, email = parseaddr(recipient)
+			else:
+				email, display_name = recipient.get("email"), recipient.get("display_name")
+				variables = recipient.get("variables")
+
+			email = (email or "").strip().lower()
+			if validate_email_address(email) != email:
+				frappe.throw(_("Invalid recipient {0}.").format(frappe.bold(email)))
+
+			if variables is not None and not isinstance(variables, dict):
+				frappe.throw(_("Variables of recipient {0} must be a dict.").format(frappe.bold(email)))
+
+			if email in emails:
+				continue
+
+			emails.add(email)
+			values.append(
+				(
+					str(uuid7()),
+					timestamp,
+					timestamp,
+					user,
+					user,
+					self.name,
+					email,
+					display_name,
+					json.dumps(variables) if variables else None,
+					"Pending",
+				)
+			)
+
+		frappe.db.bulk_insert("Newsletter Recipient", fields, values)
+		self._db_set(total_recipients=len(emails), update_modified=False)
+
+		return len(values)
+
+	def transfer_to_mail_server(self, batch_size: int = 500, chunk_size: int = 50) -> None:
+		"""Transfers the pending recipients of the campaign to the Mail Server.
+
+		The templates are compiled once and rendered per recipient only here, at transfer time. The messages
+		are then built, DKIM signed and sent in chunks of `chunk_size` by a pool of worker threads.
+		"""
+
+		if not (self.docstatus == 1 and self.status in ["Queued", "Sending"]):
+			return
+
+		if self.status == "Queued":
+			self._db_set(status="Sending", commit=True, notify_update=True)
+
+		subject_template = TEMPLATE_ENVIRONMENT.from_string(self.subject)
+		body_template = TEMPLATE_ENVIRONMENT.from_string(self.body_html)
+
+		# A body without variables is the same for every recipient, so it is rendered once and its text is
+		# taken from the cache. Personalized bodies are converted by the worker threads instead, as caching
+		# them would only churn the cache.
+		static_body_html = static_body_plain = None
+		if not meta.find_undeclared_variables(TEMPLATE_ENVIRONMENT.parse(self.body_html)):
+			static_body_html = body_template.render()
+			static_body_plain = convert_html_to_text(static_body_html)
+
+		# Resolved up front, as the worker threads have no site context.
+		dkim_key = get_dkim_key(
+			self.domain_name, frappe.get_cached_value("Mail Domain", self.domain_name, "dkim_public_key")
+		)
+		outbound_api = get_mail_server_outbound_api()
+		timezone = get_system_timezone()
+		transfer_workers = max(
+			cint(frappe.db.get_single_value("Mail Client Settings", "transfer_workers", cache=True)), 1
+		)
+		render_failure_threshold = 5
+
+		def _render(recipient: dict) -> dict:
+			"""Returns the mail of the recipient, with the subject and body rendered from the templates."""
+
+			context = json.loads(recipient.variables) if recipient.variables else {}
+			context.update({"email": recipient.email, "display_name": recipient.display_name})
+
+			return {
+				"name": recipient.name,
+				"email": recipient.email,
+				"display_name": recipient.display_name,
+				"failed_count": recipient.failed_count,
+				"message_id": make_msgid(domain=self.domain_name),
+				"subject": subject_template.render(context),
+				"body_html": body_template.render(context) if static_body_html is None else static_body_html,
+			}
+
+		def _get_message(mail: dict) -> bytes:
+			"""Returns the DKIM signed message of the mail. Runs in a worker thread."""
+
+			message = MIMEMultipart("alternative", policy=policy.SMTP)
+
+			if self.reply_to:
+				message["Reply-To"] = self.reply_to
+
+			message["From"] = formataddr((self.display_name, self.sender))
+			message["To"] = formataddr((mail["display_name"], mail["email"]))
+			message["Subject"] = mail["subject"]
+			message["Date"] = formatdate(localtime=True)
+			message["Message-ID"] = mail["message_id"]
+			message["X-Priority"] = "0"
+			message["X-Newsletter"] = "1"
+
+			body_plain = (
+				static_body_plain if static_body_plain is not None else html_to_text(mail["body_html"])
+			)
+
+			message.attach(MIMEText(body_plain, "plain", "utf-8", policy=policy.SMTP))
+			message.attach(MIMEText(mail["body_html"], "html", "utf-8", policy=policy.SMTP))
+
+			data = message.as_string().encode("utf-8")
+			dkim_signature = sign_message(data, self.domain_name, dkim_key=dkim_key)
+
+			return f"DKIM-Signature: {dkim_signature}{message.policy.linesep}".encode() + data
+
+		def _transfer(mails: list[dict]) -> list[dict]:
+			"""Signs and transfers a chunk of mails in a single request. Runs in a worker thread."""
+
+			try:
+				response = outbound_api.send_many(
+					[
+						{
+							"outgoing_mail": mail["name"],
+							"recipients": [mail["email"]],
+							"message": _get_message(mail),
+						}
+						for mail in mails
+					]
+				)
+			except MailServerUnavailableError:
+				return [{"name": mail["name"], "unavailable": True} for mail in mails]
+			except Exception:
+				error_log = traceback.format_exc()
+				return [{"name": mail["name"], "error_log": error_log} for mail in mails]
+
+			transfer_completed_at = now_in_timezone(timezone)
+			response_map = {r["outgoing_mail"]: r for r in response or []}
+
+			results = []
+			for mail in mails:
+				r = response_map.get(mail["name"]) or {"error": "No response from the Mail Server."}
+				if token := r.get("token"):
+					results.append(
+						{"name": mail["name"], "token": token, "transfer_completed_at": transfer_completed_at}
+					)
+				else:
+					results.append({"name": mail["name"], "error_log": r.get("error")})
+
+			return results
+
+		NR = frappe.qb.DocType("Newsletter Recipient")
+
+		while True:
+			recipients = (
+				frappe.qb.from_(NR)
+				.select(NR.name, NR.email, NR.display_name, NR.variables, NR.failed_count)
+				.where(
+					(NR.campaign == self.name)
+					& (
+						(NR.status == "Pending")
+						| (
+							(NR.status == "Failed")
+							& (NR.failed_count < 3)
+							& (NR.next_retry_at <= now_datetime())
+						)
+					)
+				)
+				.orderby(NR.name)
+				.limit(batch_size)
+			).run(as_dict=True)
+
+			if not recipients:
+				break
+
+			mails = []
+			throttled = False
+			render_failures = 0
+			recipient_updates = {}
+			for recipient in recipients:
+				# Throttled by the outgoing rate limits, the rest is left to the next run.
+				if get_transfer_delay(self.domain_name, self.sender):
+					throttled = True
+					break
+
+				try:
+					mails.append(_render(recipient))
+					render_failures = 0
+				except Exception:
+					# Failed for good, as rendering is deterministic, e.g. on a variable the recipient has no
+					# value for.
+					render_failures += 1
+					recipient_updates[recipient.name] = {
+						"status": "Failed",
+						"error_log": traceback.format_exc(),
+						"failed_count": 3,
+						"next_retry_at": None,
+					}
+
+					# Consecutive failures point to a broken template rather than to the recipients.
+					if render_failures >= render_failure_threshold:
+						break
+
+			mails_map = {mail["name"]: mail for mail in mails}
+			chunks = [mails[i : i + chunk_size] for i in range(0, len(mails), chunk_size)]
+			server_unavailable = False
+
+			with ThreadPoolExecutor(max_workers=transfer_workers) as executor:
+				for results in executor.map(_transfer, chunks):
+					for result in results:
+						mail = mails_map[result["name"]]
+
+						if result.get("unavailable"):
+							server_unavailable = True
+						elif error_log := result.get("error_log"):
+							recipient_updates[mail["name"]] = {
+								"status": "Failed",
+								"error_log": error_log,
+								"failed_count": mail["failed_count"] + 1,
+								"next_retry_at": get_next_retry_at(mail["failed_count"] + 1),
+							}
+						else:
+							recipient_updates[mail["name"]] = {
+								"status": "Queued",
+								"token": result["token"],
+								"message_id": mail["message_id"],
+								"error_log": None,
+								"next_retry_at": None,
+								"transfer_completed_at": result["transfer_completed_at"],
+							}
+
+			bulk_update("Newsletter Recipient", recipient_updates, update_modified=False)
+			frappe.db.commit()
+
+			if render_failures >= render_failure_threshold:
+				frappe.log_error(
+					title="Transfer Newsletter Campaign",
+					message=_("Stopped campaign {0} after {1} consecutive render failures:\n{2}").format(
+						self.name, render_failures, recipient_updates[recipient.name]["error_log"]
+					),
+				)
+				return
+
+			if server_unavailable or throttled:
+				return
+
+		remaining = frappe.db.count(
+			"Newsletter Recipient",
+			{"campaign": self.name, "status": ["in", ["Pending", "Failed"]], "failed_count": ["<", 3]},
+		)
+		if not remaining:
+			self._db_set(status="Completed", completed_at=now(), commit=True, notify_update=True)
+
+	def _db_set(
+		self,
+		update_modified: bool = True,
+		commit: bool = False,
+		notify_update: bool = False,
+		**kwargs,
+	) -> None:
+		"""Updates the document with the given key-value pairs."""
+
+		self.db_set(kwargs, update_modified=update_modified, commit=commit)
+
+		if notify_update:
+			self.notify_update()
+
+
+def create_newsletter_campaign(
+	sender: str,
+	subject: str,
+	body_html: str,
+	recipients: list[str | dict],
+	display_name: str | None = None,
+	reply_to: str | None = None,
+	do_not_submit: bool = False,
+) -> "NewsletterCampaign":
+	"""Creates the newsletter campaign."""
+
+	doc: NewsletterCampaign = frappe.new_doc("Newsletter Campaign")
+	doc.sender = sender
+	doc.display_name = display_name
+	doc.reply_to = reply_to
+	doc.subject = subject
+	doc.body_html = body_html
+	doc.insert()
+	doc.add_recipients(recipients)
+
+	if not do_not_submit:
+		doc.submit()
+
+	return doc
+
+
+def transfer_newsletter_campaigns() -> None:
+	"""Transfers the recipients of the submitted campaigns to the Mail Server."""
+
+	for name in frappe.db.get_all(
+		"Newsletter Campaign",
+		filters={"docstatus": 1, "status": ["in", ["Queued", "Sending"]]},
+		order_by="submitted_at",
+		pluck="name",
+	):
+		try:
+			frappe.get_doc("Newsletter Campaign", name).transfer_to_mail_server()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(
+				title="Transfer Newsletter Campaign", message=frappe.get_traceback(with_context=False)
+			)
+
+
+def fetch_and_update_newsletter_delivery_statuses(batch_size: int = 250) -> None:
+	"""Fetches and updates the delivery statuses of the newsletter recipients."""
+
+	NR = frappe.qb.DocType("Newsletter Recipient")
+	last_name = ""
+
+	while True:
+		recipients = (
+			frappe.qb.from_(NR)
+			.select(NR.name, NR.token)
+			.where((NR.name > last_name) & (NR.token.isnotnull()) & (NR.status.isin(["Queued", "Deferred"])))
+			.orderby(NR.name)
+			.limit(batch_size)
+		).run(as_dict=True)
+
+		if not recipients:
+			break
+
+		last_name = recipients[-1].name
+
+		try:
+			outbound_api = get_mail_server_outbound_api()
+			delivery_statuses = outbound_api.fetch_delivery_statuses(
+				[{"outgoing_mail": rcpt.name, "token": rcpt.token} for rcpt in recipients]
+			)
+		except Exception:
+			frappe.log_error(
+				title="Fetch and Update Newsletter Delivery Statuses",
+				message=frappe.get_traceback(with_context=False),
+			)
+			break
+
+		tokens = {rcpt.name: rcpt.token for rcpt in recipients}
+		recipient_updates = {
+			delivery_status["outgoing_mail"]: {
+				"status": delivery_status["status"],
+				"error_log": delivery_status.get("error_message"),
+			}
+			for delivery_status in delivery_statuses
+			if tokens.get(delivery_status["outgoing_mail"]) == delivery_status["token"]
+		}
+
+		bulk_update("Newsletter Recipient", recipient_updates, update_modified=False)
+		frappe.db.commit()
+
+
+def has_permission(doc: "Document", ptype: str, user: str) -> bool:
+	if doc.doctype != "Newsletter Campaign":
+		return False
+
+	user_is_system_manager = is_system_manager(user)
+	user_is_mailbox_owner = is_mailbox_owner(doc.sender, user)
+
+	if ptype == "create":
+		return True
+	elif ptype in ["write", "submit", "cancel"]:
+		return user_is_system_manager or user_is_mailbox_owner
+	else:
+		return user_is_system_manager or (user_is_mailbox_owner and doc.docstatus != 2)
+
+
+def get_permission_query_condition(user: str | None = None) -> str:
+	if not user:
+		user = frappe.session.user
+
+	if is_system_manager(user):
+		return ""
+
+	if mailboxes := ", ".join(repr(m) for m in get_user_mailboxes(user)):
+		return f"(`tabNewsletter Campaign`.`sender` IN ({mailboxes})) AND (`tabNewsletter Campaign`.`docstatus` != 2)"
+	else:
+		return "1=0"
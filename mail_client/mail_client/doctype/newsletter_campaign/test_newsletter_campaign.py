@@ -0,0 +1,102 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import json
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from jinja2.exceptions import SecurityError, UndefinedError
+from uuid_utils import uuid7
+
+from mail_client.mail_client.doctype.newsletter_campaign import newsletter_campaign
+from mail_client.mail_client.doctype.newsletter_campaign.newsletter_campaign import (
+	TEMPLATE_ENVIRONMENT,
+	NewsletterCampaign,
+)
+
+
+class TestNewsletterCampaign(FrappeTestCase):
+	def get_campaign(self, **kwargs) -> NewsletterCampaign:
+		"""Returns an unsaved draft campaign, which is all that templates and recipients need."""
+
+		doc = frappe.new_doc("Newsletter Campaign")
+		doc.name = str(uuid7())
+		doc.update({"subject": "Hello {{ display_name }}", "body_html": "<p>Hi {{ email }}</p>", **kwargs})
+
+		return doc
+
+	def get_recipients(self, doc: NewsletterCampaign) -> list[dict]:
+		return frappe.get_all(
+			"Newsletter Recipient",
+			filters={"campaign": doc.name},
+			fields=["email", "display_name", "variables"],
+			order_by="email",
+		)
+
+	def test_template_is_sandboxed(self):
+		def render(source: str) -> str:
+			return TEMPLATE_ENVIRONMENT.from_string(source).render({"email": "a@example.com"})
+
+		self.assertEqual(render("{{ email }}"), "a@example.com")
+		self.assertRaises(UndefinedError, render, "{{ frappe.session.user }}")
+		self.assertRaises(SecurityError, render, "{{ email.__class__.__mro__[1].__subclasses__() }}")
+
+	def test_validate_template(self):
+		self.get_campaign().validate_template()
+
+		for fieldname in ["subject", "body_html"]:
+			with self.subTest(fieldname=fieldname):
+				doc = self.get_campaign(**{fieldname: "{% if email %}unclosed"})
+				self.assertRaises(frappe.ValidationError, doc.validate_template)
+
+	def test_add_recipients(self):
+		doc = self.get_campaign()
+
+		added = doc.add_recipients(
+			[
+				"Alice <Alice@Example.com>",
+				{"email": "bob@example.com", "display_name": "Bob", "variables": {"plan": "Pro"}},
+				"alice@example.com",
+			]
+		)
+		self.assertEqual(added, 2)
+		self.assertEqual(doc.add_recipients(["ALICE@example.com", "carol@example.com"]), 1)
+		self.assertEqual(doc.total_recipients, 3)
+
+		recipients = self.get_recipients(doc)
+		self.assertEqual(
+			[r.email for r in recipients], ["alice@example.com", "bob@example.com", "carol@example.com"]
+		)
+		self.assertEqual([r.display_name for r in recipients[:2]], ["Alice", "Bob"])
+		self.assertEqual(json.loads(recipients[1].variables), {"plan": "Pro"})
+
+	def test_add_invalid_recipients(self):
+		doc = self.get_campaign()
+
+		self.assertRaises(frappe.ValidationError, doc.add_recipients, ["not an address"])
+		self.assertRaises(
+			frappe.ValidationError,
+			doc.add_recipients,
+			[{"email": "bob@example.com", "variables": ["Pro"]}],
+		)
+		self.assertEqual(self.get_recipients(doc), [])
+
+	def test_broken_template_stops_transfer(self):
+		doc = self.get_campaign(body_html="<p>Your plan is {{ plan }}</p>")
+		doc.add_recipients([f"user{i}@example.com" for i in range(7)])
+		doc.docstatus, doc.status = 1, "Sending"
+		outbound_api = MagicMock()
+
+		with (
+			patch.object(newsletter_campaign, "get_dkim_key"),
+			patch.object(newsletter_campaign, "get_mail_server_outbound_api", return_value=outbound_api),
+			patch.object(newsletter_campaign, "get_transfer_delay", return_value=0),
+		):
+			doc.transfer_to_mail_server()
+
+		statuses = frappe.get_all(
+			"Newsletter Recipient", filters={"campaign": doc.name}, pluck="status", order_by="email"
+		)
+		self.assertEqual(statuses, ["Failed"] * 5 + ["Pending"] * 2)
+		outbound_api.send_many.assert_not_called()
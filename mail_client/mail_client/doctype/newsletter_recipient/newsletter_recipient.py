@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from uuid_utils import uuid7
+
+
+class NewsletterRecipient(Document):
+	def autoname(self) -> None:
+		self.name = str(uuid7())
+
+
+def on_doctype_update() -> None:
+	frappe.db.add_index("Newsletter Recipient", ["campaign", "status"])
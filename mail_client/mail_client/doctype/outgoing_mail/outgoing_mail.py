@@ -2,51 +2,86 @@
 # For license information, please see license.txt
 
 import json
+import random
+import re
 import time
-from email import message_from_string, policy
-from email.encoders import encode_base64
+import traceback
+from base64 import encodebytes
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from copy import deepcopy
+from datetime import datetime
+from email import policy
+from email.generator import BytesGenerator
 from email.message import Message
-from email.mime.audio import MIMEAudio
 from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr, formatdate, make_msgid, parseaddr
+from io import BytesIO
+from math import ceil
 from mimetypes import guess_type
-from re import finditer
+from tempfile import SpooledTemporaryFile
+from typing import IO
 from urllib.parse import parse_qs, urlparse
 
 import frappe
-from dkim import sign as dkim_sign
 from frappe import _
 from frappe.model.document import Document
-from frappe.query_builder import Interval
-from frappe.query_builder.functions import GroupConcat, IfNull, Now
+from frappe.query_builder import Field, Interval
+from frappe.query_builder.functions import IfNull, Min, Now
 from frappe.utils import (
+	add_to_date,
+	cint,
 	convert_utc_to_system_timezone,
 	flt,
 	get_datetime,
 	get_datetime_str,
+	get_system_timezone,
 	now,
+	now_datetime,
 	time_diff_in_seconds,
 	validate_email_address,
 )
-from frappe.utils.file_manager import save_file
+from pypika import analytics as an
 from uuid_utils import uuid7
 
 from mail_client.mail_client.doctype.mail_contact.mail_contact import create_mail_contact
-from mail_client.mail_server import get_mail_server_outbound_api
+from mail_client.mail_server import (
+	MailServerOutboundAPI,
+	MailServerUnavailableError,
+	get_mail_server_outbound_api,
+)
 from mail_client.utils import (
+	bulk_update,
 	convert_html_to_text,
 	get_in_reply_to,
 	get_in_reply_to_mail,
+	now_in_timezone,
 	parsedate_to_datetime,
 )
+from mail_client.utils.attachment_store import delete_attachments, save_attachment
 from mail_client.utils.cache import get_user_default_mailbox
+from mail_client.utils.dkim_signer import get_dkim_key, sign_message
 from mail_client.utils.email_parser import EmailParser
+from mail_client.utils.message_store import (
+	compressed_bodies,
+	decompress_bodies,
+	delete_unreferenced_messages,
+	get_message_store,
+)
+from mail_client.utils.rate_limiter import acquire_token
 from mail_client.utils.user import get_user_mailboxes, is_mailbox_owner, is_system_manager
 from mail_client.utils.validation import validate_mailbox_for_outgoing
 
+# Matches the `src` attribute of an `<img>` tag, capturing everything before its value as `prefix`.
+IMG_SRC_PATTERN = re.compile(
+	r"""(?P<prefix><img\s(?:[^>]*?\s)?src\s*=\s*(?P<quote>["']))(?P<src>.*?)(?P=quote)""", re.IGNORECASE
+)
+
+# A multiple of 57 bytes, so that every base64 encoded chunk ends on a complete 76 character line.
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
+SPOOL_MAX_SIZE = 5 * 1024 * 1024
+
 
 class OutgoingMail(Document):
 	def autoname(self) -> None:
@@ -78,9 +113,7 @@ class OutgoingMail(Document):
 	def on_submit(self) -> None:
 		self.create_mail_contacts()
 
-		status = "Pending"
-		if self.via_api and not self.is_newsletter and self.submitted_after <= 5:
-			status = "Queuing"
+		status = "Queuing" if self.is_transferred_on_submit() else "Pending"
 
 		self._db_set(status=status, notify_update=True)
 
@@ -96,6 +129,19 @@ class OutgoingMail(Document):
 		if self.docstatus != 0 and frappe.session.user != "Administrator":
 			frappe.throw(_("Only Administrator can delete Outgoing Mail."))
 
+	def load_from_db(self) -> "OutgoingMail":
+		super().load_from_db()
+		decompress_bodies(self)
+		return self
+
+	def db_insert(self, *args, **kwargs) -> None:
+		with compressed_bodies(self):
+			super().db_insert(*args, **kwargs)
+
+	def db_update(self) -> None:
+		with compressed_bodies(self):
+			super().db_update()
+
 	def validate_amended_doc(self) -> None:
 		"""Validates the amended document."""
 
@@ -354,7 +400,8 @@ class OutgoingMail(Document):
 			message["Message-ID"] = self.message_id
 
 			body_html = self._replace_image_url_with_content_id()
-			body_plain = convert_html_to_text(body_html)
+			# Only `src` attributes are rewritten above, so the text of the body is unchanged.
+			body_plain = self.body_plain or convert_html_to_text(body_html)
 
 			if self.runtime.mailbox.track_outgoing_mail:
 				self.tracking_id = uuid7().hex
@@ -372,82 +419,94 @@ class OutgoingMail(Document):
 				for header in self.custom_headers:
 					message.add_header(header.key, header.value)
 
+			# Mails transferred on submit get the highest priority [3], set here so that the stored message is
+			# sent as is.
+			priority = 3 if self.is_transferred_on_submit() else (0 if self.is_newsletter else 1)
 			del message["X-Priority"]
-			message["X-Priority"] = str(0 if self.is_newsletter else 1)
+			message["X-Priority"] = str(priority)
 
 			if self.is_newsletter:
 				del message["X-Newsletter"]
 				message["X-Newsletter"] = "1"
 
-		def _add_attachments(message: MIMEMultipart | Message) -> None:
-			"""Adds the attachments to the message."""
+		def _write_message(message: MIMEMultipart | Message, fp: IO[bytes]) -> None:
+			"""Writes the message to the file, streaming the attachments from disk in base64 chunks."""
 
-			for attachment in self.attachments:
-				file = frappe.get_doc("File", attachment.get("name"))
-				content_type = guess_type(file.file_name)[0]
+			linesep = message.policy.linesep
 
-				if content_type is None:
-					content_type = "application/octet-stream"
+			# A single-part raw message has no boundary to write the attachments before.
+			if self.attachments and not message.is_multipart():
+				message = wrap_in_multipart(message)
 
-				content = file.get_content()
-				maintype, subtype = content_type.split("/", 1)
+			# Generated as bytes, so that the 8-bit parts of a raw message are written back as received.
+			buffer = BytesIO()
+			BytesGenerator(buffer, mangle_from_=False, maxheaderlen=0).flatten(message)
+			data = buffer.getvalue()
 
-				if maintype == "text":
-					if isinstance(content, str):
-						content = content.encode("utf-8")
-					part = MIMEText(content, _subtype=subtype, _charset="utf-8", policy=policy.SMTP)
+			if not self.attachments:
+				fp.write(data)
+				return
 
-				elif maintype == "image":
-					part = MIMEImage(content, _subtype=subtype, policy=policy.SMTP)
+			# The attachments are written in place of the closing boundary, which is written after them.
+			closing_boundary = f"--{message.get_boundary()}--".encode()
+			closing_boundary_at = data.rfind(closing_boundary)
+			if closing_boundary_at == -1:
+				frappe.throw(_("Unable to add the attachments, as the message has no closing boundary."))
 
-				elif maintype == "audio":
-					part = MIMEAudio(content, _subtype=subtype, policy=policy.SMTP)
+			fp.write(data[:closing_boundary_at])
 
-				else:
-					part = MIMEBase(maintype, subtype, policy=policy.SMTP)
-					part.set_payload(content)
-					encode_base64(part)
+			for attachment in self.attachments:
+				file = frappe.get_doc("File", attachment.get("name"))
+				content_type = guess_type(file.file_name)[0] or "application/octet-stream"
+				maintype, subtype = content_type.split("/", 1)
 
+				part = MIMEBase(maintype, subtype, policy=policy.SMTP)
+				if maintype == "text":
+					part.set_param("charset", "utf-8")
+				part["Content-Transfer-Encoding"] = "base64"
 				part.add_header("Content-Disposition", f'{attachment.type}; filename="{file.file_name}"')
 				part.add_header("Content-ID", f"<{attachment.name}>")
 
-				message.attach(part)
-
-		def _add_dkim_signature(message: MIMEMultipart | Message) -> None:
-			"""Adds the DKIM signature to the message."""
-
-			include_headers = [
-				b"To",
-				b"Cc",
-				b"From",
-				b"Date",
-				b"Subject",
-				b"Reply-To",
-				b"Message-ID",
-				b"In-Reply-To",
-			]
-			dkim_private_key = self.get_dkim_private_key()
-			dkim_signature = dkim_sign(
-				message=message.as_string().split("\n", 1)[-1].encode("utf-8"),
-				domain=self.domain_name.encode(),
-				selector=b"frappemail",
-				privkey=dkim_private_key.encode(),
-				include_headers=include_headers,
-			)
-			dkim_header = dkim_signature.decode().replace("\n", "").replace("\r", "")
-			message["DKIM-Signature"] = dkim_header[len("DKIM-Signature: ") :]
+				fp.write(f"--{message.get_boundary()}{linesep}".encode())
+				fp.write(part.as_string(policy=part.policy.clone(linesep=linesep)).encode("utf-8"))
+
+				is_empty = True
+				with open(file.get_full_path(), "rb") as f:
+					while chunk := f.read(ATTACHMENT_CHUNK_SIZE):
+						fp.write(encodebytes(chunk).replace(b"\n", linesep.encode()))
+						is_empty = False
+
+				if is_empty:
+					fp.write(linesep.encode())
+
+			fp.write(data[closing_boundary_at:])
+
+		def _store_message(message: MIMEMultipart | Message) -> None:
+			"""Signs the message and writes it to the message store, with the DKIM signature prepended."""
+
+			with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as fp:
+				_write_message(message, fp)
+				dkim_signature = sign_message(fp, self.domain_name, dkim_key=self.get_dkim_key())
+				dkim_header = f"DKIM-Signature: {dkim_signature}{message.policy.linesep}".encode()
+				self.message_key, self.message_size = get_message_store().put(dkim_header, fp)
+
+			self.message = None
 
 		message = _get_message()
-		_add_headers(message)
-		_add_attachments(message)
-		_add_dkim_signature(message)
 
-		self.message = message.as_string()
-		self.message_size = len(self.message)
+		# Set before the headers, as the priority depends on whether the mail is transferred on submit.
 		self.created_at = get_datetime_str(parsedate_to_datetime(message["Date"]))
 		self.submitted_at = now()
 		self.submitted_after = time_diff_in_seconds(self.submitted_at, self.created_at)
 
+		_add_headers(message)
+		_store_message(message)
+
+	def is_transferred_on_submit(self) -> bool:
+		"""Returns whether the mail is transferred on submit, rather than by the transfer job."""
+
+		return bool(self.via_api and not self.is_newsletter and self.submitted_after <= 5)
+
 	def validate_max_message_size(self) -> None:
 		"""Validates the maximum message size."""
 
@@ -468,10 +527,10 @@ class OutgoingMail(Document):
 			for recipient in self.recipients:
 				create_mail_contact(self.runtime.mailbox.user, recipient.email, recipient.display_name)
 
-	def get_dkim_private_key(self) -> str:
-		"""Returns the DKIM private key."""
+	def get_dkim_key(self) -> frappe._dict:
+		"""Returns the cached DKIM private key of the domain."""
 
-		return self.runtime.mail_domain.get_password("dkim_private_key")
+		return get_dkim_key(self.domain_name, self.runtime.mail_domain.dkim_public_key)
 
 	def _add_recipient(self, type: str, recipient: str | list[str]) -> None:
 		"""Adds the recipients."""
@@ -504,22 +563,7 @@ class OutgoingMail(Document):
 		if attachment:
 			attachments = [attachment] if isinstance(attachment, dict) else attachment
 			for a in attachments:
-				filename = a.get("filename")
-				content = a["content"]
-
-				kwargs = {
-					"dt": self.doctype,
-					"dn": self.name,
-					"df": "file",
-					"fname": filename,
-					"content": content,
-					"is_private": 1,
-					"decode": True,
-				}
-				file = save_file(**kwargs)
-
-				if filename and filename != file.file_name:
-					file.db_set("file_name", filename, update_modified=False)
+				save_attachment(a.get("filename"), a["content"], self.doctype, self.name, decode=True)
 
 	def _add_custom_headers(self, headers: dict) -> None:
 		"""Adds the custom headers."""
@@ -534,13 +578,14 @@ class OutgoingMail(Document):
 		body_html = self.body_html or ""
 
 		if body_html and self.attachments:
-			img_src_pattern = r'<img.*?src=[\'"](.*?)[\'"].*?>'
 
-			for img_src_match in finditer(img_src_pattern, body_html):
-				img_src = img_src_match.group(1)
+			def _replace(match: re.Match) -> str:
+				if content_id := self._get_attachment_content_id(match.group("src"), set_as_inline=True):
+					return f"{match.group('prefix')}cid:{content_id}{match.group('quote')}"
 
-				if content_id := self._get_attachment_content_id(img_src, set_as_inline=True):
-					body_html = body_html.replace(img_src, f"cid:{content_id}")
+				return match.group(0)
+
+			body_html = IMG_SRC_PATTERN.sub(_replace, body_html)
 
 		return body_html
 
@@ -557,31 +602,45 @@ class OutgoingMail(Document):
 					field = "name"
 					value = fid
 
-			for attachment in self.attachments:
-				if attachment[field] == value:
-					if set_as_inline:
-						attachment.type = "inline"
+			if attachment := self._get_attachments_index()[field].get(value):
+				if set_as_inline:
+					attachment.type = "inline"
 
-					return attachment.name
+				return attachment.name
 
 	def _correct_attachments_file_url(self) -> None:
 		"""Corrects the attachments file URL."""
 
 		if self.body_html and self.attachments:
-			img_src_pattern = r'<img.*?src=[\'"](.*?)[\'"].*?>'
 
-			for img_src_match in finditer(img_src_pattern, self.body_html):
-				img_src = img_src_match.group(1)
+			def _replace(match: re.Match) -> str:
+				if file_url := self._get_attachment_file_url(match.group("src")):
+					return f"{match.group('prefix')}{file_url}{match.group('quote')}"
+
+				return match.group(0)
 
-				if file_url := self._get_attachment_file_url(img_src):
-					self.body_html = self.body_html.replace(img_src, file_url)
+			self.body_html = IMG_SRC_PATTERN.sub(_replace, self.body_html)
 
 	def _get_attachment_file_url(self, src: str) -> str | None:
 		"""Returns the attachment file URL."""
 
-		for attachment in self.attachments:
-			if src == attachment.file_name:
-				return attachment.file_url
+		if attachment := self._get_attachments_index()["file_name"].get(src):
+			return attachment.file_url
+
+	def _get_attachments_index(self) -> dict[str, dict[str, dict]]:
+		"""Returns the attachments indexed by name, file URL and file name, built once per loaded list."""
+
+		index = getattr(self, "_attachments_index", None)
+		if not index or index["attachments"] is not self.attachments:
+			index = {"attachments": self.attachments, "name": {}, "file_url": {}, "file_name": {}}
+			for attachment in self.attachments:
+				# The first attachment wins, as with the previous linear scan.
+				for field in ("name", "file_url", "file_name"):
+					index[field].setdefault(attachment[field], attachment)
+
+			self._attachments_index = index
+
+		return index
 
 	def _update_delivery_status(self, data: dict, notify_update: bool = False) -> None:
 		"""Update Delivery Status."""
@@ -642,7 +701,9 @@ class OutgoingMail(Document):
 		"""Retries the failed mail."""
 
 		if self.docstatus == 1 and self.status == "Failed" and self.failed_count < 3:
-			self._db_set(status="Queuing", error_log=None, error_message=None, commit=True)
+			self._db_set(
+				status="Queuing", error_log=None, error_message=None, next_retry_at=None, commit=True
+			)
 			self.transfer_to_mail_server()
 
 	@frappe.whitelist()
@@ -656,28 +717,39 @@ class OutgoingMail(Document):
 			if not (self.docstatus == 1 and self.status in ["Queuing", "Pending"] and self.failed_count < 3):
 				return
 
+		if delay := get_transfer_delay(self.domain_name, self.sender):
+			# Throttled by the outgoing rate limits, leave it to the transfer job once the bucket refills.
+			self._db_set(
+				status="Pending",
+				next_retry_at=add_to_date(now_datetime(), seconds=ceil(delay)),
+				commit=True,
+				notify_update=True,
+			)
+			return
+
 		try:
 			transfer_started_at = now()
 			transfer_started_after = time_diff_in_seconds(transfer_started_at, self.submitted_at)
 
-			# Update X-Priority to 3 [highest]
-			message = message_from_string(self.message)
-			del message["X-Priority"]
-			message["X-Priority"] = "3"
-			message = message.as_string()
-
 			# Remove duplicate recipients while preserving the order by using `dict.fromkeys()`.
 			# This avoids using a set, which could change the order of recipients.
 			recipients = list(dict.fromkeys([rcpt.email for rcpt in self.recipients]))
 
-			outbound_api = get_mail_server_outbound_api()
-			token = outbound_api.send(self.name, recipients, message)
+			# The stored message is passed on as an open file, so that the upload streams it from disk.
+			message = get_message_store().open(self.message_key) if self.message_key else self.message
+			try:
+				outbound_api = get_mail_server_outbound_api()
+				token = outbound_api.send(self.name, recipients, message)
+			finally:
+				if hasattr(message, "close"):
+					message.close()
 
 			transfer_completed_at = now()
 			transfer_completed_after = time_diff_in_seconds(transfer_completed_at, transfer_started_at)
 			self._db_set(
 				token=token,
 				status="Queued",
+				next_retry_at=None,
 				transfer_started_at=transfer_started_at,
 				transfer_started_after=transfer_started_after,
 				transfer_completed_at=transfer_completed_at,
@@ -685,18 +757,40 @@ class OutgoingMail(Document):
 				commit=True,
 				notify_update=True,
 			)
+		except MailServerUnavailableError:
+			# The circuit breaker is open, leave it to the transfer job without counting as a failure.
+			self._db_set(status="Pending", commit=True, notify_update=True)
 		except Exception:
 			error_log = frappe.get_traceback(with_context=False)
 			self._db_set(
 				status="Failed",
 				error_log=error_log,
 				failed_count=self.failed_count + 1,
+				next_retry_at=get_next_retry_at(self.failed_count + 1),
 				commit=True,
 				notify_update=True,
 			)
 
 
 @frappe.whitelist()
+def wrap_in_multipart(message: Message) -> MIMEMultipart:
+	"""Returns the single-part message as the first part of a multipart/mixed message with its headers."""
+
+	# Copied as a whole, so that an 8-bit payload is written back as received.
+	part = deepcopy(message)
+	for key in set(part.keys()):
+		if not key.lower().startswith("content-"):
+			del part[key]
+
+	wrapper = MIMEMultipart("mixed", policy=message.policy)
+	for key, value in message.items():
+		if not key.lower().startswith("content-") and key.lower() != "mime-version":
+			wrapper[key] = value
+	wrapper.attach(part)
+
+	return wrapper
+
+
 def get_default_sender() -> str | None:
 	"""Returns the default sender."""
 
@@ -806,6 +900,43 @@ def create_outgoing_mail(
 	return doc
 
 
+def add_comments(reference_doctype: str, comments: list[tuple[str, str]]) -> None:
+	"""Adds the comments (reference name, content) using a single multi-row insert."""
+
+	if not comments:
+		return
+
+	user, timestamp = frappe.session.user, now()
+	fields = [
+		"name",
+		"creation",
+		"modified",
+		"owner",
+		"modified_by",
+		"comment_type",
+		"comment_email",
+		"reference_doctype",
+		"reference_name",
+		"content",
+	]
+	values = [
+		(
+			frappe.generate_hash(length=10),
+			timestamp,
+			timestamp,
+			user,
+			user,
+			"Comment",
+			user,
+			reference_doctype,
+			reference_name,
+			content,
+		)
+		for reference_name, content in comments
+	]
+	frappe.db.bulk_insert("Comment", fields, values)
+
+
 def delete_newsletters() -> None:
 	"""Called by the scheduler to delete the newsletters based on the retention."""
 
@@ -821,8 +952,9 @@ def delete_newsletters() -> None:
 
 	for retention_days, mail_domains in newsletter_retention_and_mail_domains_map.items():
 		OM = frappe.qb.DocType("Outgoing Mail")
-		(
+		mails = (
 			frappe.qb.from_(OM)
+			.select(OM.name, OM.message_key)
 			.where(
 				(OM.docstatus != 0)
 				& (OM.status == "Sent")
@@ -830,8 +962,13 @@ def delete_newsletters() -> None:
 				& (OM.domain_name.isin(mail_domains))
 				& (OM.submitted_at < (Now() - Interval(days=retention_days)))
 			)
-			.delete()
-		).run()
+		).run(as_dict=True)
+		names = [mail.name for mail in mails]
+
+		delete_attachments("Outgoing Mail", names)
+		for i in range(0, len(names), 1000):
+			frappe.qb.from_(OM).where(OM.name.isin(names[i : i + 1000])).delete().run()
+		delete_unreferenced_messages(mail.message_key for mail in mails)
 
 
 def has_permission(doc: "Document", ptype: str, user: str) -> bool:
@@ -862,89 +999,447 @@ def get_permission_query_condition(user: str | None = None) -> str:
 		return "1=0"
 
 
-def transfer_emails_to_mail_server() -> None:
-	"""Transfers the emails to the Mail Server."""
+def get_next_retry_at(failed_count: int, base_delay: int = 5 * 60, max_delay: int = 60 * 60) -> "datetime":
+	"""Returns when a failed mail is to be retried, using exponential backoff with jitter.
 
-	batch_size = 500
-	max_failures = 3
-	total_failures = 0
-	batch_failure_threshold = 5
+	The delay doubles with each failure (5, 10, 20 minutes by default) and a random jitter of up to half
+	the delay spreads the retries of mails that failed together, e.g. during a Mail Server outage.
+	"""
 
-	while total_failures < max_failures:
-		OM = frappe.qb.DocType("Outgoing Mail")
-		MR = frappe.qb.DocType("Mail Recipient")
-		mails = (
+	delay = min(base_delay * 2 ** max(failed_count - 1, 0), max_delay)
+	return add_to_date(now_datetime(), seconds=random.uniform(delay / 2, delay))
+
+
+def get_transfer_delay(domain_name: str, sender: str) -> float:
+	"""Takes a token from the outgoing rate limits of the domain and mailbox.
+
+	Returns 0 if the mail can be transferred now, otherwise the number of seconds to defer it for.
+	"""
+
+	return acquire_token(
+		{
+			f"Mail Domain|{domain_name}": cint(
+				frappe.get_cached_value("Mail Domain", domain_name, "outgoing_rate_limit")
+			),
+			f"Mailbox|{sender}": cint(frappe.get_cached_value("Mailbox", sender, "outgoing_rate_limit")),
+		}
+	)
+
+
+# Claims are renewed before each chunk is sent, so the lease only has to outlast a single send request.
+CLAIM_LEASE_DURATION = 10 * 60
+
+
+def claim_outgoing_mails(
+	claimed_by: str, limit: int, lease_duration: int = CLAIM_LEASE_DURATION
+) -> list[dict]:
+	"""Claims a slice of the outgoing queue for the given claimant and returns the claimed mails.
+
+	The queue is split into a transactional and a newsletter lane that share the batch by weight, and
+	any share left unused by one lane goes to the other. Within a lane, mails are ranked per sender so
+	that one bulk sender cannot starve the others.
+
+	Rows locked by another transfer job are skipped (`FOR UPDATE SKIP LOCKED`), so parallel jobs claim
+	disjoint slices. Claims expire after `lease_duration` seconds and are then reclaimed automatically,
+	unless they are renewed with `renew_outgoing_mail_claims`.
+	"""
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	current_datetime = now_datetime()
+	is_claimable = (
+		(OM.docstatus == 1)
+		& (OM.failed_count < 3)
+		& (OM.status.isin(["Pending", "Failed"]))
+		& (OM.claimed_until.isnull() | (OM.claimed_until < current_datetime))
+		& (OM.next_retry_at.isnull() | (OM.next_retry_at <= current_datetime))
+	)
+
+	def _claim_lane(is_newsletter: int, lane_limit: int, exclude: list[str]) -> list[str]:
+		"""Claims up to `lane_limit` mails of the lane, in per-sender round-robin order.
+
+		Only the `lane_limit` senders with the oldest claimable mails are ranked, read from the
+		`(is_newsletter, status, sender, submitted_at)` index, so a claim does not sort the whole queue.
+		"""
+
+		# Over-select, so that parallel jobs competing for the same rows still find unlocked ones.
+		candidate_limit = lane_limit * 4
+		in_lane = (OM.is_newsletter == is_newsletter) & is_claimable
+
+		senders = (
+			frappe.qb.from_(OM)
+			.select(OM.sender, Min(OM.submitted_at).as_("oldest_submitted_at"))
+			.where(in_lane)
+			.groupby(OM.sender)
+			.orderby(Field("oldest_submitted_at"))
+			.limit(lane_limit)
+		).run(pluck="sender")
+
+		if not senders:
+			return []
+
+		sender_rank = an.RowNumber().over(OM.sender).orderby(OM.submitted_at)
+		ranked = (
+			frappe.qb.from_(OM)
+			.select(OM.name, OM.submitted_at, sender_rank.as_("sender_rank"))
+			.where(in_lane & OM.sender.isin(senders))
+		)
+		if exclude:
+			ranked = ranked.where(OM.name.notin(exclude))
+
+		candidates = (
+			frappe.qb.from_(ranked)
+			.select(ranked.field("name"))
+			.where(ranked.field("sender_rank") <= ceil(candidate_limit / len(senders)))
+			.orderby(ranked.field("sender_rank"))
+			.orderby(ranked.field("submitted_at"))
+			.limit(candidate_limit)
+		).run(pluck="name")
+
+		if not candidates:
+			return []
+
+		unlocked = set(
+			(
+				frappe.qb.from_(OM)
+				.select(OM.name)
+				.where(OM.name.isin(candidates) & is_claimable)
+				.for_update(skip_locked=True)
+			).run(pluck="name")
+		)
+
+		return [name for name in candidates if name in unlocked][:lane_limit]
+
+	# Lane weights, keyed by `is_newsletter`. Transactional mails get 4/5 of each batch when both lanes are busy.
+	lane_weights = {0: 4, 1: 1}
+	total_weight = sum(lane_weights.values())
+
+	names = []
+	for is_newsletter, weight in lane_weights.items():
+		names += _claim_lane(is_newsletter, ceil(limit * weight / total_weight), names)
+
+	for is_newsletter in lane_weights:
+		if (remaining := limit - len(names)) <= 0:
+			break
+
+		names += _claim_lane(is_newsletter, remaining, names)
+
+	if not names:
+		frappe.db.commit()
+		return []
+
+	(
+		frappe.qb.update(OM)
+		.set(OM.claimed_by, claimed_by)
+		.set(OM.claimed_until, add_to_date(current_datetime, seconds=lease_duration))
+		.where(OM.name.isin(names))
+	).run()
+	frappe.db.commit()
+
+	mails_map = {
+		mail.name: mail
+		for mail in (
 			frappe.qb.from_(OM)
-			.join(MR)
-			.on(OM.name == MR.parent)
 			.select(
 				OM.name,
-				OM.message,
+				OM.sender,
+				OM.domain_name,
 				OM.submitted_at,
-				GroupConcat(MR.email).as_("recipients"),
+				OM.failed_count,
+				OM.message_size,
 			)
-			.where((OM.docstatus == 1) & (OM.failed_count < 3) & (OM.status.isin(["Pending", "Failed"])))
-			.groupby(OM.name)
-			.orderby(OM.submitted_at)
-			.limit(batch_size)
+			.where(OM.name.isin(names) & (OM.claimed_by == claimed_by))
 		).run(as_dict=True, as_iterator=False)
+	}
 
-		if not mails:
-			break
+	# Preserve the lane and fairness order, so that transactional mails are dispatched first.
+	return [mails_map[name] for name in names if name in mails_map]
 
-		batch_failures = 0
 
-		try:
-			outbound_api = get_mail_server_outbound_api()
+def renew_outgoing_mail_claims(
+	claimed_by: str, names: list[str], lease_duration: int = CLAIM_LEASE_DURATION
+) -> list[str]:
+	"""Extends the unexpired claims of the given claimant on the mails and returns the names still claimed.
+
+	Mails whose claim has expired may have been claimed by another job since, so they must not be sent.
+	"""
+
+	if not names:
+		return []
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	current_datetime = now_datetime()
+	is_held = OM.name.isin(names) & (OM.claimed_by == claimed_by) & (OM.claimed_until > current_datetime)
+
+	(
+		frappe.qb.update(OM)
+		.set(OM.claimed_until, add_to_date(current_datetime, seconds=lease_duration))
+		.where(is_held)
+	).run()
+
+	# The renewed rows stay locked by the update until the commit, so no other job can claim them meanwhile.
+	held = set((frappe.qb.from_(OM).select(OM.name).where(is_held)).run(pluck="name"))
+	frappe.db.commit()
 
+	return [name for name in names if name in held]
+
+
+def release_outgoing_mails(claimed_by: str) -> None:
+	"""Releases the claims of the given claimant that were not processed."""
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	(
+		frappe.qb.update(OM)
+		.set(OM.claimed_by, None)
+		.set(OM.claimed_until, None)
+		.where(OM.claimed_by == claimed_by)
+	).run()
+
+
+def transfer_emails_to_mail_server() -> None:
+	"""Transfers the emails to the Mail Server."""
+
+	def _transfer(outbound_api: MailServerOutboundAPI, mails: list[dict], timezone: str) -> list[dict]:
+		"""Transfers a chunk of mails in a single request and returns the per-mail results. Runs in a worker thread."""
+
+		transfer_started_at = now_in_timezone(timezone)
+
+		try:
+			response = outbound_api.send_many(
+				[
+					{
+						"outgoing_mail": mail["name"],
+						"recipients": mail["recipients"],
+						"message": mail["message"],
+					}
+					for mail in mails
+				]
+			)
+		except MailServerUnavailableError:
+			# The circuit breaker is open, the mails are released without counting as a failure.
+			return [{"name": mail["name"], "unavailable": True} for mail in mails]
+		except Exception:
+			error_log = traceback.format_exc()
+			return [{"name": mail["name"], "error_log": error_log} for mail in mails]
+		finally:
 			for mail in mails:
-				try:
-					transfer_started_at = now()
-					transfer_started_after = time_diff_in_seconds(transfer_started_at, mail["submitted_at"])
+				if hasattr(mail["message"], "close"):
+					mail["message"].close()
+
+		transfer_completed_at = now_in_timezone(timezone)
+		response_map = {r["outgoing_mail"]: r for r in response or []}
+
+		results = []
+		for mail in mails:
+			r = response_map.get(mail["name"]) or {"error": "No response from the Mail Server."}
+			if token := r.get("token"):
+				results.append(
+					{
+						"name": mail["name"],
+						"token": token,
+						"transfer_started_at": transfer_started_at,
+						"transfer_completed_at": transfer_completed_at,
+					}
+				)
+			else:
+				results.append({"name": mail["name"], "error_log": r.get("error")})
 
-					token = outbound_api.send(mail["name"], mail["recipients"], mail["message"])
+		return results
 
-					transfer_completed_at = now()
-					transfer_completed_after = time_diff_in_seconds(
-						transfer_completed_at, transfer_started_at
-					)
+	def _get_chunks(mails: list[dict], chunk_size: int, max_chunk_bytes: int) -> list[list[dict]]:
+		"""Splits the mails into chunks bounded by count and total message size."""
 
-					frappe.db.set_value(
-						"Outgoing Mail",
-						mail["name"],
-						{
-							"token": token,
-							"status": "Queued",
-							"error_log": None,
-							"error_message": None,
-							"transfer_started_at": transfer_started_at,
-							"transfer_started_after": transfer_started_after,
-							"transfer_completed_at": transfer_completed_at,
-							"transfer_completed_after": transfer_completed_after,
-						},
-					)
-				except Exception:
-					batch_failures += 1
-					error_log = frappe.get_traceback(with_context=False)
-					(
-						frappe.qb.update(OM)
-						.set(OM.status, "Failed")
-						.set(OM.error_log, error_log)
-						.set(OM.error_message, None)
-						.set(OM.failed_count, OM.failed_count + 1)
-						.where(OM.name == mail["name"])
-					).run()
-
-					if batch_failures >= batch_failure_threshold:
-						return
+		chunks, chunk, chunk_bytes = [], [], 0
+		for mail in mails:
+			message_size = mail["message_size"] or 0
+			if chunk and (len(chunk) >= chunk_size or chunk_bytes + message_size > max_chunk_bytes):
+				chunks.append(chunk)
+				chunk, chunk_bytes = [], 0
+
+			chunk.append(mail)
+			chunk_bytes += message_size
+
+		if chunk:
+			chunks.append(chunk)
+
+		return chunks
+
+	def _load_chunk(chunk: list[dict]) -> list[dict]:
+		"""Loads the recipients and messages of the chunk, just before it is dispatched.
+
+		The claims on the chunk are renewed first, and mails this job no longer holds are skipped. Mails held
+		back by the outgoing rate limits are deferred without counting as a failure."""
+
+		held = set(renew_outgoing_mail_claims(claimed_by, [mail["name"] for mail in chunk]))
+
+		names, deferred = [], {}
+		for mail in chunk:
+			if mail["name"] not in held:
+				continue
+
+			if delay := get_transfer_delay(mail["domain_name"], mail["sender"]):
+				# Deferred until the bucket refills, so no job picks the mail up before that.
+				deferred[mail["name"]] = {
+					"claimed_by": None,
+					"claimed_until": None,
+					"next_retry_at": add_to_date(now_datetime(), seconds=ceil(delay)),
+				}
+			else:
+				names.append(mail["name"])
+
+		bulk_update("Outgoing Mail", deferred, update_modified=False)
+
+		if not names:
+			return []
+
+		recipients_map = {}
+		for rcpt in frappe.db.get_all(
+			"Mail Recipient",
+			filters={"parenttype": "Outgoing Mail", "parent": ["in", names]},
+			fields=["parent", "email"],
+			order_by="idx",
+		):
+			recipients_map.setdefault(rcpt.parent, {})[rcpt.email] = None
+
+		# Stored messages are passed on as open files, so that the upload streams them from disk.
+		message_store = get_message_store()
+		messages_map = {
+			mail.name: message_store.open(mail.message_key) if mail.message_key else mail.message
+			for mail in frappe.db.get_all(
+				"Outgoing Mail", filters={"name": ["in", names]}, fields=["name", "message_key", "message"]
+			)
+		}
+
+		return [
+			{"name": name, "recipients": list(recipients_map.get(name, {})), "message": messages_map[name]}
+			for name in names
+		]
+
+	batch_size = 500
+	batch_failure_threshold = 5
+	chunk_size = 50
+	max_chunk_bytes = 10 * 1024 * 1024
+	transfer_workers = max(
+		cint(frappe.db.get_single_value("Mail Client Settings", "transfer_workers", cache=True)), 1
+	)
+
+	claimed_by = frappe.generate_hash(length=10)
+
+	while True:
+		# Only the metadata of the queue is loaded here, messages are loaded per chunk by `_load_chunk`.
+		mails = claim_outgoing_mails(claimed_by, batch_size)
+
+		if not mails:
+			break
+
+		batch_failures = 0
+		server_unavailable = False
+		mails_map = {mail["name"]: mail for mail in mails}
+		# Futures whose results are not written yet, so that a failed run can still record the sent chunks.
+		unrecorded = set()
+
+		def _get_doc_updates(results: list[dict]) -> dict[str, dict]:
+			"""Returns the updates of the mails of a transferred chunk, from its per-mail results."""
+
+			doc_updates = {}
+			for result in results:
+				mail = mails_map[result["name"]]
+
+				if result.get("unavailable"):
+					doc_updates[mail["name"]] = {"claimed_by": None, "claimed_until": None}
+					continue
+
+				if error_log := result.get("error_log"):
+					doc_updates[mail["name"]] = {
+						"claimed_by": None,
+						"claimed_until": None,
+						"status": "Failed",
+						"error_log": error_log,
+						"error_message": None,
+						"failed_count": mail["failed_count"] + 1,
+						"next_retry_at": get_next_retry_at(mail["failed_count"] + 1),
+					}
+					continue
+
+				doc_updates[mail["name"]] = {
+					"claimed_by": None,
+					"claimed_until": None,
+					"next_retry_at": None,
+					"token": result["token"],
+					"status": "Queued",
+					"error_log": None,
+					"error_message": None,
+					"transfer_started_at": result["transfer_started_at"],
+					"transfer_started_after": time_diff_in_seconds(
+						result["transfer_started_at"], mail["submitted_at"]
+					),
+					"transfer_completed_at": result["transfer_completed_at"],
+					"transfer_completed_after": time_diff_in_seconds(
+						result["transfer_completed_at"], result["transfer_started_at"]
+					),
+				}
+
+			return doc_updates
+
+		try:
+			outbound_api = get_mail_server_outbound_api()
+			timezone = get_system_timezone()
+			chunks = iter(_get_chunks(mails, chunk_size, max_chunk_bytes))
+
+			with ThreadPoolExecutor(max_workers=transfer_workers) as executor:
+				# At most `transfer_workers` chunks (and their messages) are held in memory at a time.
+				in_flight = set()
+
+				def _submit_next_chunk() -> None:
+					while chunk := next(chunks, None):
+						if chunk := _load_chunk(chunk):
+							future = executor.submit(_transfer, outbound_api, chunk, timezone)
+							in_flight.add(future)
+							unrecorded.add(future)
+							return
+
+				for __ in range(transfer_workers):
+					_submit_next_chunk()
+
+				# Results are written from this thread only, as the database connection is not thread-safe.
+				while in_flight:
+					done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+
+					for future in done:
+						results = future.result()
+						bulk_update("Outgoing Mail", _get_doc_updates(results))
+						# Commit so that the results are visible before the claims could expire.
+						frappe.db.commit()
+						unrecorded.discard(future)
+
+						if any(result.get("unavailable") for result in results):
+							server_unavailable = True
+
+						# Counted per chunk, as a failed request fails every mail of the chunk at once.
+						if any(result.get("error_log") for result in results):
+							batch_failures += 1
+
+						# Stop dispatching, but still record the mails that are already in flight.
+						if batch_failures < batch_failure_threshold and not server_unavailable:
+							_submit_next_chunk()
+
+			if batch_failures >= batch_failure_threshold or server_unavailable:
+				release_outgoing_mails(claimed_by)
+				return
 
 		except Exception:
-			total_failures += 1
 			error_log = frappe.get_traceback(with_context=False)
-			frappe.log_error(title="Transfer Mails", message=error_log)
+			frappe.db.rollback()
 
-			if total_failures < max_failures:
-				time.sleep(2**total_failures)
+			# The executor waits for the chunks in flight on the way out, so their mails were sent and are
+			# recorded as such, and only the claims on the mails that were not sent are released.
+			for future in unrecorded:
+				if not future.cancelled() and future.exception() is None:
+					bulk_update("Outgoing Mail", _get_doc_updates(future.result()))
+
+			# No in-process retry, the next scheduled run picks the released mails up again.
+			frappe.log_error(title="Transfer Mails", message=error_log)
+			release_outgoing_mails(claimed_by)
+			return
 
 
 def fetch_and_update_delivery_statuses() -> None:
@@ -961,8 +1456,11 @@ def fetch_and_update_delivery_statuses() -> None:
 		query = (
 			frappe.qb.from_(OM)
 			.select(
-				OM.name.as_("outgoing_mail"),
+				OM.name,
 				OM.token,
+				OM.status,
+				OM.via_api,
+				OM.transfer_completed_at,
 			)
 			.where((OM.docstatus == 1) & (IfNull(OM.token, "") != "") & (OM.status.isin(statuses_to_update)))
 			.orderby(OM.submitted_at)
@@ -979,9 +1477,65 @@ def fetch_and_update_delivery_statuses() -> None:
 
 		try:
 			outbound_api = get_mail_server_outbound_api()
-			delivery_statuses = outbound_api.fetch_delivery_statuses(mails)
+			delivery_statuses = outbound_api.fetch_delivery_statuses(
+				[{"outgoing_mail": mail.name, "token": mail.token} for mail in mails]
+			)
 
+			mails_map = {mail.name: mail for mail in mails}
+			recipients_map = {}
+			for rcpt in frappe.db.get_all(
+				"Mail Recipient",
+				filters={"parenttype": "Outgoing Mail", "parent": ["in", list(mails_map)]},
+				fields=["name", "parent", "email"],
+			):
+				recipients_map.setdefault(rcpt.parent, []).append(rcpt)
+
+			mail_updates, recipient_updates, comments, sent_via_api, fallback = {}, {}, [], [], []
 			for delivery_status in delivery_statuses:
+				mail = mails_map.get(delivery_status["outgoing_mail"])
+
+				if not mail or mail.token != delivery_status["token"]:
+					# Rare cases that raise or need the full document are handled after the bulk update.
+					fallback.append(delivery_status)
+					continue
+
+				if mail.status == delivery_status["status"] and mail.status != "Deferred":
+					comments.append((mail.name, _("Status unchanged")))
+					ignore_mails.append(mail.name)
+					continue
+
+				if _recipients_map := {rcpt["email"]: rcpt for rcpt in delivery_status["recipients"]}:
+					for rcpt in recipients_map.get(mail.name, []):
+						if _rcpt := _recipients_map.get(rcpt.email):
+							action_at = convert_utc_to_system_timezone(
+								get_datetime(_rcpt["action_at"])
+							).replace(tzinfo=None)
+							recipient_updates[rcpt.name] = {
+								"status": _rcpt["status"],
+								"action_at": action_at,
+								"action_after": time_diff_in_seconds(action_at, mail.transfer_completed_at),
+								"retries": _rcpt["retries"],
+								"response": _rcpt["response"],
+							}
+
+				mail_updates[mail.name] = {
+					"status": delivery_status["status"],
+					"error_message": delivery_status["error_message"],
+				}
+
+				if delivery_status["status"] in statuses_to_update:
+					ignore_mails.append(mail.name)
+				elif mail.via_api and delivery_status["status"] == "Sent":
+					sent_via_api.append(mail.name)
+
+			bulk_update("Mail Recipient", recipient_updates, update_modified=False)
+			bulk_update("Outgoing Mail", mail_updates)
+			add_comments("Outgoing Mail", comments)
+
+			for name in sent_via_api:
+				frappe.get_doc("Outgoing Mail", name)._sync_with_frontend("Sent")
+
+			for delivery_status in fallback:
 				doc = frappe.get_doc("Outgoing Mail", delivery_status["outgoing_mail"])
 				doc._update_delivery_status(delivery_status)
 
@@ -995,3 +1549,7 @@ def fetch_and_update_delivery_statuses() -> None:
 
 			if total_failures < max_failures:
 				time.sleep(2**total_failures)
+
+
+def on_doctype_update() -> None:
+	frappe.db.add_index("Outgoing Mail", ["is_newsletter", "status", "sender", "submitted_at"])
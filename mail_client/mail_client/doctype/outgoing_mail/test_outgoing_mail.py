@@ -1,9 +1,147 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+from email import message_from_bytes, policy
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+from uuid_utils import uuid7
+
+from mail_client.mail_client.doctype.outgoing_mail.outgoing_mail import (
+	claim_outgoing_mails,
+	release_outgoing_mails,
+	renew_outgoing_mail_claims,
+	wrap_in_multipart,
+)
 
 
 class TestOutgoingMail(FrappeTestCase):
-	pass
+	def test_wrap_in_multipart(self):
+		raw_message = (
+			b"From: sender@example.com\r\nTo: receiver@example.com\r\nSubject: Hi\r\n"
+			b"MIME-Version: 1.0\r\nContent-Type: text/plain; charset=utf-8\r\n"
+			b"Content-Transfer-Encoding: 8bit\r\n\r\nH\xc3\xa9llo\r\n"
+		)
+		message = wrap_in_multipart(message_from_bytes(raw_message, policy=policy.SMTP))
+
+		self.assertEqual(message.get_content_type(), "multipart/mixed")
+		self.assertIsNotNone(message.get_boundary())
+		self.assertEqual((message["From"], message["Subject"]), ("sender@example.com", "Hi"))
+		self.assertEqual(message.get_all("MIME-Version"), ["1.0"])
+
+		part = message.get_payload(0)
+		self.assertEqual(part.get_content_type(), "text/plain")
+		self.assertIsNone(part["Subject"])
+		self.assertEqual(part.get_payload(decode=True), "Héllo\r\n".encode())
+
+
+class TestOutgoingMailClaims(FrappeTestCase):
+	def setUp(self):
+		self.senders = [f"{frappe.generate_hash(length=8)}@claims.test" for __ in range(2)]
+		self.submitted_at = add_to_date(now_datetime(), hours=-1)
+		self.addCleanup(self.delete_mails)
+
+	def delete_mails(self):
+		# Claims are committed, so the queued mails do not go away with the rollback of the test.
+		OM = frappe.qb.DocType("Outgoing Mail")
+		frappe.qb.from_(OM).delete().where(OM.sender.isin(self.senders)).run()
+		frappe.db.commit()
+
+	def queue_mails(self, sender: str, count: int, is_newsletter: int = 0, **values) -> list[str]:
+		"""Inserts Pending mails of the sender, each submitted after the previous one, and returns them."""
+
+		names = []
+		for __ in range(count):
+			self.submitted_at = add_to_date(self.submitted_at, seconds=1)
+			doc = frappe.new_doc("Outgoing Mail")
+			doc.name = str(uuid7())
+			doc.update(
+				{
+					"docstatus": 1,
+					"status": "Pending",
+					"folder": "Sent",
+					"sender": sender,
+					"domain_name": sender.split("@")[1],
+					"is_newsletter": is_newsletter,
+					"failed_count": 0,
+					"submitted_at": self.submitted_at,
+					**values,
+				}
+			)
+			doc.db_insert()
+			names.append(doc.name)
+
+		frappe.db.commit()
+		return names
+
+	def claim(self, claimed_by: str, limit: int) -> list[str]:
+		"""Returns the names of the mails of the test senders claimed by the claimant."""
+
+		mails = claim_outgoing_mails(claimed_by, limit)
+		return [mail["name"] for mail in mails if mail["sender"] in self.senders]
+
+	def test_claims_are_disjoint(self):
+		names = self.queue_mails(self.senders[0], 6)
+
+		first = self.claim("job-1", 4)
+		second = self.claim("job-2", 10)
+
+		self.assertEqual(len(first), 4)
+		self.assertFalse(set(first) & set(second))
+		self.assertEqual(set(first) | set(second), set(names))
+		self.assertEqual(self.claim("job-3", 10), [])
+
+	def test_senders_are_claimed_round_robin(self):
+		bulk = self.queue_mails(self.senders[0], 10)
+		single = self.queue_mails(self.senders[1], 2)
+
+		self.assertEqual(self.claim("job-1", 4), [bulk[0], single[0], bulk[1], single[1]])
+
+	def test_transactional_mails_are_claimed_first(self):
+		newsletter = self.queue_mails(self.senders[0], 10, is_newsletter=1)
+		transactional = self.queue_mails(self.senders[1], 10)
+
+		claimed = self.claim("job-1", 5)
+
+		self.assertEqual(claimed[:4], transactional[:4])
+		self.assertIn(newsletter[0], claimed)
+
+	def test_unclaimable_senders_do_not_take_the_lane(self):
+		self.senders.append(f"{frappe.generate_hash(length=8)}@claims.test")
+		self.queue_mails(self.senders[0], 2, status="Failed", failed_count=3)
+		self.queue_mails(
+			self.senders[1], 2, claimed_by="job-0", claimed_until=add_to_date(now_datetime(), hours=1)
+		)
+		claimable = self.queue_mails(self.senders[2], 2)
+
+		# A limit of 1 leaves the transactional lane a single sender, the one with the oldest claimable mail.
+		self.assertEqual(self.claim("job-1", 1), claimable[:1])
+
+	def test_expired_claims_are_reclaimed_and_not_renewed(self):
+		names = self.queue_mails(self.senders[0], 3)
+		self.assertEqual(self.claim("job-1", 3), names)
+
+		OM = frappe.qb.DocType("Outgoing Mail")
+		(
+			frappe.qb.update(OM)
+			.set(OM.claimed_until, add_to_date(now_datetime(), seconds=-1))
+			.where(OM.name == names[0])
+		).run()
+		frappe.db.commit()
+
+		self.assertEqual(self.claim("job-2", 3), [names[0]])
+		self.assertEqual(renew_outgoing_mail_claims("job-1", names), names[1:])
+		self.assertEqual(renew_outgoing_mail_claims("job-2", names), [names[0]])
+
+	def test_release(self):
+		names = self.queue_mails(self.senders[0], 2)
+		self.claim("job-1", 2)
+
+		release_outgoing_mails("job-1")
+		frappe.db.commit()
+
+		self.assertEqual(
+			frappe.get_all("Outgoing Mail", filters={"name": ["in", names]}, pluck="claimed_by"), [None, None]
+		)
+		self.assertEqual(self.claim("job-2", 2), names)
@@ -1,14 +1,226 @@
-from typing import Any
+import json
+import threading
+import weakref
+from collections.abc import Callable, Iterator
+from datetime import datetime
+from io import SEEK_END, BytesIO
+from typing import IO, Any
 from urllib.parse import urljoin
+from uuid import uuid4
 
 import frappe
+import requests
 from frappe.frappeclient import FrappeClient, FrappeOAuth2Client
-from frappe.utils import convert_utc_to_system_timezone, get_datetime
+from frappe.utils import cint, convert_utc_to_timezone, get_datetime, get_system_timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+
+class MailServerUnavailableError(frappe.ValidationError):
+	pass
+
+
+class MultipartFormData:
+	"""A multipart/form-data request body that reads its files in chunks while it is sent.
+
+	`requests` builds multipart bodies in memory from `files`; this body is streamed instead, with its
+	Content-Length known up front. Files can be given as str, bytes or seekable binary files. The body is
+	byte for byte the one `requests` builds for the same `data` and `files`, except for the filename of
+	named files, which `requests` takes from the file name instead of the field name.
+	"""
+
+	CHUNK_SIZE = 64 * 1024
+
+	def __init__(
+		self, data: dict | None, files: dict[str, str | bytes | IO[bytes]], boundary: str | None = None
+	) -> None:
+		boundary = boundary or uuid4().hex
+		self.content_type = f"multipart/form-data; boundary={boundary}"
+		self._parts: list[IO[bytes]] = []
+		self._length = 0
+
+		for name, value in (data or {}).items():
+			if value is not None:
+				self._add(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+
+		for name, file in files.items():
+			self._add(
+				f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}"\r\n\r\n'
+			)
+			self._add(file)
+			self._add("\r\n")
+
+		self._add(f"--{boundary}--\r\n")
+
+	def _add(self, part: str | bytes | IO[bytes]) -> None:
+		"""Appends a part to the body."""
+
+		if isinstance(part, str):
+			part = part.encode("utf-8")
+		if isinstance(part, bytes):
+			part = BytesIO(part)
+
+		self._length += part.seek(0, SEEK_END)
+		part.seek(0)
+		self._parts.append(part)
+
+	def __len__(self) -> int:
+		return self._length
+
+	def __iter__(self) -> Iterator[bytes]:
+		while chunk := self.read(self.CHUNK_SIZE):
+			yield chunk
+
+	def read(self, size: int = -1) -> bytes:
+		"""Reads up to `size` bytes of the body, or the rest of it if `size` is negative."""
+
+		chunks = []
+		while self._parts and size != 0:
+			if not (chunk := self._parts[0].read(size)):
+				self._parts.pop(0)
+				continue
+
+			chunks.append(chunk)
+			if size > 0:
+				size -= len(chunk)
+
+		return b"".join(chunks)
+
+
+class CircuitBreaker:
+	"""Circuit breaker for the Frappe Mail Server, with its state kept in Redis so that all workers share it.
+
+	The circuit opens after `failure_threshold` consecutive connection errors, timeouts or 5xx responses,
+	and requests then fail fast with `MailServerUnavailableError`. After `recovery_timeout` seconds a single
+	caller probes the server (half-open); the circuit closes if the probe succeeds and reopens otherwise.
+
+	Keys are built when the breaker is created, and Redis is only accessed through Lua scripts, so the
+	breaker can be used from worker threads that have no site context.
+	"""
+
+	ACQUIRE_SCRIPT = """
+	local state = redis.call('HGET', KEYS[1], 'state')
+	if not state or state == 'closed' then
+		return 'closed'
+	end
+
+	local opened_at = tonumber(redis.call('HGET', KEYS[1], 'opened_at')) or 0
+	if tonumber(redis.call('TIME')[1]) - opened_at < tonumber(ARGV[1]) then
+		return 'open'
+	end
+
+	if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[1]) then
+		redis.call('HSET', KEYS[1], 'state', 'half_open')
+		return 'probe'
+	end
+
+	return 'open'
+	"""
+
+	RECORD_FAILURE_SCRIPT = """
+	local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+	local state = redis.call('HGET', KEYS[1], 'state')
+	if failures >= tonumber(ARGV[1]) or state == 'half_open' then
+		redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', redis.call('TIME')[1])
+		redis.call('DEL', KEYS[2])
+	end
+	return failures
+	"""
+
+	RECORD_SUCCESS_SCRIPT = """
+	if redis.call('HGET', KEYS[1], 'failures') ~= '0' or redis.call('HGET', KEYS[1], 'state') ~= 'closed' then
+		redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', 0)
+		redis.call('DEL', KEYS[2])
+	end
+	"""
+
+	GET_STATE_SCRIPT = """
+	return redis.call('HGETALL', KEYS[1])
+	"""
+
+	_scripts = {}
+
+	def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: int = 30) -> None:
+		self.name = name
+		self.failure_threshold = failure_threshold
+		self.recovery_timeout = recovery_timeout
+		self.keys = [
+			frappe.cache.make_key(f"mail_server_circuit_breaker|{name}"),
+			frappe.cache.make_key(f"mail_server_circuit_breaker_probe|{name}"),
+		]
+
+	def _run(self, script: str, *args) -> Any:
+		"""Runs the given Lua script against the breaker keys."""
+
+		if script not in CircuitBreaker._scripts:
+			CircuitBreaker._scripts[script] = frappe.cache.register_script(script)
+
+		return CircuitBreaker._scripts[script](keys=self.keys, args=args)
+
+	def before_request(self, probe: Callable[[], None]) -> None:
+		"""Raises `MailServerUnavailableError` if the circuit is open. Runs the probe when it is due."""
+
+		result = self._run(self.ACQUIRE_SCRIPT, self.recovery_timeout)
+		if isinstance(result, bytes):
+			result = result.decode()
+
+		if result == "closed":
+			return
+
+		if result == "probe":
+			try:
+				probe()
+			except Exception:
+				self.record_failure()
+			else:
+				self.record_success()
+				return
+
+		# Not translated, as this may be raised from a worker thread without a site context.
+		raise MailServerUnavailableError(
+			f"Mail Server {self.name} is unavailable, requests are paused by the circuit breaker."
+		)
+
+	def record_failure(self) -> None:
+		"""Records a failed request, opening the circuit once the threshold is reached."""
+
+		self._run(self.RECORD_FAILURE_SCRIPT, self.failure_threshold)
+
+	def record_success(self) -> None:
+		"""Records a successful request, closing the circuit."""
+
+		self._run(self.RECORD_SUCCESS_SCRIPT)
+
+	def get_state(self) -> dict:
+		"""Returns the state, consecutive failures and the time the circuit was opened at."""
+
+		values = [v.decode() if isinstance(v, bytes) else v for v in self._run(self.GET_STATE_SCRIPT)]
+		state = dict(zip(values[::2], values[1::2], strict=True))
+
+		return {
+			"state": state.get("state", "closed"),
+			"failures": cint(state.get("failures")),
+			"opened_at": datetime.fromtimestamp(cint(state["opened_at"])) if state.get("opened_at") else None,
+		}
 
 
 class MailServerAPI:
 	"""Class to interact with the Frappe Mail Server."""
 
+	# (connect, read) timeouts per endpoint class.
+	TIMEOUTS = {
+		"default": (10, 60),
+		"send": (10, 300),
+		"fetch": (10, 120),
+		"dns": (10, 60),
+	}
+
+	# Clients shared by all threads of the process, one per server with the credentials it was created with.
+	# Their connection pool (the mounted adapter) is shared too, but each thread has its own session.
+	_clients: dict[str, tuple[tuple, FrappeClient | FrappeOAuth2Client]] = {}
+	_clients_lock = threading.Lock()
+	_local = threading.local()
+
 	def __init__(
 		self,
 		server: str,
@@ -21,6 +233,24 @@ class MailServerAPI:
 		self.api_secret = api_secret
 		self.access_token = access_token
 		self.client = self.get_client(self.server, self.api_key, self.api_secret, self.access_token)
+		self.circuit_breaker = CircuitBreaker(self.server)
+
+	@property
+	def session(self) -> requests.Session:
+		"""Returns the session of the current thread, which shares the connection pool of the client."""
+
+		sessions = getattr(MailServerAPI._local, "sessions", None)
+		if sessions is None:
+			# Weakly keyed, so that the sessions of an evicted client go away with it.
+			sessions = MailServerAPI._local.sessions = weakref.WeakKeyDictionary()
+
+		if (session := sessions.get(self.client)) is None:
+			adapter = self.client.session.get_adapter(self.client.url)
+			session = sessions[self.client] = requests.Session()
+			session.mount("https://", adapter)
+			session.mount("http://", adapter)
+
+		return session
 
 	@staticmethod
 	def get_client(
@@ -29,19 +259,51 @@ class MailServerAPI:
 		api_secret: str | None = None,
 		access_token: str | None = None,
 	) -> FrappeClient | FrappeOAuth2Client:
-		"""Returns a FrappeClient or FrappeOAuth2Client instance."""
+		"""Returns a process-wide FrappeClient or FrappeOAuth2Client instance with a pooled adapter."""
+
+		pool_size = cint(frappe.get_cached_doc("Mail Client Settings").http_pool_size) or 10
+		key = (api_key, api_secret, access_token, pool_size)
+
+		if (cached := MailServerAPI._clients.get(server)) and cached[0] == key:
+			return cached[1]
+
+		with MailServerAPI._clients_lock:
+			if (cached := MailServerAPI._clients.get(server)) and cached[0] == key:
+				return cached[1]
+
+			client = (
+				FrappeOAuth2Client(url=server, access_token=access_token)
+				if access_token
+				else FrappeClient(url=server, api_key=api_key, api_secret=api_secret)
+			)
+
+			# Retries are limited to connection errors for all methods, and to gateway errors for GET only,
+			# so that a send is never submitted twice.
+			retry = Retry(
+				total=3,
+				connect=3,
+				read=0,
+				status=2,
+				backoff_factor=0.5,
+				status_forcelist=[502, 503, 504],
+				allowed_methods=frozenset(["GET"]),
+				raise_on_status=False,
+			)
+			adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+			client.session.mount("https://", adapter)
+			client.session.mount("http://", adapter)
+
+			# Replaces the client of previous credentials, e.g. after the API secret was rotated.
+			MailServerAPI._clients[server] = (key, client)
 
-		if hasattr(frappe.local, "frappe_mail_server"):
-			return frappe.local.frappe_mail_server
+		return client
 
-		client = (
-			FrappeOAuth2Client(url=server, access_token=access_token)
-			if access_token
-			else FrappeClient(url=server, api_key=api_key, api_secret=api_secret)
-		)
-		frappe.local.frappe_mail_server = client
+	def evict_client(self) -> None:
+		"""Evicts the client from the cache, so that the next instance creates a new one."""
 
-		return client
+		with MailServerAPI._clients_lock:
+			if (cached := MailServerAPI._clients.get(self.server)) and cached[1] is self.client:
+				del MailServerAPI._clients[self.server]
 
 	def request(
 		self,
@@ -52,9 +314,41 @@ class MailServerAPI:
 		json: dict | None = None,
 		files: dict | None = None,
 		headers: dict[str, str] | None = None,
-		timeout: int | tuple[int, int] = (60, 120),
+		timeout: int | tuple[int, int] | None = None,
 	) -> Any | None:
-		"""Makes an HTTP request to the Frappe Mail Server."""
+		"""Makes an HTTP request to the Frappe Mail Server, guarded by the circuit breaker."""
+
+		self.circuit_breaker.before_request(probe=self._probe)
+
+		try:
+			response = self._send(method, endpoint, params, data, json, files, headers, timeout)
+		except (requests.ConnectionError, requests.Timeout):
+			self.circuit_breaker.record_failure()
+			raise
+
+		if response.status_code >= 500:
+			self.circuit_breaker.record_failure()
+		else:
+			self.circuit_breaker.record_success()
+
+		if response.status_code == 401:
+			# The credentials were rejected, so the client is not reused with them.
+			self.evict_client()
+
+		return self.client.post_process(response)
+
+	def _send(
+		self,
+		method: str,
+		endpoint: str,
+		params: dict | None = None,
+		data: dict | None = None,
+		json: dict | None = None,
+		files: dict | None = None,
+		headers: dict[str, str] | None = None,
+		timeout: int | tuple[int, int] | None = None,
+	) -> requests.Response:
+		"""Sends an HTTP request to the Frappe Mail Server and returns the raw response."""
 
 		url = urljoin(self.client.url, endpoint)
 
@@ -62,9 +356,10 @@ class MailServerAPI:
 		headers.update(self.client.headers)
 
 		if files:
-			headers.pop("content-type", None)
+			data, files = MultipartFormData(data, files), None
+			headers["content-type"] = data.content_type
 
-		response = self.client.session.request(
+		return self.session.request(
 			method=method,
 			url=url,
 			params=params,
@@ -72,10 +367,15 @@ class MailServerAPI:
 			json=json,
 			files=files,
 			headers=headers,
-			timeout=timeout,
+			timeout=timeout or self.TIMEOUTS["default"],
 		)
 
-		return self.client.post_process(response)
+	def _probe(self) -> None:
+		"""Probes the Frappe Mail Server the same way as `MailServerAuthAPI.validate`, bypassing the circuit breaker."""
+
+		response = self._send("POST", "/api/method/mail_server.api.auth.validate", timeout=(5, 10))
+		response.raise_for_status()
+		self.client.post_process(response)
 
 
 class MailServerAuthAPI(MailServerAPI):
@@ -103,27 +403,27 @@ class MailServerDomainAPI(MailServerAPI):
 			"dkim_public_key": dkim_public_key,
 			"mail_client_host": mail_client_host,
 		}
-		return self.request("POST", endpoint=endpoint, data=data)
+		return self.request("POST", endpoint=endpoint, data=data, timeout=self.TIMEOUTS["dns"])
 
 	def get_dns_records(self, domain_name: str) -> list[dict] | None:
 		"""Returns the DNS records for a domain from the Frappe Mail Server."""
 
 		endpoint = "/api/method/mail_server.api.domain.get_dns_records"
 		params = {"domain_name": domain_name}
-		return self.request("GET", endpoint=endpoint, params=params)
+		return self.request("GET", endpoint=endpoint, params=params, timeout=self.TIMEOUTS["dns"])
 
 	def verify_dns_records(self, domain_name: str) -> list[str] | None:
 		"""Verifies the DNS records for a domain in the Frappe Mail Server."""
 
 		endpoint = "/api/method/mail_server.api.domain.verify_dns_records"
 		data = {"domain_name": domain_name}
-		return self.request("POST", endpoint=endpoint, data=data)
+		return self.request("POST", endpoint=endpoint, data=data, timeout=self.TIMEOUTS["dns"])
 
 
 class MailServerOutboundAPI(MailServerAPI):
 	"""Class to send outbound emails using the Frappe Mail Server."""
 
-	def send(self, outgoing_mail: str, recipients: str | list[str], message: str) -> str:
+	def send(self, outgoing_mail: str, recipients: str | list[str], message: str | bytes | IO[bytes]) -> str:
 		"""Sends an email message to the recipients using the Frappe Mail Server."""
 
 		if isinstance(recipients, list):
@@ -131,36 +431,74 @@ class MailServerOutboundAPI(MailServerAPI):
 
 		endpoint = "/api/method/mail_server.api.outbound.send"
 		data = {"outgoing_mail": outgoing_mail, "recipients": recipients}
-		return self.request("POST", endpoint=endpoint, data=data, files={"message": message})
+		return self.request(
+			"POST", endpoint=endpoint, data=data, files={"message": message}, timeout=self.TIMEOUTS["send"]
+		)
+
+	def send_many(self, mails: list[dict]) -> list[dict]:
+		"""Sends multiple email messages in a single request using the Frappe Mail Server.
+
+		Each mail is a dict with `outgoing_mail`, `recipients` and `message`. Returns a dict per mail
+		with `outgoing_mail` and either the `token` or the `error`.
+		"""
+
+		manifest, files = [], {}
+		for mail in mails:
+			recipients = mail["recipients"]
+			if isinstance(recipients, list):
+				recipients = ",".join(recipients)
+
+			manifest.append({"outgoing_mail": mail["outgoing_mail"], "recipients": recipients})
+			files[mail["outgoing_mail"]] = mail["message"]
+
+		endpoint = "/api/method/mail_server.api.outbound.send_many"
+		data = {"mails": json.dumps(manifest)}
+		return self.request("POST", endpoint=endpoint, data=data, files=files, timeout=self.TIMEOUTS["send"])
 
 	def fetch_delivery_status(self, outgoing_mail: str, token: str) -> dict:
 		"""Fetches the delivery status of an email from the Frappe Mail Server."""
 
 		endpoint = "/api/method/mail_server.api.outbound.fetch_delivery_status"
 		data = {"outgoing_mail": outgoing_mail, "token": token}
-		return self.request("GET", endpoint=endpoint, data=data)
+		return self.request("GET", endpoint=endpoint, data=data, timeout=self.TIMEOUTS["fetch"])
 
 	def fetch_delivery_statuses(self, data: list[dict]) -> list[dict]:
 		"""Fetches the delivery statuses of emails from the Frappe Mail Server."""
 
 		endpoint = "/api/method/mail_server.api.outbound.fetch_delivery_statuses"
-		return self.request("POST", endpoint=endpoint, json=data)
+		return self.request("POST", endpoint=endpoint, json=data, timeout=self.TIMEOUTS["fetch"])
 
 
 class MailServerInboundAPI(MailServerAPI):
 	"""Class to receive inbound emails from the Frappe Mail Server."""
 
-	def fetch(self, limit: int = 100, last_synced_at: str | None = None) -> dict[str, list[dict] | str]:
-		"""Fetches inbound emails from the Frappe Mail Server."""
+	def fetch(
+		self, limit: int = 100, last_synced_at: str | None = None, timezone: str | None = None
+	) -> dict[str, list[dict] | str]:
+		"""Fetches inbound emails from the Frappe Mail Server.
+
+		`timezone` defaults to the system timezone, and is passed when fetching from a worker thread.
+		"""
 
 		endpoint = "/api/method/mail_server.api.inbound.fetch"
 		data = {"limit": limit, "last_synced_at": last_synced_at}
-		result = self.request("GET", endpoint=endpoint, data=data)
-		result["last_synced_at"] = convert_utc_to_system_timezone(get_datetime(result["last_synced_at"]))
+		result = self.request("GET", endpoint=endpoint, data=data, timeout=self.TIMEOUTS["fetch"])
+		result["last_synced_at"] = convert_utc_to_timezone(
+			get_datetime(result["last_synced_at"]), timezone or get_system_timezone()
+		)
 
 		return result
 
 
+@frappe.whitelist()
+def get_circuit_breaker_state() -> dict:
+	"""Returns the state of the circuit breaker of the configured Mail Server, for monitoring."""
+
+	frappe.only_for("System Manager")
+	mail_server_host = frappe.db.get_single_value("Mail Client Settings", "mail_server_host")
+	return CircuitBreaker(mail_server_host).get_state()
+
+
 def get_mail_server_api() -> "MailServerAPI":
 	"""Returns a MailServerAPI instance."""
 
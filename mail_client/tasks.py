@@ -1,6 +1,11 @@
 import frappe
+from frappe.utils import cint
 
 from mail_client.mail_client.doctype.incoming_mail.incoming_mail import fetch_emails_from_mail_server
+from mail_client.mail_client.doctype.newsletter_campaign.newsletter_campaign import (
+	fetch_and_update_newsletter_delivery_statuses,
+	transfer_newsletter_campaigns,
+)
 from mail_client.mail_client.doctype.outgoing_mail.outgoing_mail import (
 	fetch_and_update_delivery_statuses,
 	transfer_emails_to_mail_server,
@@ -12,7 +17,20 @@ def enqueue_transfer_emails_to_mail_server() -> None:
 	"Called by the scheduler to enqueue the `transfer_emails_to_mail_server` job."
 
 	frappe.session.user = "Administrator"
-	enqueue_job(transfer_emails_to_mail_server, queue="long")
+	transfer_jobs = cint(frappe.db.get_single_value("Mail Client Settings", "transfer_jobs", cache=True))
+
+	# Each job claims a disjoint slice of the queue, see `claim_outgoing_mails`.
+	for i in range(max(transfer_jobs, 1)):
+		enqueue_job(
+			transfer_emails_to_mail_server, job_id=f"transfer_emails_to_mail_server|{i}", queue="long"
+		)
+
+
+def enqueue_transfer_newsletter_campaigns() -> None:
+	"Called by the scheduler to enqueue the `transfer_newsletter_campaigns` job."
+
+	frappe.session.user = "Administrator"
+	enqueue_job(transfer_newsletter_campaigns, queue="long")
 
 
 @frappe.whitelist()
@@ -23,6 +41,13 @@ def enqueue_fetch_and_update_delivery_statuses() -> None:
 	enqueue_job(fetch_and_update_delivery_statuses, queue="long")
 
 
+def enqueue_fetch_and_update_newsletter_delivery_statuses() -> None:
+	"Called by the scheduler to enqueue the `fetch_and_update_newsletter_delivery_statuses` job."
+
+	frappe.session.user = "Administrator"
+	enqueue_job(fetch_and_update_newsletter_delivery_statuses, queue="long")
+
+
 @frappe.whitelist()
 def enqueue_fetch_emails_from_mail_server() -> None:
 	"Called by the scheduler to enqueue the `fetch_emails_from_mail_server` job."
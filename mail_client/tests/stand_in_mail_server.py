@@ -0,0 +1,142 @@
+import json
+import threading
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+
+class StandInMailServer:
+	"""A local stand-in for the Frappe Mail Server, serving the endpoints `MailServerAPI` uses from a thread.
+
+	Mails sent through `send` and `send_many` are recorded in `mails` and answered with a token, except for
+	mails without recipients, which are answered with an error. `fetch` serves the pages queued in
+	`inbound_pages`, and the next `fail_next` requests are answered with a 503. Once `api_secret` is set,
+	requests authenticated with another secret are answered with a 401. Every request is recorded in
+	`requests`.
+
+	    with StandInMailServer() as server:
+	        api = MailServerOutboundAPI(server.url, api_key="key", api_secret="secret")
+	"""
+
+	def __init__(self) -> None:
+		self.requests: list[dict] = []
+		self.mails: list[dict] = []
+		self.inbound_pages: list[list[dict]] = []
+		self.fail_next = 0
+		self.api_secret: str | None = None
+		self.lock = threading.Lock()
+		self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._get_handler())
+		self._server.daemon_threads = True
+		self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+		self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+	def __enter__(self) -> "StandInMailServer":
+		self._thread.start()
+		return self
+
+	def __exit__(self, *args) -> None:
+		self._server.shutdown()
+		self._server.server_close()
+		self._thread.join()
+
+	def handle(
+		self, method: str, path: str, fields: dict, files: dict, authorization: str | None = None
+	) -> tuple[int, dict]:
+		"""Returns the status and the JSON response of a request."""
+
+		with self.lock:
+			self.requests.append({"method": method, "path": path, "fields": fields, "files": files})
+
+			if self.fail_next:
+				self.fail_next -= 1
+				return 503, {"exc": json.dumps(["Service Unavailable"])}
+
+		if self.api_secret and not (authorization or "").endswith(f":{self.api_secret}"):
+			return 401, {"exc_type": "AuthenticationError", "exc": json.dumps(["Invalid credentials"])}
+
+		endpoint = path.rsplit("/", 1)[-1]
+
+		if endpoint == "mail_server.api.auth.validate":
+			return 200, {"message": None}
+
+		if endpoint == "mail_server.api.outbound.send":
+			mail = {"outgoing_mail": fields["outgoing_mail"], "recipients": fields["recipients"]}
+			return 200, {"message": self._accept(mail, files["message"])["token"]}
+
+		if endpoint == "mail_server.api.outbound.send_many":
+			mails = json.loads(fields["mails"])
+			return 200, {"message": [self._accept(mail, files[mail["outgoing_mail"]]) for mail in mails]}
+
+		if endpoint == "mail_server.api.inbound.fetch":
+			with self.lock:
+				mails = self.inbound_pages.pop(0) if self.inbound_pages else []
+
+			last_synced_at = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+			return 200, {"message": {"mails": mails, "last_synced_at": last_synced_at}}
+
+		return 404, {"exc": json.dumps([f"Unknown endpoint {endpoint}"])}
+
+	def _accept(self, mail: dict, message: bytes) -> dict:
+		"""Records the mail and returns its result."""
+
+		if not mail["recipients"]:
+			return {"outgoing_mail": mail["outgoing_mail"], "error": "No recipients."}
+
+		token = uuid4().hex
+		with self.lock:
+			self.mails.append({**mail, "message": message, "token": token})
+
+		return {"outgoing_mail": mail["outgoing_mail"], "token": token}
+
+	def _get_handler(self) -> type[BaseHTTPRequestHandler]:
+		"""Returns the request handler class bound to this server."""
+
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self) -> None:
+				self._handle()
+
+			def do_POST(self) -> None:
+				self._handle()
+
+			def log_message(self, format: str, *args) -> None:
+				pass
+
+			def _handle(self) -> None:
+				url = urlparse(self.path)
+				body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+				content_type = self.headers.get("Content-Type") or ""
+				fields = {key: values[0] for key, values in parse_qs(url.query).items()}
+				files = {}
+
+				if content_type.startswith("multipart/form-data"):
+					message = BytesParser(policy=HTTP).parsebytes(
+						f"Content-Type: {content_type}\r\n\r\n".encode() + body
+					)
+					for part in message.iter_parts():
+						name = part.get_param("name", header="content-disposition")
+						if part.get_param("filename", header="content-disposition"):
+							files[name] = part.get_payload(decode=True)
+						else:
+							fields[name] = part.get_payload(decode=True).decode()
+				elif content_type.startswith("application/json"):
+					fields["json"] = json.loads(body)
+				elif body:
+					fields.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+
+				status, response = server.handle(
+					self.command, url.path, fields, files, self.headers.get("Authorization")
+				)
+				data = json.dumps(response).encode()
+
+				self.send_response(status)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(data)))
+				self.end_headers()
+				self.wfile.write(data)
+
+		return Handler
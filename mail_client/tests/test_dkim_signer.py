@@ -0,0 +1,111 @@
+from base64 import b64encode
+from io import BytesIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+import dkim
+import frappe
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from frappe.tests.utils import FrappeTestCase
+
+from mail_client.utils import dkim_signer
+from mail_client.utils.dkim_signer import sign_message
+
+try:
+	import nacl  # noqa: F401
+
+	HAS_NACL = True
+except ImportError:
+	# dkimpy verifies Ed25519 signatures with PyNaCl.
+	HAS_NACL = False
+
+MESSAGE = (
+	b"From: Sender <sender@example.com>\r\n"
+	b"To: a@example.org\r\n"
+	b"To: b@example.org\r\n"
+	b"Subject:  A subject\r\n"
+	b"\tfolded over   two lines\r\n"
+	b"Date: Sun, 18 Oct 2026 10:00:00 +0000\r\n"
+	b"Message-ID: <test@example.com>\r\n"
+	b"X-Unsigned: value\r\n"
+	b"\r\n"
+	b"Hello,  \r\n"
+	b"\r\n"
+	b"An 8-bit line: \xe2\x82\xac\r\n"
+	b"\r\n"
+	b"\r\n"
+)
+
+
+def get_dns_record(private_key: rsa.RSAPrivateKey | ed25519.Ed25519PrivateKey) -> bytes:
+	"""Returns the DKIM TXT record publishing the public key of the private key."""
+
+	public_key = private_key.public_key()
+
+	if isinstance(private_key, ed25519.Ed25519PrivateKey):
+		key_type = "ed25519"
+		public_bytes = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+	else:
+		key_type = "rsa"
+		public_bytes = public_key.public_bytes(
+			serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+		)
+
+	return f"v=DKIM1; k={key_type}; p={b64encode(public_bytes).decode()}".encode()
+
+
+class TestSignMessage(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+	def verify(self, message: bytes, private_key=None, linesep: bytes = b"\r\n") -> bool:
+		"""Signs the message and returns whether dkimpy verifies the signature."""
+
+		private_key = private_key or self.rsa_key
+		dkim_key = frappe._dict(version="test", private_key=private_key)
+		signature = sign_message(message, "example.com", dkim_key=dkim_key)
+		signed = b"DKIM-Signature: " + signature.encode() + linesep + message
+		record = get_dns_record(private_key)
+
+		return dkim.verify(signed, dnsfunc=lambda name, timeout=5: record)
+
+	def test_rsa(self):
+		self.assertTrue(self.verify(MESSAGE))
+
+	def test_message_as_file(self):
+		dkim_key = frappe._dict(version="test", private_key=self.rsa_key)
+		file = BytesIO(MESSAGE)
+		file.seek(10)
+
+		signature = sign_message(file, "example.com", dkim_key=dkim_key)
+		signed = b"DKIM-Signature: " + signature.encode() + b"\r\n" + MESSAGE
+
+		self.assertTrue(dkim.verify(signed, dnsfunc=lambda name, timeout=5: get_dns_record(self.rsa_key)))
+
+	def test_lf_line_endings(self):
+		self.assertTrue(self.verify(MESSAGE.replace(b"\r\n", b"\n"), linesep=b"\n"))
+
+	def test_body_split_across_chunks(self):
+		# Small chunks split CRLFs and trailing empty lines across chunk boundaries.
+		for chunk_size in (1, 2, 3, 7):
+			with self.subTest(chunk_size=chunk_size):
+				with patch.object(dkim_signer, "BODY_HASH_CHUNK_SIZE", chunk_size):
+					self.assertTrue(self.verify(MESSAGE))
+					self.assertTrue(self.verify(MESSAGE.replace(b"\r\n", b"\n"), linesep=b"\n"))
+
+	def test_empty_body(self):
+		self.assertTrue(self.verify(MESSAGE.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"))
+
+	def test_tampered_body(self):
+		dkim_key = frappe._dict(version="test", private_key=self.rsa_key)
+		signature = sign_message(MESSAGE, "example.com", dkim_key=dkim_key)
+		signed = b"DKIM-Signature: " + signature.encode() + b"\r\n" + MESSAGE.replace(b"Hello", b"Hallo")
+
+		self.assertFalse(dkim.verify(signed, dnsfunc=lambda name, timeout=5: get_dns_record(self.rsa_key)))
+
+	@skipUnless(HAS_NACL, "PyNaCl is not installed")
+	def test_ed25519(self):
+		self.assertTrue(self.verify(MESSAGE, private_key=ed25519.Ed25519PrivateKey.generate()))
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+from io import BytesIO
+from unittest.mock import patch
+
+import requests
+import urllib3.filepost
+from frappe.tests.utils import FrappeTestCase
+
+from mail_client.mail_server import (
+	CircuitBreaker,
+	MailServerAPI,
+	MailServerInboundAPI,
+	MailServerOutboundAPI,
+	MailServerUnavailableError,
+	MultipartFormData,
+)
+from mail_client.tests.stand_in_mail_server import StandInMailServer
+
+
+def get_requests_body(data: dict, files: dict, boundary: str) -> tuple[bytes, str]:
+	"""Returns the body and content type `requests` builds for the data and files."""
+
+	with patch.object(urllib3.filepost, "choose_boundary", return_value=boundary):
+		request = requests.Request("POST", "http://localhost", data=data, files=files).prepare()
+
+	return request.body, request.headers["Content-Type"]
+
+
+class TestMultipartFormData(FrappeTestCase):
+	def test_body_matches_requests(self):
+		data = {"mails": json.dumps([{"outgoing_mail": "mail-1", "recipients": "a@example.com"}]), "x": None}
+		files = {
+			"mail-1": b"Subject: Test\r\n\r\n\xe2\x82\xac 8-bit body\r\n",
+			"mail-2": "Subject: Test\r\n\r\n",
+		}
+
+		body = MultipartFormData(data, files, boundary="b0undary")
+		expected_body, expected_content_type = get_requests_body(data, files, "b0undary")
+
+		self.assertEqual(body.content_type, expected_content_type)
+		self.assertEqual(len(body), len(expected_body))
+		self.assertEqual(body.read(), expected_body)
+
+	def test_files_are_streamed_in_chunks(self):
+		message = bytes(range(256)) * 1024
+		file = BytesIO(message)
+		file.seek(100)
+
+		body = MultipartFormData({"outgoing_mail": "mail-1"}, {"message": file}, boundary="b0undary")
+		expected_body, __ = get_requests_body({"outgoing_mail": "mail-1"}, {"message": message}, "b0undary")
+		chunks = list(body)
+
+		self.assertGreater(len(chunks), 1)
+		self.assertTrue(all(len(chunk) <= MultipartFormData.CHUNK_SIZE for chunk in chunks))
+		self.assertEqual(b"".join(chunks), expected_body)
+
+
+class TestMailServerAPI(FrappeTestCase):
+	def setUp(self):
+		# Each stand-in listens on a new port, so every test starts with a closed circuit breaker.
+		self.server = StandInMailServer().__enter__()
+		self.addCleanup(self.server.__exit__)
+		self.outbound_api = MailServerOutboundAPI(self.server.url, api_key="key", api_secret="secret")
+
+	def test_send_many(self):
+		mails = [
+			{
+				"outgoing_mail": "mail-1",
+				"recipients": ["a@example.com", "b@example.com"],
+				"message": b"Subject: One\r\n\r\n\xe2\x82\xac\r\n",
+			},
+			{
+				"outgoing_mail": "mail-2",
+				"recipients": "c@example.com",
+				"message": BytesIO(b"Subject: Two\r\n\r\n"),
+			},
+			{"outgoing_mail": "mail-3", "recipients": [], "message": b"Subject: Three\r\n\r\n"},
+		]
+
+		results = {result["outgoing_mail"]: result for result in self.outbound_api.send_many(mails)}
+		received = {mail["outgoing_mail"]: mail for mail in self.server.mails}
+
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(results["mail-1"]["token"], received["mail-1"]["token"])
+		self.assertEqual(results["mail-2"]["token"], received["mail-2"]["token"])
+		self.assertEqual(results["mail-3"]["error"], "No recipients.")
+		self.assertEqual(received["mail-1"]["recipients"], "a@example.com,b@example.com")
+		self.assertEqual(received["mail-1"]["message"], b"Subject: One\r\n\r\n\xe2\x82\xac\r\n")
+		self.assertEqual(received["mail-2"]["message"], b"Subject: Two\r\n\r\n")
+
+	def test_fetch(self):
+		inbound_api = MailServerInboundAPI(self.server.url, api_key="key", api_secret="secret")
+		self.server.inbound_pages.append([{"incoming_mail_log": "log-1", "message": "Subject: One\r\n\r\n"}])
+
+		result = inbound_api.fetch(timezone="Asia/Kolkata")
+
+		self.assertEqual(result["mails"][0]["incoming_mail_log"], "log-1")
+		self.assertEqual(result["last_synced_at"].tzinfo.zone, "Asia/Kolkata")
+		self.assertEqual(inbound_api.fetch()["mails"], [])
+
+	def test_circuit_breaker(self):
+		self.outbound_api.circuit_breaker = CircuitBreaker(
+			self.server.url, failure_threshold=2, recovery_timeout=1
+		)
+		mails = [
+			{"outgoing_mail": "mail-1", "recipients": "a@example.com", "message": b"Subject: One\r\n\r\n"}
+		]
+
+		self.server.fail_next = 2
+		for __ in range(2):
+			with self.assertRaises(Exception):
+				self.outbound_api.send_many(mails)
+
+		# Open: the request fails fast, without reaching the server.
+		with self.assertRaises(MailServerUnavailableError):
+			self.outbound_api.send_many(mails)
+
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertEqual(self.outbound_api.circuit_breaker.get_state()["state"], "open")
+
+		# Half-open: a probe is sent once the recovery timeout has passed, and closes the circuit.
+		time.sleep(2)
+		self.outbound_api.send_many(mails)
+
+		self.assertEqual(
+			[request["path"].rsplit("/", 1)[-1] for request in self.server.requests[2:]],
+			["mail_server.api.auth.validate", "mail_server.api.outbound.send_many"],
+		)
+		self.assertEqual(self.outbound_api.circuit_breaker.get_state()["state"], "closed")
+		self.assertEqual(len(self.server.mails), 1)
+
+	def test_session_per_thread(self):
+		sessions = []
+		thread = threading.Thread(target=lambda: sessions.append(self.outbound_api.session))
+		thread.start()
+		thread.join()
+
+		self.assertIs(self.outbound_api.session, self.outbound_api.session)
+		self.assertIsNot(sessions[0], self.outbound_api.session)
+
+		# The sessions of all threads share the connection pool of the client.
+		adapter = self.outbound_api.client.session.get_adapter(self.server.url)
+		self.assertIs(sessions[0].get_adapter(self.server.url), adapter)
+		self.assertIs(self.outbound_api.session.get_adapter(self.server.url), adapter)
+
+	def test_new_credentials_replace_client(self):
+		rotated_api = MailServerOutboundAPI(self.server.url, api_key="key", api_secret="rotated")
+
+		self.assertIsNot(rotated_api.client, self.outbound_api.client)
+		self.assertIs(MailServerAPI._clients[self.server.url][1], rotated_api.client)
+		self.assertIs(
+			MailServerOutboundAPI(self.server.url, api_key="key", api_secret="rotated").client,
+			rotated_api.client,
+		)
+
+	def test_rejected_credentials_evict_client(self):
+		self.server.api_secret = "rotated"
+		mails = [
+			{"outgoing_mail": "mail-1", "recipients": "a@example.com", "message": b"Subject: One\r\n\r\n"}
+		]
+
+		with self.assertRaises(Exception):
+			self.outbound_api.send_many(mails)
+
+		self.assertNotIn(self.server.url, MailServerAPI._clients)
+		self.assertEqual(self.server.mails, [])
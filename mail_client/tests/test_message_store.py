@@ -0,0 +1,77 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from mail_client.utils.message_store import (
+	COMPRESSED_BODY_PREFIX,
+	DELETE_GRACE_PERIOD,
+	LocalMessageStore,
+	compress_body,
+	compressed_bodies,
+	decompress_body,
+)
+
+BODY_HTML = "<p>" + "A paragraph of a newsletter that repeats itself. " * 100 + "</p>"
+
+
+class TestBodyCompression(FrappeTestCase):
+	def set_compress_messages(self, value: int) -> None:
+		frappe.db.set_single_value("Mail Client Settings", "compress_messages", value)
+		frappe.clear_document_cache("Mail Client Settings", "Mail Client Settings")
+
+	def test_compress_body(self):
+		self.set_compress_messages(1)
+		compressed = compress_body(BODY_HTML)
+
+		self.assertTrue(compressed.startswith(COMPRESSED_BODY_PREFIX))
+		self.assertLess(len(compressed), len(BODY_HTML))
+		self.assertEqual(decompress_body(compressed), BODY_HTML)
+
+		# Bodies that compression would not make smaller are stored as they are.
+		self.assertEqual(compress_body("Hi"), "Hi")
+		self.assertIsNone(compress_body(None))
+
+	def test_compression_disabled(self):
+		self.set_compress_messages(0)
+
+		self.assertEqual(compress_body(BODY_HTML), BODY_HTML)
+		self.assertEqual(decompress_body(BODY_HTML), BODY_HTML)
+
+	def test_body_that_looks_compressed(self):
+		self.set_compress_messages(0)
+		body = f"{COMPRESSED_BODY_PREFIX} is a prefix"
+
+		self.assertEqual(decompress_body(compress_body(body)), body)
+
+	def test_compressed_bodies(self):
+		self.set_compress_messages(1)
+		doc = frappe.new_doc("Incoming Mail")
+		doc.body_html, doc.body_plain = BODY_HTML, "Hi"
+
+		with compressed_bodies(doc):
+			self.assertEqual(decompress_body(doc.body_html), BODY_HTML)
+			self.assertNotEqual(doc.body_html, BODY_HTML)
+			self.assertEqual(doc.body_plain, "Hi")
+
+		self.assertEqual((doc.body_html, doc.body_plain), (BODY_HTML, "Hi"))
+
+
+class TestLocalMessageStore(FrappeTestCase):
+	def test_delete(self):
+		with TemporaryDirectory() as root:
+			message_store = LocalMessageStore(root)
+			key, __ = message_store.put(b"Subject: Hi\r\n\r\nHello\r\n")
+			path = message_store._get_path(key)
+
+			# Just stored, e.g. for a row that is not committed yet.
+			message_store.delete([key])
+			self.assertEqual(message_store.get(key), b"Subject: Hi\r\n\r\nHello\r\n")
+
+			stored_at = time.time() - DELETE_GRACE_PERIOD - 60
+			os.utime(path, (stored_at, stored_at))
+			message_store.delete([key])
+			self.assertFalse(os.path.exists(path))
+			self.assertEqual(os.listdir(os.path.dirname(path)), [])
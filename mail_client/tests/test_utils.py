@@ -0,0 +1,52 @@
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from mail_client.utils import bulk_update
+
+
+class TestBulkUpdate(FrappeTestCase):
+	def setUp(self):
+		self.todos = [
+			frappe.get_doc({"doctype": "ToDo", "description": f"Task {i}", "priority": "Low"}).insert()
+			for i in range(3)
+		]
+
+	def get_values(self) -> dict[str, tuple]:
+		return {
+			todo.name: (todo.description, todo.priority, todo.modified)
+			for todo in frappe.get_all(
+				"ToDo",
+				filters={"name": ["in", [todo.name for todo in self.todos]]},
+				fields=["name", "description", "priority", "modified"],
+			)
+		}
+
+	def test_bulk_update(self):
+		first, second, third = self.todos
+		before = self.get_values()
+
+		# A chunk size of 2 splits the updates over two statements.
+		bulk_update(
+			"ToDo",
+			{
+				first.name: {"description": "First", "priority": "High"},
+				second.name: {"priority": "Medium"},
+				third.name: {"description": "Third"},
+			},
+			chunk_size=2,
+		)
+		values = self.get_values()
+
+		self.assertEqual(values[first.name][:2], ("First", "High"))
+		self.assertEqual(values[second.name][:2], ("Task 1", "Medium"))
+		self.assertEqual(values[third.name][:2], ("Third", "Low"))
+		self.assertTrue(all(values[name][2] > before[name][2] for name in values))
+
+	def test_bulk_update_without_modified(self):
+		before = self.get_values()
+
+		bulk_update("ToDo", {todo.name: {"priority": "High"} for todo in self.todos}, update_modified=False)
+		after = self.get_values()
+
+		for name, (description, priority, modified) in after.items():
+			self.assertEqual((description, priority, modified), (before[name][0], "High", before[name][2]))
@@ -1,29 +1,27 @@
-import re
 from collections.abc import Callable
 from datetime import datetime
 from email.utils import parsedate_to_datetime as parsedate
 
 import frappe
 import pytz
-from bs4 import BeautifulSoup
 from frappe import _
-from frappe.utils import convert_utc_to_system_timezone, get_datetime, get_datetime_str, get_system_timezone
+from frappe.query_builder import Case
+from frappe.utils import (
+	convert_utc_to_system_timezone,
+	get_datetime,
+	get_datetime_str,
+	get_system_timezone,
+	now,
+)
 from frappe.utils.background_jobs import get_jobs
-from frappe.utils.caching import request_cache
+
+from mail_client.utils.html_to_text import get_cached_text
 
 
-@request_cache
 def convert_html_to_text(html: str) -> str:
 	"""Returns plain text from HTML content."""
 
-	text = ""
-
-	if html:
-		soup = BeautifulSoup(html, "html.parser")
-		text = soup.get_text()
-		text = re.sub(r"\s+", " ", text).strip()
-
-	return text
+	return get_cached_text(html) if html else ""
 
 
 def get_in_reply_to_mail(
@@ -53,8 +51,12 @@ def get_in_reply_to(
 	return None
 
 
-def enqueue_job(method: str | Callable, **kwargs) -> None:
-	"""Enqueues a background job."""
+def enqueue_job(method: str | Callable, job_id: str | None = None, **kwargs) -> None:
+	"""Enqueues a background job. If `job_id` is given, the job is deduplicated by it instead of the method."""
+
+	if job_id:
+		frappe.enqueue(method, job_id=job_id, deduplicate=True, **kwargs)
+		return
 
 	site = frappe.local.site
 	jobs = get_jobs(site=site)
@@ -62,6 +64,43 @@ def enqueue_job(method: str | Callable, **kwargs) -> None:
 		frappe.enqueue(method, **kwargs)
 
 
+def bulk_update(
+	doctype: str,
+	doc_updates: dict[str, dict],
+	chunk_size: int = 100,
+	update_modified: bool = True,
+) -> None:
+	"""Updates multiple documents with one `UPDATE ... SET field = CASE name ... END` statement per chunk.
+
+	`doc_updates` maps document names to the field values to be set on them.
+	"""
+
+	if not doc_updates:
+		return
+
+	DT = frappe.qb.DocType(doctype)
+	modified, modified_by = now(), frappe.session.user
+	items = list(doc_updates.items())
+
+	for i in range(0, len(items), chunk_size):
+		chunk = items[i : i + chunk_size]
+		fields = list(dict.fromkeys(field for __, values in chunk for field in values))
+		query = frappe.qb.update(DT).where(DT.name.isin([name for name, __ in chunk]))
+
+		for field in fields:
+			case = Case()
+			for name, values in chunk:
+				if field in values:
+					case = case.when(DT.name == name, values[field])
+
+			query = query.set(DT[field], case.else_(DT[field]))
+
+		if update_modified:
+			query = query.set(DT.modified, modified).set(DT.modified_by, modified_by)
+
+		query.run()
+
+
 def convert_to_utc(date_time: datetime | str, from_timezone: str | None = None) -> "datetime":
 	"""Converts the given datetime to UTC timezone."""
 
@@ -73,6 +112,12 @@ def convert_to_utc(date_time: datetime | str, from_timezone: str | None = None)
 	return dt.astimezone(pytz.utc)
 
 
+def now_in_timezone(timezone: str) -> "datetime":
+	"""Returns the current naive datetime in the given timezone. Safe to call outside of a request context."""
+
+	return datetime.now(pytz.timezone(timezone)).replace(tzinfo=None)
+
+
 def parsedate_to_datetime(date_header: str) -> "datetime":
 	"""Returns datetime object from parsed date header."""
 
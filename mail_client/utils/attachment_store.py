@@ -0,0 +1,181 @@
+import os
+from base64 import b64decode
+from hashlib import sha256
+
+import frappe
+from frappe.utils import cint, now
+
+# Attachments are stored once per content under `files/mail/<sha256[:2]>/<sha256><ext>`, and each mail
+# gets its own File row pointing to the shared blob. The File rows carry the SHA-256 as `content_hash`, so
+# a blob is referenced for as long as a File row with its URL exists, and Frappe's own `File.on_trash` keeps
+# the blob while another File shares its content hash.
+STORE_FOLDER = "mail"
+
+# Writing and deleting a blob are serialized by a Redis lock per blob. As the File row of a saved blob is
+# only visible once the saving transaction commits, the blob is also marked as pending for `PENDING_EXPIRY`
+# seconds, during which it is not deleted.
+LOCK_TIMEOUT = 60
+PENDING_EXPIRY = 60 * 60
+
+
+def save_attachment(
+	file_name: str,
+	content: bytes | str,
+	doctype: str,
+	docname: str,
+	is_private: bool = True,
+	decode: bool = False,
+) -> dict:
+	"""Stores the content in the attachment store and attaches it to the document as a File.
+
+	The File row is bulk inserted, bypassing the validation and hooks of File, so this is only meant for
+	content the app itself stores with mails, not for user uploads.
+	"""
+
+	if decode:
+		if isinstance(content, str):
+			content = content.encode("utf-8")
+		if b"," in content:
+			content = content.split(b",", 1)[1]
+		content = b64decode(content)
+	elif isinstance(content, str):
+		content = content.encode("utf-8")
+
+	content_hash = sha256(content).hexdigest()
+	file_url = _write_blob(content, content_hash, _get_extension(file_name), is_private)
+	file = {
+		"name": frappe.generate_hash(length=10),
+		"file_name": file_name,
+		"file_url": file_url,
+		"is_private": cint(is_private),
+		"file_size": len(content),
+		"file_type": os.path.splitext(file_name or "")[1][1:].upper() or None,
+		"content_hash": content_hash,
+		"folder": "Home/Attachments",
+		"attached_to_doctype": doctype,
+		"attached_to_name": docname,
+	}
+
+	user, timestamp = frappe.session.user, now()
+	row = {"creation": timestamp, "modified": timestamp, "owner": user, "modified_by": user, **file}
+	frappe.db.bulk_insert("File", fields=list(row), values=[tuple(row.values())])
+
+	return {
+		"name": file["name"],
+		"file_name": file["file_name"],
+		"file_url": file["file_url"],
+		"is_private": file["is_private"],
+	}
+
+
+def delete_attachments(doctype: str, docnames: list[str], chunk_size: int = 1000) -> None:
+	"""Deletes the Files attached to the documents, and the stored files no other File refers to."""
+
+	FILE = frappe.qb.DocType("File")
+	file_urls = set()
+
+	for i in range(0, len(docnames), chunk_size):
+		files = (
+			frappe.qb.from_(FILE)
+			.select(FILE.name, FILE.file_url)
+			.where(
+				(FILE.attached_to_doctype == doctype)
+				& (FILE.attached_to_name.isin(docnames[i : i + chunk_size]))
+			)
+		).run(as_dict=True)
+
+		if not files:
+			continue
+
+		frappe.qb.from_(FILE).where(FILE.name.isin([f.name for f in files])).delete().run()
+		file_urls.update(f.file_url for f in files if f.file_url)
+
+	if not file_urls:
+		return
+
+	file_urls = list(file_urls)
+	for i in range(0, len(file_urls), chunk_size):
+		chunk = file_urls[i : i + chunk_size]
+		referenced = set(
+			(frappe.qb.from_(FILE).select(FILE.file_url).distinct().where(FILE.file_url.isin(chunk))).run(
+				pluck=True
+			)
+		)
+		unreferenced = [file_url for file_url in chunk if file_url not in referenced]
+
+		if unreferenced:
+			# Files are removed only once the rows are gone for good, and are checked again then, as a
+			# concurrent save may refer to them by then.
+			frappe.db.after_commit.add(lambda file_urls=unreferenced: _delete_blobs(file_urls))
+
+
+def _get_extension(file_name: str | None) -> str:
+	"""Returns the lowercased extension of the file name, if it is safe to use in a path."""
+
+	extension = os.path.splitext(file_name or "")[1].lower()
+	return extension if extension[1:].isalnum() else ""
+
+
+def _get_blob_path(file_url: str) -> str:
+	"""Returns the path of the stored file on disk."""
+
+	if file_url.startswith("/private/files/"):
+		return frappe.get_site_path("private", "files", *file_url[len("/private/files/") :].split("/"))
+
+	return frappe.get_site_path("public", "files", *file_url[len("/files/") :].split("/"))
+
+
+def _write_blob(content: bytes, content_hash: str, extension: str, is_private: bool) -> str:
+	"""Writes the content to the attachment store, unless it is already stored, and returns its file URL."""
+
+	prefix = "/private/files" if is_private else "/files"
+	file_url = f"{prefix}/{STORE_FOLDER}/{content_hash[:2]}/{content_hash}{extension}"
+	path = _get_blob_path(file_url)
+
+	with _get_blob_lock(file_url):
+		frappe.cache.set(_get_pending_key(file_url), 1, ex=PENDING_EXPIRY)
+
+		if not os.path.exists(path):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+
+			# Written to a temporary file first, so a concurrent reader never sees a partial file.
+			temp_path = f"{path}.{frappe.generate_hash(length=8)}.tmp"
+			with open(temp_path, "wb") as f:
+				f.write(content)
+			os.replace(temp_path, path)
+
+	return file_url
+
+
+def _delete_blobs(file_urls: list[str]) -> None:
+	"""Deletes the stored files from disk, unless a File refers to them or they are being saved."""
+
+	FILE = frappe.qb.DocType("File")
+
+	for file_url in file_urls:
+		if not file_url.startswith(("/files/", "/private/files/")):
+			continue
+
+		with _get_blob_lock(file_url):
+			if frappe.cache.exists(_get_pending_key(file_url)):
+				continue
+
+			if (frappe.qb.from_(FILE).select(FILE.name).where(FILE.file_url == file_url).limit(1)).run():
+				continue
+
+			try:
+				os.remove(_get_blob_path(file_url))
+			except FileNotFoundError:
+				pass
+
+
+def _get_blob_lock(file_url: str):
+	"""Returns the Redis lock that serializes writing and deleting the stored file."""
+
+	return frappe.cache.lock(frappe.cache.make_key(f"attachment_store|lock|{file_url}"), timeout=LOCK_TIMEOUT)
+
+
+def _get_pending_key(file_url: str) -> str:
+	"""Returns the Redis key that marks the stored file as being saved."""
+
+	return frappe.cache.make_key(f"attachment_store|pending|{file_url}")
@@ -0,0 +1,183 @@
+import re
+import threading
+import time
+from base64 import b64encode
+from hashlib import sha256
+from io import BytesIO
+from typing import IO
+
+import frappe
+
+DKIM_SELECTOR = "frappemail"
+DKIM_HEADERS = ["To", "Cc", "From", "Date", "Subject", "Reply-To", "Message-ID", "In-Reply-To"]
+BODY_HASH_CHUNK_SIZE = 64 * 1024
+
+WSP_RE = re.compile(rb"[ \t]+")
+
+# In-process cache of DKIM private keys, keyed by domain name. Each entry holds the version (hash of the
+# domain's public key) it was loaded for, so a rotation done by another process is picked up on next use.
+_dkim_keys: dict[str, frappe._dict] = {}
+_dkim_keys_lock = threading.Lock()
+
+
+def get_dkim_key(domain_name: str, dkim_public_key: str | None = None) -> frappe._dict:
+	"""Returns the cached DKIM private key of the domain, loaded with cryptography."""
+
+	if dkim_public_key is None:
+		dkim_public_key = frappe.get_cached_value("Mail Domain", domain_name, "dkim_public_key")
+
+	version = sha256(dkim_public_key.encode()).hexdigest()
+
+	with _dkim_keys_lock:
+		dkim_key = _dkim_keys.get(domain_name)
+
+	if dkim_key and dkim_key.version == version:
+		return dkim_key
+
+	from cryptography.hazmat.primitives import serialization
+
+	private_key_pem = frappe.get_cached_doc("Mail Domain", domain_name).get_password("dkim_private_key")
+	dkim_key = frappe._dict(
+		{
+			"version": version,
+			"private_key": serialization.load_pem_private_key(private_key_pem.encode(), password=None),
+		}
+	)
+
+	with _dkim_keys_lock:
+		_dkim_keys[domain_name] = dkim_key
+
+	return dkim_key
+
+
+def invalidate_dkim_key(domain_name: str) -> None:
+	"""Removes the cached DKIM private key of the domain."""
+
+	with _dkim_keys_lock:
+		_dkim_keys.pop(domain_name, None)
+
+
+def sign_message(
+	message: bytes | IO[bytes],
+	domain_name: str,
+	selector: str = DKIM_SELECTOR,
+	include_headers: list[str] | None = None,
+	dkim_key: frappe._dict | None = None,
+) -> str:
+	"""Returns the DKIM-Signature header value for the message (relaxed/simple canonicalization).
+
+	The message can be given as bytes or as a binary file, which is read in chunks from its start."""
+
+	from cryptography.hazmat.primitives import hashes
+	from cryptography.hazmat.primitives.asymmetric import ed25519, padding
+
+	dkim_key = dkim_key or get_dkim_key(domain_name)
+	is_ed25519 = isinstance(dkim_key.private_key, ed25519.Ed25519PrivateKey)
+	include_headers = include_headers or DKIM_HEADERS
+
+	fp = BytesIO(message) if isinstance(message, bytes) else message
+	fp.seek(0)
+
+	header_lines = []
+	while line := fp.readline():
+		if line in (b"\r\n", b"\n"):
+			break
+		header_lines.append(line)
+
+	linesep = b"\r\n" if header_lines and header_lines[0].endswith(b"\r\n") else b"\n"
+	headers = _get_headers(b"".join(header_lines), linesep)
+	signed_headers = []
+	for name in include_headers:
+		# Repeated headers are signed bottom-up, as verifiers select them (RFC 6376, section 5.4.2).
+		signed_headers.extend(reversed(headers.get(name.lower(), [])))
+
+	tags = [
+		("v", "1"),
+		("a", "ed25519-sha256" if is_ed25519 else "rsa-sha256"),
+		("c", "relaxed/simple"),
+		("d", domain_name),
+		("s", selector),
+		("t", str(int(time.time()))),
+		("h", ":".join(name.decode() for name, __ in signed_headers)),
+		("bh", b64encode(_get_body_hash(fp, linesep)).decode()),
+		("b", ""),
+	]
+	dkim_signature = "; ".join(f"{tag}={value}" for tag, value in tags)
+
+	data = b"".join(_canonicalize_header(name, value) + b"\r\n" for name, value in signed_headers)
+	data += _canonicalize_header(b"DKIM-Signature", dkim_signature.encode())
+
+	if is_ed25519:
+		signature = dkim_key.private_key.sign(sha256(data).digest())
+	else:
+		signature = dkim_key.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+	return dkim_signature + b64encode(signature).decode()
+
+
+def _get_headers(header_block: bytes, linesep: bytes) -> dict[str, list[tuple[bytes, bytes]]]:
+	"""Returns the (name, raw value) pairs of the header block, grouped by lowercased name."""
+
+	headers = {}
+	name = value = None
+
+	for line in header_block.split(linesep):
+		if line[:1] in (b" ", b"\t") and name is not None:
+			value += b"\r\n" + line
+			continue
+
+		if name is not None:
+			headers.setdefault(name.lower(), []).append((name, value))
+
+		name, colon, value = line.partition(b":")
+		if not colon:
+			name = None
+
+	if name is not None:
+		headers.setdefault(name.lower(), []).append((name, value))
+
+	return {name.decode(): values for name, values in headers.items()}
+
+
+def _canonicalize_header(name: bytes, value: bytes) -> bytes:
+	"""Returns the header canonicalized with the relaxed algorithm, without the trailing CRLF."""
+
+	value = WSP_RE.sub(b" ", value.replace(b"\r\n", b"")).strip(b" ")
+	return name.strip().lower() + b":" + value
+
+
+def _get_body_hash(fp: IO[bytes], linesep: bytes) -> bytes:
+	"""Returns the SHA-256 hash of the rest of the file, canonicalized with the simple algorithm."""
+
+	body_hash = sha256()
+	# Trailing empty lines are ignored by the simple algorithm, so line endings at the end of a chunk are
+	# held back until it is known whether more content follows them.
+	pending_crlfs = 0
+	carry = b""
+
+	while chunk := fp.read(BODY_HASH_CHUNK_SIZE):
+		if linesep == b"\n":
+			chunk = chunk.replace(b"\n", b"\r\n")
+
+		chunk, carry = carry + chunk, b""
+		if chunk.endswith(b"\r"):
+			# A CRLF may be split across chunks.
+			chunk, carry = chunk[:-1], b"\r"
+
+		content = chunk.rstrip(b"\r\n")
+		trailing = chunk[len(content) :]
+		if trailing.count(b"\r\n") * 2 != len(trailing):
+			content, trailing = chunk, b""
+
+		if content:
+			body_hash.update(b"\r\n" * pending_crlfs)
+			body_hash.update(content)
+			pending_crlfs = 0
+
+		pending_crlfs += len(trailing) // 2
+
+	if carry:
+		body_hash.update(b"\r\n" * pending_crlfs + carry)
+
+	body_hash.update(b"\r\n")
+	return body_hash.digest()
@@ -1,46 +1,103 @@
 import re
-from email import message_from_string, policy
+from email import policy
 from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser, BytesParser
+from email.policy import Compat32
 from email.utils import parseaddr
 from typing import TYPE_CHECKING
 from urllib.parse import unquote
 
-from frappe.utils import cint, get_datetime_str
-from frappe.utils.file_manager import save_file
+from frappe.utils import get_datetime_str
 
 from mail_client.utils import parsedate_to_datetime
+from mail_client.utils.attachment_store import save_attachment
 
 if TYPE_CHECKING:
 	from email.message import Message
 
+HEADER_BLOCK_END_PATTERN = re.compile(rb"\r?\n\r?\n")
+
+
+class UTF8HeadersPolicy(Compat32):
+	"""The `compat32` policy, except that raw 8-bit (SMTPUTF8) header values are returned decoded as UTF-8
+	instead of as a `Header` of unknown charset."""
+
+	def header_fetch_parse(self, name: str, value: str) -> str:
+		try:
+			# Undecodable bytes of a message parsed from bytes are kept as surrogate escapes.
+			return value.encode("ascii", "surrogateescape").decode("utf-8", "replace")
+		except UnicodeEncodeError:
+			return value
+
+
+utf8_headers_policy = UTF8HeadersPolicy()
+
 
 class EmailParser:
-	def __init__(self, message: str) -> None:
-		self.message = self.get_parsed_message(message)
+	"""Parses the message once and memoizes the derived values (recipients, bodies, attachments, etc.), so
+	that a parser can be shared by all the mailboxes an inbound message is delivered to.
+
+	Only the header block is parsed up front. The MIME structure is parsed on first access to `message`, so
+	header lookups (routing, subject, recipients) never pay for decoding large bodies.
+
+	Messages are parsed as bytes, so 8-bit bodies are decoded with their own charset rather than round
+	tripped through `str`, and the size of the message is that of the raw bytes received.
+	"""
+
+	def __init__(self, message: str | bytes) -> None:
+		self.raw_message = message.encode("utf-8") if isinstance(message, str) else message
+		self.size = len(self.raw_message)
 		self.content_id_and_file_url_map = {}
+		self._message = None
+		self._headers = None
+		self._modified = False
+		self._cache = {}
+
+	@property
+	def message(self) -> "Message":
+		"""Returns the parsed message, parsing the whole message on first access."""
+
+		if self._message is None:
+			self._message = self.get_parsed_message(self.raw_message)
+
+		return self._message
+
+	@property
+	def headers(self) -> "Message":
+		"""Returns the headers of the message, parsed from the header block only."""
+
+		if self._message is not None:
+			return self._message
+
+		if self._headers is None:
+			match = HEADER_BLOCK_END_PATTERN.search(self.raw_message)
+			header_block = self.raw_message[: match.end()] if match else self.raw_message
+			self._headers = BytesHeaderParser(policy=utf8_headers_policy).parsebytes(header_block)
+
+		return self._headers
 
 	@staticmethod
-	def get_parsed_message(message: str) -> "Message":
-		"""Returns parsed email message object from string."""
+	def get_parsed_message(message: bytes) -> "Message":
+		"""Returns parsed email message object from bytes."""
 
-		return message_from_string(message)
+		return BytesParser(policy=utf8_headers_policy).parsebytes(message)
 
 	def get_message_id(self) -> str | None:
 		"""Returns the message ID of the email."""
 
-		if message_id := self.message.get("Message-ID"):
+		if message_id := self.headers.get("Message-ID"):
 			return remove_whitespace_characters(message_id)
 
 	def get_in_reply_to(self) -> str | None:
 		"""Returns the in-reply-to message ID of the email."""
 
-		if in_reply_to := self.message.get("In-Reply-To"):
+		if in_reply_to := self.headers.get("In-Reply-To"):
 			return remove_whitespace_characters(in_reply_to)
 
 	def get_subject(self) -> str | None:
 		"""Returns the decoded subject of the email."""
 
-		if subject := self.message["Subject"]:
+		if subject := self.headers["Subject"]:
 			decoded_subject = str(make_header(decode_header(subject)))
 			return remove_whitespace_characters(decoded_subject)
 
@@ -49,18 +106,18 @@ class EmailParser:
 	def get_sender(self) -> tuple[str, str]:
 		"""Returns the display name and email of the sender."""
 
-		return parseaddr(self.message["From"])
+		return parseaddr(self.headers["From"])
 
 	def get_reply_to(self) -> str:
 		"""Returns the reply-to email(s) of the email."""
 
-		if reply_to := self.message.get("Reply-To"):
+		if reply_to := self.headers.get("Reply-To"):
 			return remove_whitespace_characters(reply_to)
 
 	def get_header(self, header: str) -> str | None:
 		"""Returns the value of the header."""
 
-		return self.message[header]
+		return self.headers[header]
 
 	def update_header(self, header: str, value: str) -> None:
 		"""Updates the value of the header."""
@@ -69,17 +126,25 @@ class EmailParser:
 			del self.message[header]
 
 		self.message[header] = value
+		self._modified = True
+		self._cache.clear()
 
 	def get_date(self) -> str | None:
 		"""Returns the date of the email."""
 
-		if date_header := self.message.get("Date"):
+		if date_header := self.headers.get("Date"):
 			return get_datetime_str(parsedate_to_datetime(date_header))
 
 	def get_size(self) -> int:
 		"""Returns the size of the email."""
 
-		return len(self.message.as_string(policy=policy.default).encode("utf-8"))
+		if not self._modified:
+			return self.size
+
+		if "size" not in self._cache:
+			self._cache["size"] = len(self.message.as_bytes(policy=policy.default))
+
+		return self._cache["size"]
 
 	def get_recipients(self, types: str | list | None = None) -> list[dict]:
 		"""Returns the list of recipients of the email."""
@@ -89,75 +154,82 @@ class EmailParser:
 		elif isinstance(types, str):
 			types = [types]
 
-		recipients = []
-		for type in types:
-			if addresses := self.message.get(type):
-				for address in addresses.split(","):
-					display_name, email = parseaddr(remove_whitespace_characters(address))
-					if email:
-						recipients.append({"type": type, "email": email, "display_name": display_name})
+		key = ("recipients", *types)
+		if key not in self._cache:
+			recipients = []
+			for type in types:
+				if addresses := self.headers.get(type):
+					for address in addresses.split(","):
+						display_name, email = parseaddr(remove_whitespace_characters(address))
+						if email:
+							recipients.append({"type": type, "email": email, "display_name": display_name})
+
+			self._cache[key] = recipients
+
+		return [recipient.copy() for recipient in self._cache[key]]
+
+	def get_attachments(self) -> list[dict]:
+		"""Returns the decoded attachments (and inline images) of the email."""
+
+		if "attachments" not in self._cache:
+			attachments = []
+			for part in self.message.walk():
+				filename = part.get_filename()
+				disposition = part.get("Content-Disposition")
+
+				if disposition and filename:
+					filename = unquote(filename)
+					disposition = disposition.lower()
+
+					if disposition.startswith("inline"):
+						if content_id := re.sub(r"[<>]", "", part.get("Content-ID", "")):
+							if payload := part.get_payload(decode=True):
+								attachments.append(
+									{"filename": filename, "content_id": content_id, "payload": payload}
+								)
+
+					elif disposition.startswith("attachment"):
+						if payload := part.get_payload(decode=True):
+							attachments.append({"filename": filename, "content_id": None, "payload": payload})
+
+			self._cache["attachments"] = attachments
 
-		return recipients
+		return self._cache["attachments"]
 
 	def save_attachments(self, doctype: str, docname: str, is_private: bool = True) -> None:
 		"""Saves the attachments of the email."""
 
-		def save_attachment(
-			filename: str, content: bytes, doctype: str, docname: str, is_private: bool
-		) -> dict:
-			"""Saves the attachment as a file."""
-
-			kwargs = {
-				"fname": filename,
-				"content": content,
-				"df": "file",
-				"dt": doctype,
-				"dn": docname,
-				"is_private": cint(is_private),
-			}
-			file = save_file(**kwargs)
-			return {
-				"name": file.name,
-				"file_name": file.file_name,
-				"file_url": file.file_url,
-				"is_private": file.is_private,
-			}
-
-		for part in self.message.walk():
-			filename = part.get_filename()
-			disposition = part.get("Content-Disposition")
-
-			if disposition and filename:
-				filename = unquote(filename)
-				disposition = disposition.lower()
-
-				if disposition.startswith("inline"):
-					if content_id := re.sub(r"[<>]", "", part.get("Content-ID", "")):
-						if payload := part.get_payload(decode=True):
-							file = save_attachment(filename, payload, doctype, docname, is_private)
-							self.content_id_and_file_url_map[content_id] = file["file_url"]
+		self.content_id_and_file_url_map = {}
 
-				elif disposition.startswith("attachment"):
-					if payload := part.get_payload(decode=True):
-						save_attachment(filename, payload, doctype, docname, is_private)
+		for attachment in self.get_attachments():
+			file = save_attachment(
+				attachment["filename"], attachment["payload"], doctype, docname, is_private
+			)
+			if content_id := attachment["content_id"]:
+				self.content_id_and_file_url_map[content_id] = file["file_url"]
 
 	def get_body(self) -> tuple[str | None, str | None]:
 		"""Returns the HTML and plain text body of the email."""
 
-		body_html, body_plain = "", ""
+		if "body" not in self._cache:
+			body_html, body_plain = "", ""
 
-		for part in self.message.walk():
-			content_type = part.get_content_type()
+			for part in self.message.walk():
+				content_type = part.get_content_type()
 
-			if content_type == "text/html":
-				if payload := part.get_payload(decode=True):
-					charset = part.get_content_charset() or "utf-8"
-					body_html += payload.decode(charset, "ignore")
+				if content_type == "text/html":
+					if payload := part.get_payload(decode=True):
+						charset = part.get_content_charset() or "utf-8"
+						body_html += payload.decode(charset, "ignore")
 
-			elif content_type == "text/plain":
-				if payload := part.get_payload(decode=True):
-					charset = part.get_content_charset() or "utf-8"
-					body_plain += payload.decode(charset, "ignore")
+				elif content_type == "text/plain":
+					if payload := part.get_payload(decode=True):
+						charset = part.get_content_charset() or "utf-8"
+						body_plain += payload.decode(charset, "ignore")
+
+			self._cache["body"] = body_html, body_plain
+
+		body_html, body_plain = self._cache["body"]
 
 		if self.content_id_and_file_url_map:
 			for content_id, file_url in self.content_id_and_file_url_map.items():
@@ -169,6 +241,9 @@ class EmailParser:
 	def get_authentication_results(self) -> dict[str, int | str]:
 		"""Returns the authentication results of the email."""
 
+		if "authentication_results" in self._cache:
+			return self._cache["authentication_results"].copy()
+
 		result = {}
 		checks = ["spf", "dkim", "dmarc"]
 
@@ -176,7 +251,7 @@ class EmailParser:
 			result[f"{check}_pass"] = 0
 			result[f"{check}_description"] = "Header not found."
 
-		if headers := self.message.get_all("Authentication-Results"):
+		if headers := self.headers.get_all("Authentication-Results"):
 			if len(headers) == 1:
 				headers = headers[0].split(";")
 
@@ -190,7 +265,8 @@ class EmailParser:
 						result[f"{check}_description"] = header
 						break
 
-		return result
+		self._cache["authentication_results"] = result
+		return result.copy()
 
 
 def remove_whitespace_characters(text: str) -> str:
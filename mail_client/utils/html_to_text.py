@@ -0,0 +1,112 @@
+import re
+import threading
+from collections import OrderedDict
+from hashlib import sha1
+from html.parser import HTMLParser
+
+import frappe
+
+# Elements whose content is not text, as in BeautifulSoup's `get_text`.
+NON_TEXT_TAGS = frozenset(["script", "style", "template"])
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Converted texts are kept in Redis for `CACHE_EXPIRY` seconds, so that they are shared by every worker and
+# background job of the site, with a small process-local LRU in front of it.
+CACHE_EXPIRY = 24 * 60 * 60
+CACHE_SIZE = 128
+_cache: OrderedDict[str, str] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class TextCollector:
+	"""Collects the text of an HTML document from parser events, skipping comments and non-text elements."""
+
+	def __init__(self) -> None:
+		self.parts = []
+		self.skip_depth = 0
+
+	def start(self, tag: str, attrs=None) -> None:
+		if tag.lower() in NON_TEXT_TAGS:
+			self.skip_depth += 1
+
+	def end(self, tag: str) -> None:
+		if self.skip_depth and tag.lower() in NON_TEXT_TAGS:
+			self.skip_depth -= 1
+
+	def data(self, data: str) -> None:
+		if not self.skip_depth:
+			self.parts.append(data)
+
+	def close(self) -> str:
+		return WHITESPACE_PATTERN.sub(" ", "".join(self.parts)).strip()
+
+
+class TextParser(HTMLParser):
+	"""Event-based HTML tokenizer that feeds a `TextCollector`, without building a document tree."""
+
+	def __init__(self) -> None:
+		super().__init__(convert_charrefs=True)
+		self.collector = TextCollector()
+
+	def handle_starttag(self, tag: str, attrs: list) -> None:
+		self.collector.start(tag)
+
+	def handle_startendtag(self, tag: str, attrs: list) -> None:
+		pass
+
+	def handle_endtag(self, tag: str) -> None:
+		self.collector.end(tag)
+
+	def handle_data(self, data: str) -> None:
+		self.collector.data(data)
+
+	def unknown_decl(self, data: str) -> None:
+		if data.startswith("CDATA["):
+			self.collector.data(data[len("CDATA[") :])
+
+	def get_text(self, html: str) -> str:
+		"""Returns the text of the HTML."""
+
+		self.feed(html)
+		super().close()
+		return self.collector.close()
+
+
+def html_to_text(html: str, parser: str = "html.parser") -> str:
+	"""Returns the whitespace-normalized text of the HTML, using html.parser or lxml (`parser="lxml"`)."""
+
+	if parser == "lxml":
+		from lxml import etree
+
+		return etree.fromstring(html, etree.HTMLParser(target=TextCollector()))
+
+	return TextParser().get_text(html)
+
+
+def get_cached_text(html: str, parser: str = "html.parser") -> str:
+	"""Returns the text of the HTML, cached by its content hash in the local LRU and in Redis.
+
+	Needs a site context, as the Redis keys are namespaced by site.
+	"""
+
+	key = f"html_to_text|{parser}|{sha1(html.encode('utf-8', 'surrogatepass')).hexdigest()}"
+
+	with _cache_lock:
+		if (text := _cache.get(key)) is not None:
+			_cache.move_to_end(key)
+			return text
+
+	# Read and written directly, as `get_value` would also memoize every text for the rest of the job.
+	redis_key = frappe.cache.make_key(key)
+	if (text := frappe.cache.get(redis_key)) is not None:
+		text = text.decode("utf-8")
+	else:
+		text = html_to_text(html, parser)
+		frappe.cache.set(redis_key, text.encode("utf-8", "surrogatepass"), ex=CACHE_EXPIRY)
+
+	with _cache_lock:
+		_cache[key] = text
+		if len(_cache) > CACHE_SIZE:
+			_cache.popitem(last=False)
+
+	return text
@@ -0,0 +1,329 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from base64 import b64decode, b64encode
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, nullcontext
+from hashlib import sha256
+from tempfile import SpooledTemporaryFile
+from typing import IO, TYPE_CHECKING
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+if TYPE_CHECKING:
+	from frappe.model.document import Document
+
+MESSAGE_DOCTYPES = ["Outgoing Mail", "Incoming Mail"]
+SPOOL_MAX_SIZE = 5 * 1024 * 1024
+ZSTD_LEVEL = 3
+
+# Messages are content-addressed, so a message being deleted may have just been stored again for a new row
+# that is not committed yet. Messages stored within the last `DELETE_GRACE_PERIOD` seconds are therefore kept.
+DELETE_GRACE_PERIOD = 60 * 60
+
+# Compressed bodies are kept in their LONGTEXT columns as this prefix followed by a base64 zstd frame.
+BODY_FIELDS = ["body_html", "body_plain"]
+COMPRESSED_BODY_PREFIX = "zstd:"
+
+
+class MessageStore(ABC):
+	"""Base class for the stores that keep the raw (RFC 822) messages out of the database.
+
+	Messages are content-addressed: `put` returns the SHA-256 of the message as its key, so a message
+	delivered to several mailboxes is stored once, and only the key and size are kept on the row.
+	"""
+
+	@abstractmethod
+	def put(self, *parts: bytes | IO[bytes]) -> tuple[str, int]:
+		"""Stores the message made of the given parts and returns its key and (uncompressed) size."""
+
+	@abstractmethod
+	def open(self, key: str) -> IO[bytes]:
+		"""Returns the stored message as a seekable binary file."""
+
+	def get(self, key: str) -> bytes:
+		"""Returns the stored message."""
+
+		with self.open(key) as f:
+			return f.read()
+
+	def get_compressed(self, key: str) -> bytes:
+		"""Returns the stored message as a zstd frame."""
+
+		import zstandard
+
+		return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(self.get(key))
+
+	@abstractmethod
+	def delete(self, keys: Iterable[str]) -> None:
+		"""Deletes the stored messages, except those stored within the last `DELETE_GRACE_PERIOD` seconds."""
+
+
+class LocalMessageStore(MessageStore):
+	"""Stores the messages as files under `private/messages/<key[:2]>/` in the site folder.
+
+	With compression enabled, messages are written as zstd frames (`<key>.eml.zst`). Messages written
+	either way are readable regardless of the current setting.
+	"""
+
+	CHUNK_SIZE = 64 * 1024
+
+	def __init__(self, root: str | None = None, compress: bool = False) -> None:
+		# Resolved up front, so that the store can be used from worker threads that have no site context.
+		self.root = os.path.abspath(root or frappe.get_site_path("private", "messages"))
+		self.compress = compress
+
+	def put(self, *parts: bytes | IO[bytes]) -> tuple[str, int]:
+		os.makedirs(self.root, exist_ok=True)
+		temp_path = os.path.join(self.root, f"{frappe.generate_hash(length=16)}.tmp")
+		message_hash, size = sha256(), 0
+
+		try:
+			with open(temp_path, "wb") as f:
+				if self.compress:
+					import zstandard
+
+					writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(f, closefd=False)
+				else:
+					writer = nullcontext(f)
+
+				with writer as w:
+					for part in parts:
+						for chunk in _iter_chunks(part, self.CHUNK_SIZE):
+							w.write(chunk)
+							message_hash.update(chunk)
+							size += len(chunk)
+
+			key = message_hash.hexdigest()
+			path = self._get_path(key, self.compress)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			os.replace(temp_path, path)
+		finally:
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+
+		return key, size
+
+	def open(self, key: str) -> IO[bytes]:
+		if not os.path.exists(path := self._get_path(key, compressed=True)):
+			return open(self._get_path(key), "rb")
+
+		import zstandard
+
+		# Decompressed into a spooled file, as callers need the size of the message and to seek in it.
+		fp = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+		with open(path, "rb") as f:
+			zstandard.ZstdDecompressor().copy_stream(f, fp)
+		fp.seek(0)
+
+		return fp
+
+	def get(self, key: str) -> bytes:
+		if not os.path.exists(path := self._get_path(key, compressed=True)):
+			return super().get(key)
+
+		import zstandard
+
+		with open(path, "rb") as f:
+			return zstandard.ZstdDecompressor().decompressobj().decompress(f.read())
+
+	def get_compressed(self, key: str) -> bytes:
+		if not os.path.exists(path := self._get_path(key, compressed=True)):
+			return super().get_compressed(key)
+
+		with open(path, "rb") as f:
+			return f.read()
+
+	def delete(self, keys: Iterable[str]) -> None:
+		stored_before = time.time() - DELETE_GRACE_PERIOD
+
+		for key in keys:
+			for compressed in (False, True):
+				path = self._get_path(key, compressed)
+				temp_path = f"{path}.{frappe.generate_hash(length=8)}.deleted"
+
+				# Moved aside before its age is checked, so that a concurrent `put` either renewed the moved
+				# file or writes a new one, which is left in place.
+				try:
+					os.rename(path, temp_path)
+				except FileNotFoundError:
+					continue
+
+				if os.stat(temp_path).st_mtime > stored_before:
+					# Restored as is, since a file written to the path in the meantime has the same content.
+					os.replace(temp_path, path)
+				else:
+					os.remove(temp_path)
+
+	def _get_path(self, key: str, compressed: bool = False) -> str:
+		"""Returns the path of the stored message."""
+
+		if not key.isalnum():
+			frappe.throw(_("Invalid message key {0}.").format(frappe.bold(key)))
+
+		return os.path.join(self.root, key[:2], f"{key}.eml.zst" if compressed else f"{key}.eml")
+
+
+MESSAGE_STORES: dict[str, type[MessageStore]] = {
+	"Local Filesystem": LocalMessageStore,
+}
+
+
+def get_message_store() -> MessageStore:
+	"""Returns the message store configured in the Mail Client Settings."""
+
+	settings = frappe.get_cached_doc("Mail Client Settings")
+	message_store = MESSAGE_STORES[settings.message_store or "Local Filesystem"]
+	return message_store(compress=cint(settings.compress_messages))
+
+
+def load_message(message_key: str | None, message: str | None = None) -> str | None:
+	"""Returns the raw message from the message store, or the one stored on the row before the migration."""
+
+	if message_key:
+		return get_message_store().get(message_key).decode("utf-8")
+
+	return message
+
+
+def load_compressed_message(message_key: str | None, message: str | None = None) -> bytes | None:
+	"""Returns the raw message as a zstd frame, without decompressing it if it is stored compressed."""
+
+	if message_key:
+		return get_message_store().get_compressed(message_key)
+
+	if message is not None:
+		import zstandard
+
+		return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(message.encode("utf-8"))
+
+
+def compress_body(body: str | None) -> str | None:
+	"""Returns the body to store, compressed if Compress Messages is enabled and it makes the body smaller."""
+
+	if not body:
+		return body
+
+	# A body that looks compressed is always compressed, so that it is not mistaken for one when read.
+	is_ambiguous = body.startswith(COMPRESSED_BODY_PREFIX)
+	if not is_ambiguous and not cint(frappe.get_cached_doc("Mail Client Settings").compress_messages):
+		return body
+
+	import zstandard
+
+	frame = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body.encode("utf-8"))
+	compressed = COMPRESSED_BODY_PREFIX + b64encode(frame).decode()
+
+	return compressed if is_ambiguous or len(compressed) < len(body) else body
+
+
+def decompress_body(body: str | None) -> str | None:
+	"""Returns the stored body, decompressed if it is stored compressed."""
+
+	if not body or not body.startswith(COMPRESSED_BODY_PREFIX):
+		return body
+
+	import zstandard
+
+	frame = b64decode(body[len(COMPRESSED_BODY_PREFIX) :])
+	return zstandard.ZstdDecompressor().decompressobj().decompress(frame).decode("utf-8")
+
+
+@contextmanager
+def compressed_bodies(doc: "Document") -> Iterator[None]:
+	"""Compresses the bodies of the document for the duration of the block, in which its row is written."""
+
+	bodies = {field: doc.get(field) for field in BODY_FIELDS if doc.meta.has_field(field)}
+
+	try:
+		for field, body in bodies.items():
+			doc.set(field, compress_body(body))
+
+		yield
+	finally:
+		doc.update(bodies)
+
+
+def decompress_bodies(doc: "Document") -> None:
+	"""Decompresses the bodies of the document loaded from the database."""
+
+	for field in BODY_FIELDS:
+		if body := doc.get(field):
+			doc.set(field, decompress_body(body))
+
+
+def delete_unreferenced_messages(keys: Iterable[str], chunk_size: int = 1000) -> None:
+	"""Deletes the stored messages no Outgoing Mail or Incoming Mail refers to any more, after commit."""
+
+	if unreferenced := _get_unreferenced_keys(set(filter(None, keys)), chunk_size):
+		message_store = get_message_store()
+
+		# Checked again once the rows are gone for good, as rows committed in the meantime may refer to them.
+		frappe.db.after_commit.add(
+			lambda: message_store.delete(_get_unreferenced_keys(unreferenced, chunk_size))
+		)
+
+
+def migrate_messages(batch_size: int = 500) -> int:
+	"""Moves the raw messages stored on Outgoing Mail and Incoming Mail rows to the message store."""
+
+	message_store = get_message_store()
+	total_migrated = 0
+
+	for doctype in MESSAGE_DOCTYPES:
+		DT = frappe.qb.DocType(doctype)
+
+		while rows := (
+			frappe.qb.from_(DT)
+			.select(DT.name, DT.message)
+			.where(DT.message_key.isnull() & DT.message.isnotnull())
+			.limit(batch_size)
+		).run(as_dict=True):
+			for row in rows:
+				key, __ = message_store.put(row.message.encode("utf-8"))
+				(
+					frappe.qb.update(DT)
+					.set(DT.message_key, key)
+					.set(DT.message, None)
+					.where(DT.name == row.name)
+				).run()
+
+			frappe.db.commit()
+			total_migrated += len(rows)
+
+	return total_migrated
+
+
+def _get_unreferenced_keys(keys: Iterable[str], chunk_size: int) -> list[str]:
+	"""Returns the keys no Outgoing Mail or Incoming Mail refers to."""
+
+	keys = list(keys)
+	unreferenced = []
+
+	for i in range(0, len(keys), chunk_size):
+		chunk = keys[i : i + chunk_size]
+		referenced = set()
+		for doctype in MESSAGE_DOCTYPES:
+			DT = frappe.qb.DocType(doctype)
+			referenced.update(
+				(frappe.qb.from_(DT).select(DT.message_key).distinct().where(DT.message_key.isin(chunk))).run(
+					pluck=True
+				)
+			)
+		unreferenced.extend(key for key in chunk if key not in referenced)
+
+	return unreferenced
+
+
+def _iter_chunks(part: bytes | IO[bytes], chunk_size: int) -> Iterable[bytes]:
+	"""Yields the part in chunks, reading files from their start."""
+
+	if isinstance(part, bytes):
+		yield part
+		return
+
+	part.seek(0)
+	while chunk := part.read(chunk_size):
+		yield chunk
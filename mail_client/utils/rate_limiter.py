@@ -0,0 +1,62 @@
+import frappe
+
+# Takes one token from every bucket in KEYS, or from none of them. ARGV holds a (capacity, refill rate per
+# second) pair for each key. Returns 0 if the tokens were taken, else the seconds until they will be available.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tokens = {}
+local wait = 0
+
+for i, key in ipairs(KEYS) do
+	local capacity = tonumber(ARGV[i * 2 - 1])
+	local rate = tonumber(ARGV[i * 2])
+	local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+	local available = tonumber(bucket[1]) or capacity
+	local updated_at = tonumber(bucket[2]) or now
+
+	available = math.min(capacity, available + math.max(0, now - updated_at) * rate)
+	if available < 1 then
+		wait = math.max(wait, (1 - available) / rate)
+	end
+	tokens[i] = available
+end
+
+for i, key in ipairs(KEYS) do
+	local capacity = tonumber(ARGV[i * 2 - 1])
+	local rate = tonumber(ARGV[i * 2])
+	local available = tokens[i]
+	if wait == 0 then
+		available = available - 1
+	end
+	redis.call('HSET', key, 'tokens', tostring(available), 'updated_at', tostring(now))
+	redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+end
+
+return tostring(wait)
+"""
+
+_token_bucket_script = None
+
+
+def acquire_token(buckets: dict[str, int]) -> float:
+	"""Takes a token from each of the given buckets (name: limit per minute) using a shared token bucket in Redis.
+
+	Returns 0 if the tokens were taken, otherwise the number of seconds to wait before retrying.
+	"""
+
+	global _token_bucket_script
+
+	buckets = {name: limit for name, limit in buckets.items() if limit and limit > 0}
+	if not buckets:
+		return 0
+
+	if _token_bucket_script is None:
+		_token_bucket_script = frappe.cache.register_script(TOKEN_BUCKET_SCRIPT)
+
+	keys, args = [], []
+	for name, limit in buckets.items():
+		keys.append(frappe.cache.make_key(f"rate_limit|{name}"))
+		args.extend([limit, limit / 60])
+
+	return float(_token_bucket_script(keys=keys, args=args))
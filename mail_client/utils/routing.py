@@ -0,0 +1,88 @@
+import frappe
+
+# The routing table maps the enabled domains, the aliases (to their mailboxes) and the enabled mailboxes, so
+# that inbound mails are routed without querying the database. It is shared through Redis under a version
+# that is replaced whenever a Mail Domain, Mail Alias or Mailbox changes, and each process keeps a local
+# copy for as long as the version is current. Addresses and domains are keyed in lowercase, as lookups in the
+# database are case-insensitive.
+ROUTING_TABLE_VERSION_KEY = "mail_routing_table_version"
+ROUTING_TABLE_KEY = "mail_routing_table"
+
+# Local copies of the routing table, keyed by site.
+_routing_tables: dict[str, frappe._dict] = {}
+
+
+def get_routing_table() -> frappe._dict:
+	"""Returns the routing table, rebuilt only when its version in Redis has changed."""
+
+	# Read from Redis on every call, as `get_value` memoizes values for the whole request or job.
+	if version := frappe.cache.get(frappe.cache.make_key(ROUTING_TABLE_VERSION_KEY)):
+		version = version.decode()
+	else:
+		version = _set_version()
+
+	site = frappe.local.site
+	if (routing_table := _routing_tables.get(site)) and routing_table.version == version:
+		return routing_table
+
+	routing_table = frappe.cache.get_value(f"{ROUTING_TABLE_KEY}|{version}")
+	if not routing_table:
+		routing_table = _build_routing_table()
+		routing_table.version = version
+		frappe.cache.set_value(f"{ROUTING_TABLE_KEY}|{version}", routing_table, expires_in_sec=24 * 60 * 60)
+
+	_routing_tables[site] = routing_table
+	return routing_table
+
+
+def invalidate_routing_table() -> None:
+	"""Invalidates the routing table of every process, once the current transaction is committed."""
+
+	frappe.db.after_commit.add(_set_version)
+
+
+def _set_version() -> str:
+	"""Sets a new version of the routing table and returns it."""
+
+	version = frappe.generate_hash(length=10)
+	frappe.cache.set(frappe.cache.make_key(ROUTING_TABLE_VERSION_KEY), version)
+
+	return version
+
+
+def _build_routing_table() -> frappe._dict:
+	"""Returns the routing table built from the database.
+
+	`domains` is the set of enabled domains, `mailboxes` maps the enabled mailboxes to their names, and
+	`aliases` maps the aliases to whether they are enabled and the names of their mailboxes.
+	"""
+
+	MAIL_ALIAS = frappe.qb.DocType("Mail Alias")
+	MAIL_ALIAS_MAILBOX = frappe.qb.DocType("Mail Alias Mailbox")
+
+	aliases = {
+		alias.name.lower(): frappe._dict(enabled=alias.enabled, mailboxes=[])
+		for alias in (frappe.qb.from_(MAIL_ALIAS).select(MAIL_ALIAS.name, MAIL_ALIAS.enabled)).run(
+			as_dict=True
+		)
+	}
+	for row in (
+		frappe.qb.from_(MAIL_ALIAS_MAILBOX)
+		.select(MAIL_ALIAS_MAILBOX.parent, MAIL_ALIAS_MAILBOX.mailbox)
+		.where(MAIL_ALIAS_MAILBOX.parenttype == "Mail Alias")
+		.orderby(MAIL_ALIAS_MAILBOX.idx)
+	).run(as_dict=True):
+		if alias := aliases.get(row.parent.lower()):
+			alias.mailboxes.append(row.mailbox)
+
+	return frappe._dict(
+		domains={
+			domain_name.lower()
+			for domain_name in frappe.db.get_all("Mail Domain", filters={"enabled": 1}, pluck="domain_name")
+		},
+		mailboxes={
+			email.lower(): email
+			for email in frappe.db.get_all("Mailbox", filters={"enabled": 1}, pluck="email")
+		},
+		aliases=aliases,
+	)